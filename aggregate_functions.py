@@ -0,0 +1,174 @@
+"""
+Author: Siebrant Hendriks.
+
+Supplementary script for summarizing the yearly results of many replicates
+
+Every finished replicate gets folded into running moments and a quantile
+sketch of every year and statistics column, after which it can be dropped. The
+sketch keeps a few levels of a fixed amount of sorted samples, where a sample
+at level i stands for 2 ** i replicates, and halves a level into the next
+whenever it fills up. As every replicate has a value for every year and
+column, all (year, column) cells fill up at the same time and get compacted in
+a single array operation. Summaries of different replicates, e.g. made in
+different worker processes, merge into the summary of all of them, so the
+memory needed does not grow with the amount of replicates (other than the
+few extra levels).
+"""
+import numpy as np
+
+# Samples kept per level of a quantile sketch, more gives more precise
+# quantiles. Up to this amount of replicates the quantiles are exact.
+SKETCH_SIZE = 200
+# Quantiles reported of every year and column.
+QUANTILES = [0.05, 0.5, 0.95]
+
+
+class YearlySummary:
+    """
+    Yearly summary keeps running statistics of the results of replicates.
+
+    Attribues:
+    ----------
+    count : int
+        Amount of replicates summarized.
+    mean : np.ndarray
+        (years x columns) mean of every year and column.
+    squares : np.ndarray
+        (years x columns) sum of the squared deviations from the mean.
+    levels : list
+        (years x columns x samples) sorted samples of every level of the
+        quantile sketch, a sample at level i stands for 2 ** i replicates.
+    halvings : list
+        Amount of times every level was halved, which decides if the even
+        or the odd samples move on.
+    """
+
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.squares = np.zeros(shape)
+        self.levels = [np.zeros((*shape, 0))]
+        self.halvings = [0]
+
+    def add(self, values):
+        """
+        Fold the results of a replicate into the summary.
+
+        Parameters
+        ----------
+        values : np.ndarray
+            (years x columns) results of the replicate.
+
+        Returns
+        -------
+        None.
+        """
+        self.count += 1
+        deviation = values - self.mean
+        self.mean += deviation / self.count
+        self.squares += deviation * (values - self.mean)
+        self.levels[0] = np.concatenate([self.levels[0], values[..., None]],
+                                        axis=-1)
+        self.compact()
+
+    def merge(self, other):
+        """
+        Fold the summary of other replicates into this summary.
+
+        Parameters
+        ----------
+        other : YearlySummary
+            Summary of other replicates, of the same years and columns.
+
+        Returns
+        -------
+        None.
+        """
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        deviation = other.mean - self.mean
+        self.squares += other.squares +\
+            deviation ** 2 * self.count * other.count / count
+        self.mean += deviation * other.count / count
+        self.count = count
+        for level, samples in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(samples[..., :0])
+                self.halvings.append(0)
+            self.levels[level] = np.concatenate([self.levels[level], samples],
+                                                axis=-1)
+        self.compact()
+
+    def compact(self):
+        """
+        Halve every full level of the sketch into the next level.
+
+        The samples get sorted and every other one moves on, with double the
+        weight; alternately the even and the odd ones, so the sketch does not
+        lean to either side.
+
+        Returns
+        -------
+        None.
+        """
+        level = 0
+        while level < len(self.levels):
+            samples = self.levels[level]
+            if samples.shape[-1] >= SKETCH_SIZE:
+                samples = np.sort(samples, axis=-1)
+                paired = samples.shape[-1] // 2 * 2
+                offset = self.halvings[level] % 2
+                self.halvings[level] += 1
+                if level + 1 == len(self.levels):
+                    self.levels.append(samples[..., :0])
+                    self.halvings.append(0)
+                self.levels[level + 1] = np.concatenate(
+                    [self.levels[level + 1], samples[..., offset:paired:2]],
+                    axis=-1)
+                self.levels[level] = samples[..., paired:]
+            level += 1
+
+    def variance(self):
+        """
+        Get the sample variance of every year and column.
+
+        Returns
+        -------
+        np.ndarray
+            (years x columns) variance, NaN with less than two replicates.
+        """
+        if self.count < 2:
+            return np.full_like(self.mean, np.nan)
+        return self.squares / (self.count - 1)
+
+    def quantiles(self, probabilities=QUANTILES):
+        """
+        Estimate quantiles of every year and column from the sketch.
+
+        Parameters
+        ----------
+        probabilities : list, optional
+            Probabilities of the quantiles.
+
+        Returns
+        -------
+        np.ndarray
+            (probabilities x years x columns) smallest sample at or above
+            each probability of the replicates, NaN without replicates.
+        """
+        samples = np.concatenate(self.levels, axis=-1)
+        if samples.shape[-1] == 0:
+            return np.full((len(probabilities), *self.mean.shape), np.nan)
+        weights = np.concatenate([np.full(level.shape[-1], 2.0 ** index)
+                                  for index, level in enumerate(self.levels)])
+        order = np.argsort(samples, axis=-1)
+        samples = np.take_along_axis(samples, order, axis=-1)
+        ranks = np.cumsum(weights[order], axis=-1)
+        quantiles = []
+        for probability in probabilities:
+            found = (ranks < probability * ranks[..., -1:]).sum(axis=-1)
+            found = np.minimum(found, samples.shape[-1] - 1)
+            quantiles.append(np.take_along_axis(samples, found[..., None],
+                                                axis=-1)[..., 0])
+        return np.array(quantiles)
@@ -3,11 +3,123 @@ Author: Siebrant Hendriks.
 
 Supplementary script used for aging/reproduction and culling farm animals
 """
-from random import random
-from random import seed
 import numpy as np
 import global_data as gd
-seed('squire')  # set seed to make results reproducable
+import kernel_functions as kn
+import trace_functions as tr
+
+# Entropy of the seed sequence every run spawns its random streams from, to
+# make results reproducable.
+SEED = int.from_bytes(b'squire', 'big')
+
+# Subsystems drawing random numbers, each from its own stream.
+STREAMS = ['fertility', 'sex_ratio']
+
+# Random streams of the current run by subsystem, how the run was seeded as
+# (seed, replicate, antithetic), and whether it draws 1 - u for every u.
+streams = {}
+run_seed = None
+mirrored = False
+
+# Results columns a slaughtered animal adds its yields to.
+SLAUGHTER_YIELDS = ['revenue_balance_animal', 'food_energy_produced',
+                    'food_protein_produced', 'food_fat_produced']
+
+
+def seed_run(replicate=0, antithetic=False, seed=SEED):
+    """
+    Give the run its own random streams.
+
+    Every replicate gets its own child of the seed sequence, which is spawned
+    into a stream per subsystem. Runs thus never share a stream, and the same
+    replicate of two scenarios draws the same numbers for the same purpose
+    (common random numbers), which makes their differences far less noisy.
+    With antithetic pairing replicates 2k and 2k + 1 share a child, the
+    second drawing 1 - u for every u the first draws.
+
+    Parameters
+    ----------
+    replicate : int, optional
+        Number of the replicate run.
+    antithetic : bool, optional
+        Pair the replicates antithetically.
+    seed : int, optional
+        Entropy of the seed sequence.
+
+    Returns
+    -------
+    None;
+    The streams get set in global variables.
+
+    """
+    global streams, run_seed, mirrored
+    child = replicate // 2 if antithetic else replicate
+    sequence = np.random.SeedSequence(seed, spawn_key=(child,))
+    streams = {name: np.random.Generator(np.random.PCG64(stream))
+               for name, stream in zip(STREAMS,
+                                       sequence.spawn(len(STREAMS)))}
+    run_seed = (seed, replicate, antithetic)
+    mirrored = antithetic and replicate % 2 == 1
+
+
+def draw(name, size):
+    """
+    Draw uniform random numbers from the stream of a subsystem.
+
+    Parameters
+    ----------
+    name : str
+        Name of the subsystem, one of STREAMS.
+    size : int
+        Amount of numbers to draw.
+
+    Returns
+    -------
+    draws : np.ndarray
+        Numbers in [0, 1), or in (0, 1] for the second of an antithetic pair.
+
+    """
+    draws = streams[name].random(size)
+    if mirrored:
+        draws = 1 - draws
+    return draws
+
+
+def get_random_state():
+    """
+    Get the state of the random streams, to continue them later on.
+
+    Returns
+    -------
+    dict
+        How the run was seeded and the state of every stream.
+
+    """
+    return {'run_seed': run_seed,
+            'streams': {name: stream.bit_generator.state
+                        for name, stream in streams.items()}}
+
+
+def set_random_state(state):
+    """
+    Continue the random streams from a state made by get_random_state.
+
+    Parameters
+    ----------
+    state : dict
+        How the run was seeded and the state of every stream.
+
+    Returns
+    -------
+    None.
+
+    """
+    seed_run(state['run_seed'][1], state['run_seed'][2], state['run_seed'][0])
+    for name, stream_state in state['streams'].items():
+        streams[name].bit_generator.state = stream_state
+
+
+seed_run()
 
 
 def apply_slaughter_yield(animal_label):
@@ -25,6 +137,7 @@ def apply_slaughter_yield(animal_label):
     Yields get added to global variables.
 
     """
+    gd.slaughter_count[animal_label] += 1
     meat_yield = gd.animal_data['slaughter_meat_yield'].loc[animal_label]
     meat_value = gd.animal_data['meat_sale_value'].loc[animal_label]
     diet_engergy = gd.estate_values['meat_diet_energy_content']
@@ -40,6 +153,64 @@ def apply_slaughter_yield(animal_label):
         diet_fat
 
 
+def age_herd_compiled(animals_on_farm):
+    """
+    Age the herd by one year using the compiled kernel.
+
+    Parameters
+    ----------
+    animals_on_farm : pd.Series
+        Keeps track of which animals are on the farm and in what amount they
+        are present.
+
+    Returns
+    -------
+    None;
+    Passed variable gets altered in place.
+
+    """
+    positions = animals_on_farm.index.get_indexer
+    herd = animals_on_farm.to_numpy().copy()
+    fertility_draws = draw('fertility', len(gd.female_labs))
+    sex_draws = draw('sex_ratio', len(gd.female_labs))
+    male_ratio = gd.estate_values['female_ratio'] /\
+        gd.estate_values['male_ratio']
+    meat_yield = gd.animal_data['slaughter_meat_yield'].loc[
+        animals_on_farm.index].to_numpy(dtype='float')
+    meat_value = gd.animal_data['meat_sale_value'].loc[
+        animals_on_farm.index].to_numpy(dtype='float')
+    head_yields = np.column_stack([
+        meat_yield * meat_value,
+        meat_yield * gd.estate_values['meat_diet_energy_content'],
+        meat_yield * gd.estate_values['meat_diet_protein_content'],
+        meat_yield * gd.estate_values['meat_diet_fat_content']])
+    row = f'year_{gd.year}'
+    totals = gd.results.loc[row, SLAUGHTER_YIELDS].to_numpy(dtype='float')
+    slaughtered = np.zeros((len(kn.SLAUGHTER_REASONS), len(herd)),
+                           dtype='int64')
+    fertility = gd.animal_data['fertility_rate'].loc[animals_on_farm.index]
+    kn.age_herd(herd, positions(gd.castrated_labs), positions(gd.female_labs),
+                positions(gd.male_labs[:-1]),
+                fertility.to_numpy(dtype='float'), fertility_draws, sex_draws,
+                male_ratio,
+                positions(['male_0_year', 'female_0_year', 'male_1_year',
+                           'male_castrated_1_year']),
+                head_yields, totals, slaughtered)
+    animals_on_farm[:] = herd
+    gd.slaughter_count += slaughtered.sum(axis=0)
+    gd.results.loc[row, SLAUGHTER_YIELDS] = totals.tolist()
+    if tr.tracing():
+        # Record the slaughter in the order age_herd does.
+        for labels, reason in [(gd.castrated_labs[:1], 'max_age'),
+                               (gd.female_labs[:1], 'max_age'),
+                               (gd.female_labs[1:], 'not_pregnant'),
+                               (gd.male_labs[:-1][:1], 'max_age'),
+                               (gd.male_labs[:-1], 'male_surplus')]:
+            counts = slaughtered[kn.SLAUGHTER_REASONS.index(reason)]
+            for label, amount in zip(labels, counts[positions(labels)]):
+                tr.record('slaughter', label, amount, reason=reason)
+
+
 def age_herd(animals_on_farm):
     """
     Age the herd by one year; slaughter expired and introduce newborns.
@@ -56,12 +227,19 @@ def age_herd(animals_on_farm):
     Passed variable gets altered in place.
 
     """
+    if kn.use_jit:
+        age_herd_compiled(animals_on_farm)
+        return
     newborn_male = 0
     newborn_female = 0
+    # One draw per female type from each stream, every year.
+    fertility_draws = draw('fertility', len(gd.female_labs))
+    sex_draws = draw('sex_ratio', len(gd.female_labs))
     # Slaughter max age castrated animals, and age non max age.
     for pos, label in enumerate(gd.castrated_labs):
         amount = animals_on_farm[label]
         if pos == 0:
+            tr.record('slaughter', label, amount, reason='max_age')
             for _ in range(amount):
                 apply_slaughter_yield(label)
         else:
@@ -73,8 +251,8 @@ def age_herd(animals_on_farm):
     # After max age is slaughtered, all other is aged.
     for pos, label in enumerate(gd.female_labs):
         fert = gd.animal_data['fertility_rate'].loc[label]
-        decider_1 = random()
-        decider_2 = random()
+        decider_1 = fertility_draws[pos]
+        decider_2 = sex_draws[pos]
         non_whole = animals_on_farm[label] * fert
         whole = np.floor(non_whole)
         rest = non_whole - whole
@@ -92,9 +270,12 @@ def age_herd(animals_on_farm):
             succes = animals_on_farm[label]
         fail = animals_on_farm[label] - succes
         if pos == 0:
+            tr.record('slaughter', label, animals_on_farm[label],
+                      reason='max_age')
             for _ in range(animals_on_farm[label]):
                 apply_slaughter_yield(label)
         else:
+            tr.record('slaughter', label, int(fail), reason='not_pregnant')
             for _ in range(int(fail)):
                 apply_slaughter_yield(label)
             label = gd.female_labs[pos - 1]
@@ -105,6 +286,7 @@ def age_herd(animals_on_farm):
     for pos, label in enumerate(gd.male_labs[:-1]):
         amount = animals_on_farm[label]
         if pos == 0:
+            tr.record('slaughter', label, amount, reason='max_age')
             for _ in range(amount):
                 apply_slaughter_yield(label)
         else:
@@ -117,12 +299,16 @@ def age_herd(animals_on_farm):
         gd.estate_values['male_ratio']
     male_limit = sum(animals_on_farm[gd.female_labs[:-1]]) / male_ratio
     males_present = sum(animals_on_farm[gd.male_labs[:-1]])
+    surplus = dict.fromkeys(gd.male_labs[:-1], 0)
     while males_present > male_limit:
         for label in gd.male_labs[:-1]:
             if animals_on_farm[label] > 0:
                 animals_on_farm[label] -= 1
+                surplus[label] += 1
                 apply_slaughter_yield(label)
         males_present = sum(animals_on_farm[gd.male_labs[:-1]])
+    for label, amount in surplus.items():
+        tr.record('slaughter', label, amount, reason='male_surplus')
     # Determine how many baby males are needed to replenish desired
     # fertile male amount. Remainder of baby males get castrated.
     males_to_add = 0
@@ -138,7 +324,7 @@ def age_herd(animals_on_farm):
     animals_on_farm['female_0_year'] = int(newborn_female)
 
 
-def reduce_animal(animals_on_farm):
+def reduce_animal(animals_on_farm, reason):
     """
     Remove the least wanted animal from the farm.
 
@@ -147,6 +333,8 @@ def reduce_animal(animals_on_farm):
     animals_on_farm : pd.Series
         Keeps track of which animals are on the farm and in what amount they
         are present.
+    reason : str
+        What the herd is reduced for: 'stocking', 'bedding' or 'feed'.
 
     Returns
     -------
@@ -173,6 +361,7 @@ def reduce_animal(animals_on_farm):
         if animals_on_farm[label] > 0:
             animals_on_farm[label] -= 1
             apply_slaughter_yield(label)
+            tr.record('cull', label, reason=reason)
             return
 
     # Second slaughter superfluous fertile males.
@@ -184,6 +373,7 @@ def reduce_animal(animals_on_farm):
             if animals_on_farm[label] > 0:
                 animals_on_farm[label] -= 1
                 apply_slaughter_yield(label)
+                tr.record('cull', label, reason=reason)
                 return
 
     # Third slaughter superfluous fertile femals.
@@ -195,6 +385,7 @@ def reduce_animal(animals_on_farm):
             if animals_on_farm[label] > 0:
                 animals_on_farm[label] -= 1
                 apply_slaughter_yield(label)
+                tr.record('cull', label, reason=reason)
                 return
 
     # When more newborn females are present than newborn males,
@@ -204,6 +395,7 @@ def reduce_animal(animals_on_farm):
         if animals_on_farm[label] > 0:
             animals_on_farm[label] -= 1
             apply_slaughter_yield(label)
+            tr.record('cull', label, reason=reason)
             return
 
     # When more newborn males are present then newborn females, and the herd
@@ -216,7 +408,9 @@ def reduce_animal(animals_on_farm):
         if ratio_current > ratio_want and animals_on_farm[label] > 0:
             animals_on_farm[label] -= 1
             apply_slaughter_yield(label)
+            tr.record('cull', label, reason=reason)
             return
 
     print('cannot reduce herd further')
+    tr.record('cull_failed', count=sum(animals_on_farm), reason=reason)
     return
@@ -3,52 +3,9 @@ Author: Siebrant Hendriks.
 
 Supplementary script for bioprocessor use
 """
-import pandas as pd
+import numpy as np
 import global_data as gd
-
-
-def biopro_no_mulch(harvest_stores):
-    """
-    Get crops from harvest_stores that can "only" be used for bioprocessor.
-
-    Parameters
-    ----------
-    harvest_stores : pd.Series
-        Contains all harvested crops and their stored amounts.
-
-    Returns
-    -------
-    bio_crops : pd.Series
-        Contains crops suitable for bioprocessor and their stored Kg amount.
-
-    """
-    bio_crops = harvest_stores.where(gd.plant_data['bioprocessor_use'] == True)
-    bio_crops = bio_crops.where(gd.plant_data['mulch_use'] == False)
-    bio_crops = bio_crops.where(bio_crops > 0)
-    bio_crops.dropna(inplace=True)
-    return bio_crops
-
-
-def biopro_with_mulch(harvest_stores):
-    """
-    Get crops that can be used either for mulch or bioprocessor.
-
-    Parameters
-    ----------
-    harvest_stores : pd.Series
-        Contains all harvested crops and their stored amounts.
-
-    Returns
-    -------
-    bio_crops : pd.Series
-        Contains crops suitable for bioprocessor and their stored Kg amount.
-
-    """
-    bio_crops = harvest_stores.where(gd.plant_data['bioprocessor_use'] == True)
-    bio_crops = bio_crops.where(gd.plant_data['mulch_use'] == True)
-    bio_crops = bio_crops.where(bio_crops > 0)
-    bio_crops.dropna(inplace=True)
-    return bio_crops
+import utility_functions as ul
 
 
 def get_deep_litter(animals_on_farm):
@@ -63,45 +20,50 @@ def get_deep_litter(animals_on_farm):
 
     Returns
     -------
-    deep_litter : pd.Series
+    deep_litter : float
         Kg amount of deep litter produced.
 
     """
     deep_litter = sum(animals_on_farm *
                       gd.animal_data['deep_litter_production'])
-    deep_litter = {'deep_litter': deep_litter}
-    deep_litter = pd.Series(deep_litter)
     return deep_litter
 
 
-def biopro_manure():
+def store_animal_matter(harvest_stores, animals_on_farm):
     """
-    Select imported manure suitable for the bioprocessor.
+    Put the imported manure and the deep litter of the herd in store.
+
+    Parameters
+    ----------
+    harvest_stores : stores_functions.HarvestStores
+        Keeps the Kg amount in store of every material.
+    animals_on_farm : pd.Series
+        Keeps track of which animals are on the farm and in what amount they
+        are present.
 
     Returns
     -------
-    bio_anim : pd.Series
-        Contains matter types suitable for bioprocessor and their Kg amount.
+    None;
+    The stores are altered in place.
 
     """
-    chicken_manure = gd.estate_values['import_chicken_manure']
-    horse_manure = gd.estate_values['import_horse_manure']
-    bio_anim = {'chicken_manure': chicken_manure, 'horse_manure': horse_manure}
-    bio_anim = pd.Series(bio_anim)
-    return bio_anim
+    for manure in ['chicken_manure', 'horse_manure']:
+        harvest_stores.deposit(manure,
+                               gd.estate_values[f'import_{manure}'])
+    harvest_stores.deposit('deep_litter', get_deep_litter(animals_on_farm))
 
 
-def biopro_all(harvest_stores, animals_on_farm):
+def biopro_all(harvest_stores):
     """
     Get all matter suitable for bioprocessor in order of preferred use.
 
+    That is the imported manure, the crops only fit for the bioprocessor,
+    the deep litter and then the crops that could be used as mulch as well.
+
     Parameters
     ----------
     harvest_stores : pd.Series
-        Contains all harvested crops and their stored amounts.
-    animals_on_farm : pd.Series
-        Keeps track of which animals are on the farm and in what amount they
-        are present.
+        Kg amount in store of every material in the material registry.
 
     Returns
     -------
@@ -110,13 +72,16 @@ def biopro_all(harvest_stores, animals_on_farm):
         Series is ordered to have preferred matter appear first.
 
     """
-    biopro_available = biopro_manure()
-    biopro_available = pd.concat([biopro_available,
-                                  biopro_no_mulch(harvest_stores)])
-    biopro_available = pd.concat([biopro_available,
-                                 get_deep_litter(animals_on_farm)])
-    biopro_available = pd.concat([biopro_available,
-                                  biopro_with_mulch(harvest_stores)])
+    uses = gd.material_uses
+    bio_crops = uses['bioprocessor_use'].to_numpy() &\
+        (harvest_stores.to_numpy() > 0)
+    mulch_use = uses['mulch_use'].to_numpy()
+    positions = np.concatenate([
+        gd.materials.get_indexer(['chicken_manure', 'horse_manure']),
+        np.flatnonzero(bio_crops & ~mulch_use),
+        [gd.materials.get_loc('deep_litter')],
+        np.flatnonzero(bio_crops & mulch_use)])
+    biopro_available = harvest_stores.iloc[positions]
     return biopro_available
 
 
@@ -138,38 +103,7 @@ def biopro_to_use(bio_available):
 
     """
     digest_max = gd.estate_values['maximum_digestate_spreadable']
-    to_use = pd.Series(0.0, index=bio_available.index)
-    for label, amount in bio_available.items():
-        digest_yield = amount * gd.biodigestor_data['digestate'].loc[label]
-        if digest_yield > digest_max:
-            amount = digest_max / gd.biodigestor_data['digestate'].loc[label]
-        to_use[label] = amount
-        digest_max -= amount * gd.biodigestor_data['digestate'].loc[label]
-        if digest_max <= 0:
-            break
+    digest_yield = gd.biodigestor_data['digestate'].loc[bio_available.index]
+    to_use, _ = ul.allocate(bio_available, digest_max,
+                            digest_yield.to_numpy(dtype='float'))
     return to_use
-
-
-def make_biopro_products(bio_input):
-    """
-    Apply all product yields generated by bioprocessor.
-
-    Parameters
-    ----------
-    bio_input : pd.Series
-        Contains matter types suitable for bioprocessor and their Kg amount
-        that will be used by the bioprocessor.
-
-    Returns
-    -------
-    None;
-    All yields are added to global variables.
-
-    """
-    for label, amount in bio_input.items():
-        digestate = gd.biodigestor_data['digestate'].loc[label] * amount
-        electricity = gd.biodigestor_data['electricity'].loc[label] * amount
-        methane = gd.biodigestor_data['biomethane'].loc[label] * amount
-        gd.results['digestate_produced'].loc[f'year_{gd.year}'] += digestate
-        gd.results['electricity_balance'].loc[f'year_{gd.year}'] += electricity
-        gd.results['biomethane_produced'].loc[f'year_{gd.year}'] += methane
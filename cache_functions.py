@@ -0,0 +1,251 @@
+"""
+Author: Siebrant Hendriks.
+
+Supplementary script for keeping finished runs in an on-disk result cache
+
+Every run is stored under a hash of everything its outcome depends on: the
+input data, the random seed, the runtime and the version of the simulation.
+Identical runs, by any runner and from any process, are thus only simulated
+once. Entries are written atomically, so several processes can share a cache
+directory, and the least recently used entries are removed when the cache
+grows beyond its size limit.
+"""
+import os
+import hashlib
+import pickle
+import zlib
+import pandas as pd
+import global_data as gd
+import utility_functions as ul
+import animal_lifecycle_functions as al
+import checkpoint_functions as cp
+
+# Raise when a change to the simulation changes its results, so runs cached
+# by an older version are no longer used.
+ENGINE_VERSION = 2
+
+# Size limit of the cache in MB, when none is given.
+DEFAULT_CACHE_SIZE = 1024
+
+# Results and reports of a run stored in the cache, by global variable.
+CACHED_DATA = ['year', 'results', 'herd_results', 'feed_used', 'bedding_used',
+               'crops_sold', 'digestor_used', 'mulch_used', 'herd_year_end',
+               'animals_slaughtered']
+
+# Directory of the cache and its size limit in bytes, None disables caching.
+cache_dir = None
+max_bytes = DEFAULT_CACHE_SIZE * 2 ** 20
+
+
+def use_cache(directory, size=DEFAULT_CACHE_SIZE):
+    """
+    Set the result cache runs are looked up in and stored to.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the cache, None disables caching.
+    size : float, optional
+        Size limit of the cache in MB.
+
+    Returns
+    -------
+    None.
+
+    """
+    global cache_dir, max_bytes
+    cache_dir = directory
+    max_bytes = size * 2 ** 20
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+def normalize_sheet(sheet):
+    """
+    Make the values of a sheet compare equal regardless of how they were read.
+
+    Columns holding only numbers become float, so e.g. a runtime of 30 read
+    from a workbook and one of 30.0 set by an override give the same key.
+
+    Parameters
+    ----------
+    sheet : pd.DataFrame
+        Any input sheet.
+
+    Returns
+    -------
+    sheet : pd.DataFrame
+        Normalized copy of the sheet.
+
+    """
+    sheet = sheet.copy()
+    for column in sheet.columns:
+        numbers = pd.to_numeric(sheet[column], errors='coerce')
+        if numbers.notna().sum() == sheet[column].notna().sum():
+            sheet[column] = numbers.astype('float')
+    return sheet
+
+
+def run_key(input_sheets=None):
+    """
+    Make the key a run is cached under.
+
+    Parameters
+    ----------
+    input_sheets : dict, optional
+        Contains the estate, crops, animal and biodigestor sheets of the run.
+        Defaults to the input sheets currently loaded.
+
+    Returns
+    -------
+    key : str
+        Hexadecimal sha256 digest of the normalized input data, the seed and
+        replicate of the random streams, runtime and engine version.
+
+    """
+    if input_sheets is None:
+        input_sheets = gd.get_input_sheets()
+    normalized = {name: normalize_sheet(sheet)
+                  for name, sheet in input_sheets.items()}
+    runtime = gd.get_input_value(input_sheets, 'estate:runtime')
+    digest = hashlib.sha256()
+    digest.update(f'{ENGINE_VERSION}:{al.run_seed}:{runtime}:'.encode())
+    digest.update(cp.input_fingerprint(normalized).encode())
+    key = digest.hexdigest()
+    return key
+
+
+def entry_path(key):
+    """
+    Get the file a run is cached in.
+
+    Parameters
+    ----------
+    key : str
+        Key of the run.
+
+    Returns
+    -------
+    str
+        Name of the cache entry.
+
+    """
+    return os.path.join(cache_dir, f'{key}.run')
+
+
+def cached(key):
+    """
+    Check if a run is in the cache.
+
+    Parameters
+    ----------
+    key : str
+        Key of the run.
+
+    Returns
+    -------
+    bool
+        True if the run is cached, False if not or caching is disabled.
+
+    """
+    return bool(cache_dir) and os.path.exists(entry_path(key))
+
+
+def load_run():
+    """
+    Take the run of the currently loaded input data from the cache.
+
+    Returns
+    -------
+    animals_on_farm : pd.Series
+        Herd at the end of the run, None if the run is not cached or caching
+        is disabled. The results and reports get restored into global
+        variables.
+
+    """
+    if not cache_dir:
+        return None
+    path = entry_path(run_key())
+    try:
+        with open(path, 'rb') as entry_file:
+            entry = pickle.loads(zlib.decompress(entry_file.read()))
+        # Mark the entry as recently used.
+        os.utime(path)
+    except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+        return None
+    for name in CACHED_DATA:
+        setattr(gd, name, entry[name])
+    return entry['animals_on_farm']
+
+
+def save_run(animals_on_farm):
+    """
+    Store the finished run of the currently loaded input data in the cache.
+
+    Parameters
+    ----------
+    animals_on_farm : pd.Series
+        Herd at the end of the run.
+
+    Returns
+    -------
+    None;
+    Nothing is stored when caching is disabled.
+
+    """
+    if not cache_dir:
+        return
+    entry = {name: getattr(gd, name) for name in CACHED_DATA}
+    entry['animals_on_farm'] = animals_on_farm
+    data = zlib.compress(pickle.dumps(entry, pickle.HIGHEST_PROTOCOL))
+    ul.write_atomic(entry_path(run_key()), data)
+    evict()
+
+
+def evict():
+    """
+    Remove the least recently used entries until the cache fits its limit.
+
+    Returns
+    -------
+    None.
+
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.run'):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Removed by another process at the same time.
+            pass
+        total -= size
+
+
+def report_hits(hits, runs):
+    """
+    Print how many runs were found in the cache.
+
+    Parameters
+    ----------
+    hits : int
+        Amount of runs found in the cache.
+    runs : int
+        Amount of runs looked up.
+
+    Returns
+    -------
+    None.
+
+    """
+    rate = hits / runs if runs else 0.0
+    print(f'result cache: {hits} of {runs} runs found ({rate:.0%})')
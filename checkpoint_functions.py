@@ -0,0 +1,214 @@
+"""
+Author: Siebrant Hendriks.
+
+Supplementary script for saving and resuming the simulation state
+"""
+import hashlib
+import pickle
+import time
+import zlib
+import pandas as pd
+import global_data as gd
+import utility_functions as ul
+import animal_lifecycle_functions as al
+
+CHECKPOINT_VERSION = 4
+
+
+def input_fingerprint(input_sheets=None):
+    """
+    Make a fingerprint of the input data the simulation is running on.
+
+    Parameters
+    ----------
+    input_sheets : dict, optional
+        Contains the estate, crops, animal and biodigestor sheets as they are
+        in the input file. Defaults to the input sheets currently loaded.
+
+    Returns
+    -------
+    fingerprint : str
+        Hexadecimal sha256 digest of all four (unformatted) input sheets.
+
+    """
+    if input_sheets is None:
+        input_sheets = gd.get_input_sheets()
+    digest = hashlib.sha256()
+    for sheet in input_sheets.values():
+        digest.update(' '.join(map(str, sheet.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(sheet, index=True).values)
+    fingerprint = digest.hexdigest()
+    return fingerprint
+
+
+def mk_state(animals_on_farm):
+    """
+    Collect everything needed to continue the simulation after this year.
+
+    Parameters
+    ----------
+    animals_on_farm : pd.Series
+        Keeps track of which animals are on the farm and in what amount they
+        are present.
+
+    Returns
+    -------
+    state : dict
+        Contains the herd, the year, all results and reports gathered so far
+        and the state of the random streams.
+
+    """
+    state = {'version': CHECKPOINT_VERSION,
+             'fingerprint': input_fingerprint(),
+             'year': gd.year,
+             'animals_on_farm': animals_on_farm,
+             'fertile_molecules': gd.fertile_molecules,
+             'results': gd.results,
+             'herd_results': gd.herd_results,
+             'feed_used': gd.feed_used,
+             'bedding_used': gd.bedding_used,
+             'crops_sold': gd.crops_sold,
+             'digestor_used': gd.digestor_used,
+             'mulch_used': gd.mulch_used,
+             'report_order': gd.report_order,
+             'slaughter_count': gd.slaughter_count,
+             'herd_year_end': gd.herd_year_end,
+             'animals_slaughtered': gd.animals_slaughtered,
+             'random_state': al.get_random_state()}
+    return state
+
+
+def save_checkpoint(path, animals_on_farm):
+    """
+    Atomically write the current simulation state to a checkpoint file.
+
+    Parameters
+    ----------
+    path : str
+        Name of the checkpoint file to write.
+    animals_on_farm : pd.Series
+        Keeps track of which animals are on the farm and in what amount they
+        are present.
+
+    Returns
+    -------
+    None.
+
+    """
+    state = mk_state(animals_on_farm)
+    data = zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+    ul.write_atomic(path, data)
+
+
+def load_checkpoint(path):
+    """
+    Restore the simulation state from a checkpoint file.
+
+    Parameters
+    ----------
+    path : str
+        Name of the checkpoint file to read.
+
+    Raises
+    ------
+    ValueError
+        When the checkpoint was made with a different version or from
+        different input data than is currently loaded.
+
+    Returns
+    -------
+    animals_on_farm : pd.Series
+        Herd as it was on the farm at the end of the checkpointed year.
+        All other state gets restored into global variables.
+
+    """
+    with open(path, 'rb') as checkpoint_file:
+        state = pickle.loads(zlib.decompress(checkpoint_file.read()))
+    if state['version'] != CHECKPOINT_VERSION:
+        raise ValueError(f'checkpoint {path} has unsupported version '
+                         f'{state["version"]}')
+    if state['fingerprint'] != input_fingerprint():
+        raise ValueError(f'checkpoint {path} was made from other input data '
+                         f'than {gd.FILENAME}')
+    gd.year = state['year']
+    gd.fertile_molecules = state['fertile_molecules']
+    gd.results = state['results']
+    gd.herd_results = state['herd_results']
+    gd.feed_used = state['feed_used']
+    gd.bedding_used = state['bedding_used']
+    gd.crops_sold = state['crops_sold']
+    gd.digestor_used = state['digestor_used']
+    gd.mulch_used = state['mulch_used']
+    gd.report_order = state['report_order']
+    gd.slaughter_count = state['slaughter_count']
+    gd.herd_year_end = state['herd_year_end']
+    gd.animals_slaughtered = state['animals_slaughtered']
+    al.set_random_state(state['random_state'])
+    gd.animals_on_farm = state['animals_on_farm']
+    return gd.animals_on_farm
+
+
+class Checkpointer:
+    """
+    Checkpointer decides when the simulation state gets saved to disk.
+
+    Attribues:
+    ----------
+    path : str
+        Name of the checkpoint file, None disables checkpointing.
+    every_years : int
+        Amount of simulated years between checkpoints, 0 disables.
+    every_seconds : float
+        Amount of seconds between checkpoints, 0 disables.
+    last_year : int
+        Last year that was completed when the previous checkpoint was made.
+    last_time : float
+        Moment at which the last checkpoint was made.
+    """
+
+    def __init__(self, path, every_years=0, every_seconds=0.0, last_year=0):
+        self.path = path
+        self.every_years = every_years
+        self.every_seconds = every_seconds
+        if path and not every_years and not every_seconds:
+            self.every_years = 1
+        self.last_year = last_year
+        self.last_time = time.monotonic()
+
+    def due(self):
+        """
+        Check if a new checkpoint should be made.
+
+        Returns
+        -------
+        bool
+            True if the year or time interval has passed, False if not.
+        """
+        if not self.path:
+            return False
+        if self.every_years and gd.year - self.last_year >= self.every_years:
+            return True
+        if self.every_seconds and\
+                time.monotonic() - self.last_time >= self.every_seconds:
+            return True
+        return False
+
+    def update(self, animals_on_farm):
+        """
+        Save a checkpoint at the end of a year if one is due.
+
+        Parameters
+        ----------
+        animals_on_farm : pd.Series
+            Keeps track of which animals are on the farm and in what amount
+            they are present.
+
+        Returns
+        -------
+        None.
+        """
+        if not self.due():
+            return
+        save_checkpoint(self.path, animals_on_farm)
+        self.last_year = gd.year
+        self.last_time = time.monotonic()
@@ -0,0 +1,210 @@
+"""
+Author: Siebrant Hendriks.
+
+Supplementary script for keeping the replicates of an ensemble on disk
+
+The statistics and herds of every replicate of a scenario are kept in two
+memory-mapped numpy arrays, (replicate x year x statistics column) and
+(replicate x year x animal type), allocated once for the whole replicate
+budget. Worker processes write the replicates they simulate straight into
+their own slices of the arrays, so no results are sent back to the parent and
+no more than one replicate is held in memory at a time. The arrays are .npy
+files next to a small json file with their labels and units, so they can be
+opened lazily with numpy.load(file, mmap_mode='r') for analysis afterwards.
+"""
+import os
+import json
+import numpy as np
+import global_data as gd
+import utility_functions as ul
+
+METADATA_FILE = 'metadata.json'
+# Array files of a store, with their dimensions and data type.
+STORE_ARRAYS = {'statistics': (['replicate', 'year', 'metric'], 'float64'),
+                'herds': (['replicate', 'year', 'cohort'], 'int32')}
+HERD_UNIT = 'animals'
+
+# Arrays of the stores by scenario, in a worker process.
+open_stores = {}
+
+
+def create_store(directory, capacity, input_file, seeding):
+    """
+    Allocate the store of a scenario, for the input sheets currently loaded.
+
+    Statistics of replicates not simulated (yet) are NaN, their herds 0.
+
+    Parameters
+    ----------
+    directory : str
+        Directory the store is made in, any store there is replaced.
+    capacity : int
+        Amount of replicates the store can hold.
+    input_file : str
+        Name of the input file of the scenario.
+    seeding : tuple
+        Whether replicates are paired antithetically, and the seed.
+
+    Returns
+    -------
+    None.
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    runtime = int(gd.estate_values['runtime'])
+    metadata = {'input_file': input_file, 'replicates': 0,
+                'capacity': capacity, 'antithetic': seeding[0],
+                'seed': seeding[1],
+                'years': [f'year_{year}' for year in range(1, runtime + 1)],
+                'metrics': list(gd.results.columns),
+                'units': list(gd.results.loc['unit']),
+                'cohorts': list(gd.initial_herd.index),
+                'cohort_unit': HERD_UNIT,
+                'arrays': {}}
+    for name, (dimensions, dtype) in STORE_ARRAYS.items():
+        shape = (capacity, runtime, len(metadata[dimensions[2] + 's']))
+        array = np.lib.format.open_memmap(os.path.join(directory,
+                                                       f'{name}.npy'),
+                                          mode='w+', dtype=dtype, shape=shape)
+        if dtype == 'float64':
+            array[:] = np.nan
+        array.flush()
+        del array
+        metadata['arrays'][name] = {'file': f'{name}.npy',
+                                    'dimensions': dimensions,
+                                    'dtype': dtype}
+    write_metadata(directory, metadata)
+
+
+def write_metadata(directory, metadata):
+    """
+    Write the metadata of a store.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the store.
+    metadata : dict
+        Labels, units and settings of the store.
+
+    Returns
+    -------
+    None.
+
+    """
+    ul.write_atomic(os.path.join(directory, METADATA_FILE),
+                    json.dumps(metadata, indent=1).encode())
+
+
+def read_metadata(directory):
+    """
+    Read the metadata of a store.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the store.
+
+    Returns
+    -------
+    metadata : dict
+        Labels, units and settings of the store.
+
+    """
+    with open(os.path.join(directory, METADATA_FILE)) as metadata_file:
+        metadata = json.load(metadata_file)
+    return metadata
+
+
+def count_replicates(directory, replicates):
+    """
+    Record how many replicates a store holds.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the store.
+    replicates : int
+        Amount of replicates written, the first ones of the store.
+
+    Returns
+    -------
+    None.
+
+    """
+    metadata = read_metadata(directory)
+    metadata['replicates'] = replicates
+    write_metadata(directory, metadata)
+
+
+def open_store(directory, mode='r'):
+    """
+    Open the arrays of a store without reading them into memory.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the store.
+    mode : str, optional
+        'r' to read the arrays, 'r+' to write into them as well.
+
+    Returns
+    -------
+    arrays : dict
+        Memory-mapped array by name, see STORE_ARRAYS.
+
+    """
+    arrays = {name: np.load(os.path.join(directory, f'{name}.npy'),
+                            mmap_mode=mode)
+              for name in STORE_ARRAYS}
+    return arrays
+
+
+def use_stores(directories):
+    """
+    Open the stores of all scenarios for writing, in a worker process.
+
+    Parameters
+    ----------
+    directories : list
+        Directory of the store of every scenario, empty without stores.
+
+    Returns
+    -------
+    None.
+
+    """
+    global open_stores
+    open_stores = {scenario: open_store(directory, 'r+')
+                   for scenario, directory in enumerate(directories)}
+
+
+def write_replicate(scenario, replicate, results, herd_results):
+    """
+    Write the results of a replicate into its slices of the store.
+
+    The arrays are shared with every process that opened them, so the parent
+    sees the slices as soon as they are written.
+
+    Parameters
+    ----------
+    scenario : int
+        Index of the scenario.
+    replicate : int
+        Number of the replicate.
+    results : pd.DataFrame
+        The statistics of every year simulated.
+    herd_results : pd.DataFrame
+        The herd at the end of every year simulated.
+
+    Returns
+    -------
+    None.
+
+    """
+    arrays = open_stores[scenario]
+    years = len(results)
+    arrays['statistics'][replicate, :years] = results.to_numpy(
+        dtype='float64')
+    arrays['herds'][replicate, :years] = herd_results.iloc[:years].to_numpy(
+        dtype='int32')
@@ -0,0 +1,238 @@
+"""
+Author: Siebrant Hendriks.
+
+Supplementary script for writing the results workbook
+
+The sheets are streamed to the workbook row by row, straight from the result
+arrays when the reports were not turned into dataframes, so writing takes
+about the same memory for any runtime. xlsxwriter is used in its
+constant_memory mode when it is installed, otherwise openpyxl in its write_only
+mode. Sheet names and layout are those of pd.DataFrame.to_excel.
+"""
+import math
+import numpy as np
+import pandas as pd
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+import global_data as gd
+import utility_functions as ul
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+# Sheets of the results workbook with the reports shown in them, in order.
+REPORT_SHEETS = [('feed use(Kg)', 'feed_used'),
+                 ('bedding use(Kg)', 'bedding_used'),
+                 ('crops sold(Kg)', 'crops_sold'),
+                 ('biodigestor inputs(Kg)', 'digestor_used'),
+                 ('mulch applied(Kg)', 'mulch_used')]
+
+
+def cell_value(value):
+    """
+    Convert a value to what gets written in its cell.
+
+    Parameters
+    ----------
+    value : object
+        Any value of a result or input sheet.
+
+    Returns
+    -------
+    object
+        Python equivalent of the value, an empty string for NaN as written
+        by pd.DataFrame.to_excel.
+
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ''
+        if math.isinf(value):
+            return 'inf' if value > 0 else '-inf'
+    return value
+
+
+def frame_sheet(frame):
+    """
+    Lay out a dataframe as a sheet.
+
+    Parameters
+    ----------
+    frame : pd.DataFrame
+        Any dataframe.
+
+    Returns
+    -------
+    header : list
+        Index name followed by the column labels.
+    rows : generator
+        (row label, row values) of every row.
+
+    """
+    header = [frame.index.name, *frame.columns]
+    rows = zip(frame.index, frame.itertuples(index=False, name=None))
+    return header, rows
+
+
+def herd_sheet():
+    """
+    Lay out the herd of every year as a sheet.
+
+    Returns
+    -------
+    header : list
+        Index name followed by the column labels.
+    rows : generator
+        (row label, row values) of every row.
+
+    """
+    if isinstance(gd.herd_results, pd.DataFrame):
+        return frame_sheet(gd.herd_results)
+    header = [None, *gd.herd_results[0].index]
+    rows = ((herd.name, herd.to_numpy()) for herd in gd.herd_results)
+    return header, rows
+
+
+def report_sheet(name):
+    """
+    Lay out a report as a sheet.
+
+    Parameters
+    ----------
+    name : str
+        Name of the report, as in gd.report_order.
+
+    Returns
+    -------
+    header : list
+        Index name followed by the column labels.
+    rows : generator
+        (row label, row values) of every row.
+
+    """
+    report = getattr(gd, name)
+    if isinstance(report, pd.DataFrame):
+        return frame_sheet(report)
+    positions = ul.report_positions(name)
+    header = [None, *gd.materials[positions]]
+    rows = ((label, ul.report_values(name, year, positions))
+            for year, label in enumerate(ul.report_labels()))
+    return header, rows
+
+
+def mk_sheets():
+    """
+    Lay out all sheets of the results workbook.
+
+    Returns
+    -------
+    sheets : list
+        (sheet name, header, rows) of every sheet, in order.
+
+    """
+    sheets = [('statistics', *frame_sheet(gd.results)),
+              ('herd', *herd_sheet())]
+    for sheet_name, name in REPORT_SHEETS:
+        sheets.append((sheet_name, *report_sheet(name)))
+    sheets += [('estate', *frame_sheet(gd.estate_data_ori)),
+               ('crops', *frame_sheet(gd.plant_data_ori)),
+               ('animal', *frame_sheet(gd.animal_data_ori)),
+               ('biodigestor', *frame_sheet(gd.biodigestor_data_ori))]
+    return sheets
+
+
+def write_xlsxwriter(path, sheets):
+    """
+    Write sheets to a workbook using xlsxwriter in constant_memory mode.
+
+    Parameters
+    ----------
+    path : str
+        Name of the workbook to write.
+    sheets : list
+        (sheet name, header, rows) of every sheet, in order.
+
+    Returns
+    -------
+    None.
+
+    """
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    label_format = workbook.add_format({'bold': True, 'border': 1,
+                                        'align': 'center', 'valign': 'top'})
+    for sheet_name, header, rows in sheets:
+        worksheet = workbook.add_worksheet(sheet_name)
+        for col, label in enumerate(header):
+            if label is not None:
+                worksheet.write(0, col, cell_value(label), label_format)
+        for row, (label, values) in enumerate(rows, start=1):
+            worksheet.write(row, 0, cell_value(label), label_format)
+            for col, value in enumerate(values, start=1):
+                worksheet.write(row, col, cell_value(value))
+    workbook.close()
+
+
+def write_openpyxl(path, sheets):
+    """
+    Write sheets to a workbook using openpyxl in write_only mode.
+
+    Parameters
+    ----------
+    path : str
+        Name of the workbook to write.
+    sheets : list
+        (sheet name, header, rows) of every sheet, in order.
+
+    Returns
+    -------
+    None.
+
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    thin = Side(style='thin')
+    bold = Font(bold=True)
+    border = Border(left=thin, right=thin, top=thin, bottom=thin)
+    alignment = Alignment(horizontal='center', vertical='top')
+
+    def label_cell(worksheet, label):
+        if label is None:
+            return None
+        label = cell_value(label)
+        cell = WriteOnlyCell(worksheet, label)
+        cell.font = bold
+        cell.border = border
+        cell.alignment = alignment
+        return cell
+
+    for sheet_name, header, rows in sheets:
+        worksheet = workbook.create_sheet(sheet_name)
+        worksheet.append([label_cell(worksheet, label) for label in header])
+        for label, values in rows:
+            worksheet.append([label_cell(worksheet, label),
+                              *map(cell_value, values)])
+    workbook.save(path)
+
+
+def write_results(path):
+    """
+    Write the results and inputs of the run to a workbook.
+
+    Parameters
+    ----------
+    path : str
+        Name of the workbook to write.
+
+    Returns
+    -------
+    None.
+
+    """
+    if xlsxwriter is not None:
+        write_xlsxwriter(path, mk_sheets())
+    else:
+        write_openpyxl(path, mk_sheets())
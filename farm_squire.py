@@ -9,6 +9,8 @@ It is made to model Product yields that are common for beef farms.
 All the preset data relates to finnish beef farms.
 """
 import os
+import argparse
+import contextlib
 import datetime as dt
 import pandas as pd
 import global_data as gd
@@ -16,91 +18,178 @@ import feed_functions as fd
 import animal_lifecycle_functions as al
 import utility_functions as ul
 import bioprocessor_functions as bi
+import checkpoint_functions as cp
+import recompute_functions as rc
+import valuation_functions as vl
+import flow_functions as fl
+import stores_functions as st
+import export_functions as ex
+import cache_functions as cr
+import monthly_functions as mo
+import kernel_functions as kn
+import trace_functions as tr
 
-# Core loop implemented as 'do while' each run accounts for one year of
-# operations.
-if __name__ == '__main__':
-    print('simulating...')
-    harvest_stores = gd.harvest_yield.copy()
+
+def parse_arguments():
+    """
+    Read the command line options.
+
+    Returns
+    -------
+    args : argparse.Namespace
+        Contains the input file name and all optional settings given.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='Model nutrient flows and yearly operations on farms.')
+    parser.add_argument('input_file', nargs='?', default=gd.FILENAME,
+                        help='input workbook')
+    parser.add_argument('--checkpoint', metavar='FILE',
+                        help='periodically save the simulation state to FILE')
+    parser.add_argument('--checkpoint-years', type=int, default=0,
+                        metavar='N', help='checkpoint every N years')
+    parser.add_argument('--checkpoint-seconds', type=float, default=0.0,
+                        metavar='M', help='checkpoint every M seconds')
+    parser.add_argument('--resume', metavar='FILE',
+                        help='continue the simulation saved in FILE')
+    parser.add_argument('--trajectory', metavar='FILE',
+                        help='reuse the run saved in FILE when only prices, '
+                        'costs or contents changed, and save this run to it')
+    parser.add_argument('--price-scenarios', metavar='FILE',
+                        help='value the run against the price scenarios in '
+                        'csv FILE')
+    parser.add_argument('--flows', metavar='FILE',
+                        help='write the yearly material flows to csv FILE')
+    parser.add_argument('--monthly', metavar='FILE',
+                        help='write an estimated monthly split of the yearly '
+                        'feed, manure and digestate to csv FILE')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='record the herd and feed decisions and write '
+                        'them to FILE, as JSON lines or .npz')
+    parser.add_argument('--trace-size', type=int,
+                        default=tr.DEFAULT_TRACE_SIZE, metavar='N',
+                        help='amount of most recent events kept in the trace')
+    parser.add_argument('--seed', type=int, default=al.SEED,
+                        help='seed the random streams of runs spawn from')
+    parser.add_argument('--replicate', type=int, default=0, metavar='K',
+                        help='simulate replicate K, each replicate draws its '
+                        'own random numbers')
+    parser.add_argument('--antithetic', action='store_true',
+                        help='pair replicates antithetically, odd replicates '
+                        'mirror the random numbers of the one before')
+    parser.add_argument('--no-jit', action='store_true',
+                        help='run the Python code even when Numba is '
+                        'installed')
+    parser.add_argument('--result-cache', metavar='DIR',
+                        help='take the run from the result cache in DIR if '
+                        'it was simulated before, and store it there')
+    parser.add_argument('--result-cache-size', type=float,
+                        default=cr.DEFAULT_CACHE_SIZE, metavar='MB',
+                        help='size limit of the result cache')
+    args = parser.parse_args()
+    return args
+
+
+def run_year(animals_on_farm, harvest_stores):
+    """
+    Run all operations on the farm for the current year.
+
+    Parameters
+    ----------
+    animals_on_farm : pd.Series
+        Keeps track of which animals are on the farm and in what amount they
+        are present.
+    harvest_stores : stores_functions.HarvestStores
+        Keeps the Kg amount in store of every material.
+
+    Returns
+    -------
+    None;
+    Passed variables get altered in place and results get added to global
+    variables.
+
+    """
+    harvest_stores.restock()
     ul.apply_crop_balance()
-    animals_on_farm = gd.animals_on_farm
-    ul.fixate_fm(harvest_stores)
-    bedding = ul.assign_bedding(harvest_stores, animals_on_farm)
+    fl.book('harvest', harvest_stores.stock)
+    bedding = ul.assign_bedding(harvest_stores.stock, animals_on_farm)
     ul.report_bedding(bedding)
-    harvest_stores = harvest_stores.sub(bedding, fill_value=0.0)
-    harvest_stores = harvest_stores.reindex_like(gd.harvest_yield)
+    fl.book('bedding', bedding)
+    harvest_stores.withdraw('bedding', bedding)
     # reclaim bedding if herd gets reduced during feeding?
     feed = fd.feed_animals(harvest_stores, animals_on_farm)
     ul.report_feed(feed)
-    harvest_stores -= feed
+    fl.book('feed', feed)
     ul.apply_digestion_methane_emission(animals_on_farm)
     manure = animals_on_farm * gd.animal_data['manure_pasture_production']
-    ul.apply_manure(manure)
-    biomatter_available = bi.biopro_all(harvest_stores, animals_on_farm)
+    fl.book('manure', manure)
+    bi.store_animal_matter(harvest_stores, animals_on_farm)
+    biomatter_available = bi.biopro_all(harvest_stores.stock)
     biomatter_use = bi.biopro_to_use(biomatter_available)
     ul.report_digestor(biomatter_use)
-    ul.extract_fm(biomatter_use)
-    bi.make_biopro_products(biomatter_use)
+    fl.book('digestor', biomatter_use)
     ul.apply_digestate()
-    harvest_stores = harvest_stores.sub(biomatter_use, fill_value=0.0)
-    harvest_stores = harvest_stores.reindex_like(gd.harvest_yield)
-    mulch = ul.select_mulch(harvest_stores, biomatter_available, biomatter_use)
+    harvest_stores.withdraw('digestor', biomatter_use)
+    mulch = ul.select_mulch(harvest_stores.stock)
     ul.report_mulch(mulch)
-    ul.apply_mulch(mulch)
-    harvest_stores = harvest_stores.sub(mulch, fill_value=0.0)
-    harvest_stores = harvest_stores.reindex_like(gd.harvest_yield)
-    cash_crops = ul.select_cash_crops(harvest_stores)
-    ul.apply_cash_crop_yield(cash_crops)
+    fl.book('mulch', mulch)
+    harvest_stores.withdraw('mulch', mulch)
+    cash_crops = ul.select_cash_crops(harvest_stores.stock)
+    fl.book('sale', cash_crops)
     ul.report_sold(cash_crops)
-    harvest_stores = harvest_stores.sub(cash_crops, fill_value=0.0)
-    harvest_stores = harvest_stores.reindex_like(gd.harvest_yield)
+    harvest_stores.withdraw('sale', cash_crops)
     ul.apply_animal_balance(animals_on_farm)
     ul.apply_electricity_use()
     ul.fertilize_fm()
     ul.report_and_wipe_fm()
-    print(f'years passed: {gd.year}')
-    print(f'herd size is: {sum(animals_on_farm)}\n')
+    ul.report_and_wipe_slaughter(animals_on_farm)
+
+
+def simulate(checkpointer, resume=None, stop=None):
+    """
+    Simulate all years of operation on the farm.
+
+    Core loop implemented as 'do while' each run accounts for one year of
+    operations.
+
+    Parameters
+    ----------
+    checkpointer : checkpoint_functions.Checkpointer
+        Decides when the simulation state gets saved.
+    resume : str, optional
+        Name of a checkpoint file to continue the simulation from.
+    stop : function, optional
+        Gets called after every year, the simulation ends early when it
+        returns True.
+
+    Returns
+    -------
+    animals_on_farm : pd.Series
+        The herd at the end of the simulation.
+        All results get added to global variables.
+
+    """
+    if resume:
+        animals_on_farm = cp.load_checkpoint(resume)
+        harvest_stores = st.HarvestStores()
+        checkpointer.last_year = gd.year
+        print(f'resuming after year {gd.year}...')
+    else:
+        print('simulating...')
+        animals_on_farm = gd.animals_on_farm
+        harvest_stores = st.HarvestStores()
+        run_year(animals_on_farm, harvest_stores)
+        print(f'years passed: {gd.year}')
+        print(f'herd size is: {sum(animals_on_farm)}\n')
+        checkpointer.update(animals_on_farm)
+        if stop and stop():
+            return animals_on_farm
 
     while gd.year < gd.estate_values['runtime']:
         gd.year += 1
         al.age_herd(animals_on_farm)
         ul.apply_stocking_limits(animals_on_farm)
-        harvest_stores = gd.harvest_yield.copy()
-        ul.apply_crop_balance()
-        ul.fixate_fm(harvest_stores)
-        bedding = ul.assign_bedding(harvest_stores, animals_on_farm)
-        ul.report_bedding(bedding)
-        harvest_stores = harvest_stores.sub(bedding, fill_value=0.0)
-        harvest_stores = harvest_stores.reindex_like(gd.harvest_yield)
-        feed = fd.feed_animals(harvest_stores, animals_on_farm)
-        ul.report_feed(feed)
-        harvest_stores -= feed
-        ul.apply_digestion_methane_emission(animals_on_farm)
-        manure = animals_on_farm * gd.animal_data['manure_pasture_production']
-        ul.apply_manure(manure)
-        biomatter_available = bi.biopro_all(harvest_stores, animals_on_farm)
-        biomatter_use = bi.biopro_to_use(biomatter_available)
-        ul.report_digestor(biomatter_use)
-        ul.extract_fm(biomatter_use)
-        bi.make_biopro_products(biomatter_use)
-        ul.apply_digestate()
-        harvest_stores = harvest_stores.sub(biomatter_use, fill_value=0.0)
-        harvest_stores = harvest_stores.reindex_like(gd.harvest_yield)
-        mulch = ul.select_mulch(harvest_stores, biomatter_available,
-                                biomatter_use)
-        ul.report_mulch(mulch)
-        ul.apply_mulch(mulch)
-        harvest_stores = harvest_stores.sub(mulch, fill_value=0.0)
-        harvest_stores = harvest_stores.reindex_like(gd.harvest_yield)
-        cash_crops = ul.select_cash_crops(harvest_stores)
-        ul.apply_cash_crop_yield(cash_crops)
-        ul.report_sold(cash_crops)
-        harvest_stores = harvest_stores.sub(cash_crops, fill_value=0.0)
-        harvest_stores = harvest_stores.reindex_like(gd.harvest_yield)
-        ul.apply_animal_balance(animals_on_farm)
-        ul.apply_electricity_use()
-        ul.fertilize_fm()
-        ul.report_and_wipe_fm()
+        run_year(animals_on_farm, harvest_stores)
         animals_on_farm.name = f'year_{gd.year}'
         gd.herd_results.append(animals_on_farm.copy())
         print(f'years passed: {gd.year}')
@@ -108,34 +197,117 @@ if __name__ == '__main__':
         # females = sum(animals_on_farm[gd.female_labs[:-1]])
         # males = sum(animals_on_farm[gd.male_labs[:-1]])
         # print(f'female per male is: {females/males}\n')
+        checkpointer.update(animals_on_farm)
+        if stop and stop():
+            break
+    return animals_on_farm
+
 
-    print(f'final herd is:\n{animals_on_farm}\n')
+def collect_reports():
+    """
+    Turn the yearly reports into dataframes for output.
 
+    Returns
+    -------
+    None;
+    Global variables get replaced.
+
+    """
     gd.herd_results = pd.DataFrame(gd.herd_results)
-    gd.bedding_used = pd.DataFrame(gd.bedding_used)
-    gd.feed_used = pd.DataFrame(gd.feed_used)
-    ul.drop_empty_columns(gd.feed_used)
-    gd.crops_sold = pd.DataFrame(gd.crops_sold)
-    gd.digestor_used = pd.DataFrame(gd.digestor_used)
-    gd.digestor_used.fillna(0, inplace=True)
-    gd.mulch_used = pd.DataFrame(gd.mulch_used)
-    gd.mulch_used.fillna(0, inplace=True)
+    gd.bedding_used = ul.mk_report_frame('bedding_used')
+    gd.feed_used = ul.mk_report_frame('feed_used')
+    gd.crops_sold = ul.mk_report_frame('crops_sold')
+    gd.digestor_used = ul.mk_report_frame('digestor_used')
+    gd.mulch_used = ul.mk_report_frame('mulch_used')
+
+
+def run_scenario(input_sheets, stop=None, replicate=0, antithetic=False,
+                 seed=al.SEED):
+    """
+    Quietly simulate a complete run from the given input sheets.
+
+    Parameters
+    ----------
+    input_sheets : dict
+        Contains the estate, crops, animal and biodigestor sheets as they are
+        in the input file.
+    stop : function, optional
+        Gets called after every year, the run ends early when it returns
+        True. Without it, the run is taken from the result cache if it is
+        there (see cache_functions).
+    replicate : int, optional
+        Replicate to simulate. The same replicate of different scenarios
+        draws the same random numbers.
+    antithetic : bool, optional
+        Pair the replicates antithetically.
+    seed : int, optional
+        Seed the random streams of the replicates spawn from.
+
+    Returns
+    -------
+    results : pd.DataFrame
+        The statistics of every year simulated.
+        Reports are available in global variables.
+
+    """
+    gd.setup(input_sheets)
+    al.seed_run(replicate, antithetic, seed)
+    # Runs that may end early are not cached, their length depends on stop.
+    if stop is not None or cr.load_run() is None:
+        with open(os.devnull, 'w') as devnull:
+            with contextlib.redirect_stdout(devnull):
+                animals_on_farm = simulate(cp.Checkpointer(None), stop=stop)
+                collect_reports()
+        if stop is None:
+            cr.save_run(animals_on_farm)
+    results = gd.results.iloc[1:gd.year + 1].astype('float')
+    return results
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    gd.use_input_file(args.input_file)
+    if args.no_jit:
+        kn.use_jit = False
+    al.seed_run(args.replicate, args.antithetic, args.seed)
+    cr.use_cache(args.result_cache, args.result_cache_size)
+    if args.trace:
+        tr.start_trace(args.trace_size)
+    # A trace needs the run to be simulated, not reused.
+    if args.trace or not (args.trajectory and
+                          rc.try_recompute(args.trajectory)):
+        animals_on_farm = None if args.trace else cr.load_run()
+        if args.result_cache and not args.trace:
+            cr.report_hits(int(animals_on_farm is not None), 1)
+        if animals_on_farm is None:
+            checkpointer = cp.Checkpointer(args.checkpoint,
+                                           args.checkpoint_years,
+                                           args.checkpoint_seconds)
+            animals_on_farm = simulate(checkpointer, args.resume)
+            # The results workbook is written straight from the reports,
+            # they only get turned into dataframes when the run's ledger is
+            # needed or the run gets cached.
+            if args.trajectory or args.price_scenarios or args.flows or\
+                    args.monthly or args.result_cache:
+                collect_reports()
+            cr.save_run(animals_on_farm)
+        print(f'final herd is:\n{animals_on_farm}\n')
+    if args.trajectory:
+        rc.save_trajectory(args.trajectory)
 
     # At the end of the run output relevant results and inputs used.
     timestamp = dt.datetime.now()
     timestamp = timestamp.strftime('%Y-%m-%d_%H.%M.%S')
+    if args.price_scenarios:
+        vl.write_scenario_values(args.price_scenarios,
+                                 f'squire_prices_{timestamp}.csv')
+    if args.flows:
+        fl.write_flow_table(args.flows, rc.mk_ledger())
+    if args.monthly:
+        mo.write_monthly_table(args.monthly, rc.mk_ledger())
+    if args.trace:
+        tr.write_trace(args.trace)
     output_name = f'squire_results_{timestamp}.xlsx'
-    with pd.ExcelWriter(output_name) as writer:
-        gd.results.to_excel(writer, sheet_name='statistics')
-        gd.herd_results.to_excel(writer, sheet_name='herd')
-        gd.feed_used.to_excel(writer, sheet_name='feed use(Kg)')
-        gd.bedding_used.to_excel(writer, sheet_name='bedding use(Kg)')
-        gd.crops_sold.to_excel(writer, sheet_name='crops sold(Kg)')
-        gd.digestor_used.to_excel(writer, sheet_name='biodigestor inputs(Kg)')
-        gd.mulch_used.to_excel(writer, sheet_name='mulch applied(Kg)')
-        gd.estate_data_ori.to_excel(writer, sheet_name='estate')
-        gd.plant_data_ori.to_excel(writer, sheet_name='crops')
-        gd.animal_data_ori.to_excel(writer, sheet_name='animal')
-        gd.biodigestor_data_ori.to_excel(writer, sheet_name='biodigestor')
+    ex.write_results(output_name)
     print('simulation done, check output file')
     os.system(f'start EXCEL.EXE {output_name}')
@@ -8,6 +8,210 @@ import pandas as pd
 import numpy as np
 import global_data as gd
 import animal_lifecycle_functions as al
+import kernel_functions as kn
+import trace_functions as tr
+
+
+class FeedState:
+    """
+    Feed state keeps track of the feed solver between its feeding steps.
+
+    The crops that can be fed are ranked on their protein and energy content
+    once. Every feeding step only changes the stored and fed amount of one
+    crop, so the rankings only get filtered again when a crop runs out or when
+    grasses are excluded from or included in the crops considered.
+
+    Attribues:
+    ----------
+    labels : np.ndarray
+        Names of the crops that can be fed, in the order of the crops sheet.
+    protein : np.ndarray
+        The kg amount of protein 1 kg of each crop yields.
+    energy : np.ndarray
+        The MJ amount of energy 1 kg of each crop yields.
+    grass : np.ndarray
+        True for the crops which can be considered grasses.
+    stored : np.ndarray
+        The kg amount of each crop left in store.
+    fed : np.ndarray
+        The kg amount of each crop fed so far.
+    p_order : np.ndarray
+        Positions of the crops from most to least protein yielding.
+    e_order : np.ndarray
+        Positions of the crops from most to least energy yielding.
+    grass_used : bool
+        True if grasses are considered for feed at this step.
+    in_use : np.ndarray
+        True for the crops considered for feed at this step.
+    p_rank : np.ndarray
+        p_order limited to the crops considered for feed.
+    e_rank : np.ndarray
+        e_order limited to the crops considered for feed.
+    grass_capped : np.ndarray
+        Times the amount of each crop to feed was capped by the grass share.
+    grass_cut : np.ndarray
+        Kg amount of each crop the grass share cut off.
+    needs_remain : dict
+        The remaining nutrient needs (protein, energy and dry matter).
+    limits_remain : dict
+        The remaining nutrient limits (protein, energy and dry matter).
+    """
+
+    def __init__(self, harvest_stores, feed_needs, feed_limits,
+                 feeding_groups_used):
+        feed_sources = mk_feeds_to_use(feeding_groups_used, harvest_stores)
+        source_data = gd.plant_data.loc[feed_sources]
+        grasses = get_grasses(feed_sources)
+        self.labels = np.array(feed_sources, dtype=object)
+        self.protein = source_data['feed_protein_content'].to_numpy(
+            dtype='float')
+        self.energy = source_data['feed_energy_content'].to_numpy(
+            dtype='float')
+        self.grass = np.array([crop in grasses for crop in feed_sources],
+                              dtype=bool)
+        self.stored = harvest_stores[feed_sources].to_numpy(dtype='float')
+        self.p_order = np.argsort(-self.protein, kind='stable')
+        self.e_order = np.argsort(-self.energy, kind='stable')
+        self.grass_used = False
+        self.grass_capped = np.zeros(len(self.labels), dtype='int64')
+        self.grass_cut = np.zeros(len(self.labels))
+        self.update_rankings()
+        self.reset(feed_needs, feed_limits)
+
+    def reset(self, feed_needs, feed_limits):
+        """
+        Undo all feeding, the stored amounts are left as they are.
+
+        Parameters
+        ----------
+        feed_needs : pd.Series
+            Countains the minimal nutrient needs for the current herd.
+        feed_limits : pd.Series
+            Contains the maxium nutrient amounts the herd could be fed.
+
+        Returns
+        -------
+        None.
+        """
+        self.fed = np.zeros(len(self.labels))
+        self.needs_remain = {nutrient: float(need)
+                             for nutrient, need in feed_needs.items()}
+        self.limits_remain = {nutrient: float(limit)
+                              for nutrient, limit in feed_limits.items()}
+
+    def update_rankings(self):
+        """
+        Limit the rankings to the crops considered for feed at this step.
+
+        Returns
+        -------
+        None.
+        """
+        self.in_use = self.stored > 0
+        if not self.grass_used:
+            self.in_use &= ~self.grass
+        self.p_rank = self.p_order[self.in_use[self.p_order]]
+        self.e_rank = self.e_order[self.in_use[self.e_order]]
+
+    def use_grass(self, grass_used):
+        """
+        Include or exclude grasses from the crops considered for feed.
+
+        Parameters
+        ----------
+        grass_used : bool
+            True if grasses can be considered for the next step.
+
+        Returns
+        -------
+        None.
+        """
+        if grass_used != self.grass_used:
+            self.grass_used = grass_used
+            self.update_rankings()
+
+    def feed(self, pos, amount):
+        """
+        Feed an amount of a crop and take its nutrients off the remainders.
+
+        Parameters
+        ----------
+        pos : int
+            Position of the crop being fed.
+        amount : float
+            Kg amount of the crop being fed.
+
+        Returns
+        -------
+        None.
+        """
+        self.fed[pos] += amount
+        self.stored[pos] -= amount
+        prot_yield = self.protein[pos] * amount
+        energy_yield = self.energy[pos] * amount
+        for remain in (self.needs_remain, self.limits_remain):
+            remain['protein'] -= prot_yield
+            remain['energy'] -= energy_yield
+            remain['dm'] -= amount
+        if self.stored[pos] <= 0:
+            self.update_rankings()
+
+    def fed_yields(self):
+        """
+        Determine the nutrient yields of all feed fed so far.
+
+        The yields are summed crop by crop in the order of the crops sheet,
+        to get exactly the sums over all crops the margins are checked on.
+
+        Returns
+        -------
+        fed_yields : dict
+            Contains the nutrient yields (protein, energy and dry matter).
+        """
+        fed_yields = {'protein': sum((self.fed * self.protein).tolist()),
+                      'energy': sum((self.fed * self.energy).tolist()),
+                      'dm': self.fed_total()}
+        return fed_yields
+
+    def fed_total(self):
+        """
+        Determine the kg amount of all feed fed so far.
+
+        Returns
+        -------
+        float
+            Kg amount of feed fed.
+        """
+        return sum(self.fed.tolist())
+
+    def grass_fed(self):
+        """
+        Determine the kg amount of grasses in use fed so far.
+
+        Returns
+        -------
+        float
+            Kg amount of grasses fed.
+        """
+        return sum(self.fed[self.in_use & self.grass].tolist())
+
+    def mk_feed_use(self, index):
+        """
+        Make the kg amount fed of each crop.
+
+        Parameters
+        ----------
+        index : pd.Index
+            Names of all crops.
+
+        Returns
+        -------
+        feed_use : pd.Series
+            Contains the kg amount determined for feed for each crop.
+        """
+        feed_use = pd.Series(0.0, index=index)
+        feed_use[list(self.labels)] = self.fed
+        return feed_use
 
 
 class NutrientData:
@@ -16,16 +220,16 @@ class NutrientData:
 
     Attribues:
     ----------
-    p_lab : str
-        Name of best available protein yielding feed source.
-    e_lab : str
-        Name of best available energy yielding feed source.
-    dm_lab : str
-        Name of best available dry matter yielding feed source.
+    p_pos : int
+        Position of best available protein yielding feed source.
+    e_pos : int
+        Position of best available energy yielding feed source.
+    dm_pos : int
+        Position of best available dry matter yielding feed source.
     p_yld : float
-        The kg amount of protein 1 kg of p_lab would yield.
+        The kg amount of protein 1 kg of p_pos would yield.
     e_yld : float
-        The MJ amount of energy 1 kg of e_lab would yield.
+        The MJ amount of energy 1 kg of e_pos would yield.
     p_kg : float
         The persumed amount of kg feed needed to meet protein demands.
     e_kg : float
@@ -45,146 +249,124 @@ class NutrientData:
         in the feeding process.
     """
 
-    def __init__(self, source_data, feed_needs_remain, harvest_stores):
-        self.assign_p_lab(source_data)
-        self.assign_e_lab(source_data)
-        self.assign_p_yld(self.p_lab, source_data)
-        self.assign_e_yld(self.e_lab, source_data)
-        self.assign_p_kg(self.p_lab, self.p_yld, source_data,
-                         feed_needs_remain, harvest_stores)
-        self.assign_e_kg(self.e_lab, self.e_yld, source_data,
-                         feed_needs_remain, harvest_stores)
-        self.assign_dm_lab(source_data, self.p_kg, self.e_kg)
-        self.assign_dm_kg(feed_needs_remain)
+    def __init__(self, feed_state):
+        self.assign_p_pos(feed_state)
+        self.assign_e_pos(feed_state)
+        self.assign_p_yld(self.p_pos, feed_state)
+        self.assign_e_yld(self.e_pos, feed_state)
+        self.assign_p_kg(feed_state)
+        self.assign_e_kg(feed_state)
+        self.assign_dm_pos(feed_state, self.p_kg, self.e_kg)
+        self.assign_dm_kg(feed_state.needs_remain)
         self.rank_kg(self.p_kg, self.e_kg, self.dm_kg)
         self.assign_tf(self.first, self.second, self.third)
 
-    def assign_p_lab(self, source_data):
+    def assign_p_pos(self, feed_state):
         """
-        Assign protein label based on new source data.
+        Assign the best protein yielding crop considered for feed.
 
         Parameters
         ----------
-        source_data : pd.Dataframe
-            Data frame containing all attributes relevant to selection of feed.
+        feed_state : FeedState
+            State of the feed solver at this step.
 
         Returns
         -------
         None.
         """
-        self.p_lab = find_best_prot_yielder(source_data)
+        self.p_pos = feed_state.p_rank[0]
 
-    def assign_p_yld(self, p_lab, source_data):
+    def assign_p_yld(self, p_pos, feed_state):
         """
-        Assign protein yield based on new source data.
+        Assign protein yield of the best protein yielding crop.
 
         Parameters
         ----------
-        p_lab : str
-            Name of best available protein yielding feed source.
-        source_data : pd.Dataframe
-            Data frame containing all attributes relevant to selection of feed.
+        p_pos : int
+            Position of best available protein yielding feed source.
+        feed_state : FeedState
+            State of the feed solver at this step.
 
         Returns
         -------
         None.
         """
-        self.p_yld = source_data['feed_protein_content'].loc[p_lab]
+        self.p_yld = feed_state.protein[p_pos]
 
-    def assign_p_kg(self, p_lab, p_yld, source_data, feed_needs_remain,
-                    harvest_stores):
+    def assign_p_kg(self, feed_state):
         """
         Assign kg of feed needed based on protein needs.
 
         Parameters
         ----------
-        p_lab : str
-            Name of best available protein yielding feed source.
-        p_yld : float
-            The kg amount of protein 1 kg of p_lab would yield.
-        source_data : pd.Dataframe
-            Data frame containing all attributes relevant to selection of feed.
-        feed_needs_remain : pd.Series
-            Contains the remaning nutrient needs
-            (protein, energy and dry matter) of the herd.
-        harvest_stores : pd.Series
-            Contains all harvested crops and their stored amounts.
+        feed_state : FeedState
+            State of the feed solver at this step.
 
         Returns
         -------
         None.
         """
-        self.p_kg = find_kg_need_for_prot(p_lab, p_yld, source_data,
-                                          feed_needs_remain,
-                                          harvest_stores)
+        self.p_kg = find_kg_need(feed_state.protein, feed_state.stored,
+                                 feed_state.p_rank,
+                                 feed_state.needs_remain['protein'])
 
-    def assign_e_lab(self, source_data):
+    def assign_e_pos(self, feed_state):
         """
-        Assing energy label based on new source data.
+        Assign the best energy yielding crop considered for feed.
 
         Parameters
         ----------
-        source_data : pd.Dataframe
-            Data frame containing all attributes relevant to selection of feed.
+        feed_state : FeedState
+            State of the feed solver at this step.
 
         Returns
         -------
         None.
         """
-        self.e_lab = find_best_energy_yielder(source_data)
+        self.e_pos = feed_state.e_rank[0]
 
-    def assign_e_yld(self, e_lab, source_data):
+    def assign_e_yld(self, e_pos, feed_state):
         """
-        Assign energy yield based on source data.
+        Assign energy yield of the best energy yielding crop.
 
         Parameters
         ----------
-        e_lab : str
-            Name of best available energy yielding feed source.
-        source_data : pd.Dataframe
-            Data frame containing all attributes relevant to selection of feed.
+        e_pos : int
+            Position of best available energy yielding feed source.
+        feed_state : FeedState
+            State of the feed solver at this step.
 
         Returns
         -------
         None.
         """
-        self.e_yld = source_data['feed_energy_content'].loc[e_lab]
+        self.e_yld = feed_state.energy[e_pos]
 
-    def assign_e_kg(self, e_lab, e_yld, source_data, feed_needs_remain,
-                    harvest_stores):
+    def assign_e_kg(self, feed_state):
         """
         Assign kg of feed needed based on energy needs.
 
         Parameters
         ----------
-        e_lab : str
-            Name of best available energy yielding feed source.
-        e_yld : float
-            The MJ amount of energy 1 kg of e_lab would yield.
-        source_data : pd.Dataframe
-            Data frame containing all attributes relevant to selection of feed.
-        feed_needs_remain : pd.Series
-            Contains the remaning nutrient needs
-            (protein, energy and dry matter) of the herd.
-        harvest_stores : pd.Series
-            Contains all harvested crops and their stored amounts.
+        feed_state : FeedState
+            State of the feed solver at this step.
 
         Returns
         -------
         None.
         """
-        self.e_kg = find_kg_need_for_energy(e_lab, e_yld, source_data,
-                                            feed_needs_remain,
-                                            harvest_stores)
+        self.e_kg = find_kg_need(feed_state.energy, feed_state.stored,
+                                 feed_state.e_rank,
+                                 feed_state.needs_remain['energy'])
 
-    def assign_dm_lab(self, source_data, p_kg, e_kg):
+    def assign_dm_pos(self, feed_state, p_kg, e_kg):
         """
-        Assign dry matter label based on new source data and nutrient needs.
+        Assign dry matter crop based on the crops in use and nutrient needs.
 
         Parameters
         ----------
-        source_data : pd.Dataframe
-            Data frame containing all attributes relevant to selection of feed.
+        feed_state : FeedState
+            State of the feed solver at this step.
         p_kg : float
             The persumed amount of kg feed needed to meet protein demands.
         e_kg : float
@@ -194,7 +376,7 @@ class NutrientData:
         -------
         None.
         """
-        self.dm_lab = find_best_dm_yielder(source_data, p_kg, e_kg)
+        self.dm_pos = find_best_dm_yielder(feed_state, p_kg, e_kg)
 
     def assign_dm_kg(self, feed_needs_remain):
         """
@@ -202,7 +384,7 @@ class NutrientData:
 
         Parameters
         ----------
-        feed_needs_remain : pd.Series
+        feed_needs_remain : dict
             Contains the remaning nutrient needs
             (protein, energy and dry matter) of the herd.
 
@@ -266,58 +448,17 @@ class NutrientData:
             self.kg_tf = first - second
 
 
-def find_best_prot_yielder(source_data):
-    """
-    Find crop that yields the most protein per Kg present in source data.
-
-    Parameters
-    ----------
-    source_data : pd.Dataframe
-        Data frame containing all attributes relevant to selection of feed.
-
-    Returns
-    -------
-    best : string
-        The name of the available crop yielding the most protein.
-    """
-    protein_rank = source_data['feed_protein_content']
-#   alternate selection criterea below
-#   protein_rank /= source_data['feed_energy_content']
-    best_rank = protein_rank.nlargest(n=1)
-    best = best_rank.index[0]
-    return best
-
-
-def find_best_energy_yielder(source_data):
-    """
-    Find crop that yields the most energy per Kg present in source data.
-
-    Parameters
-    ----------
-    source_data : pd.Dataframe
-        Data frame containing all attributes relevant to selection of feed.
-
-    Returns
-    -------
-    best : string
-        The name of the available crop yielding the most energy.
-    """
-    energy_rank = source_data['feed_energy_content']
-#   alternate selection criterea below
-#   energy_rank /= source_data['feed_protein_content']
-    best_rank = energy_rank.nlargest(n=1)
-    best = best_rank.index[0]
-    return best
-
-
-def find_best_dm_yielder(source_data, kg_need_for_prot, kg_need_for_energy):
+def find_best_dm_yielder(feed_state, kg_need_for_prot, kg_need_for_energy):
     """
     Find crop that can best be used to satisfy dry matter requirement.
 
+    That is the crop in use with the lowest content of the nutrient needing
+    the most kg feed, the first one in the crops sheet on a tie.
+
     Parameters
     ----------
-    source_data : pd.Dataframe
-        Data frame containing all attributes relevant to selection of feed.
+    feed_state : FeedState
+        State of the feed solver at this step.
     kg_need_for_prot : float
         Persumed amount of kg feed needed to satisfy protein needs.
     kg_need_for_energy : float
@@ -325,107 +466,57 @@ def find_best_dm_yielder(source_data, kg_need_for_prot, kg_need_for_energy):
 
     Returns
     -------
-    best : string
-        The name of the available harvest product best fit to satisfy
+    best : int
+        Position of the available harvest product best fit to satisfy
         dry matter requirement in the current situation.
     """
-    energy_rank = source_data['feed_energy_content'].rank()
-    protein_rank = source_data['feed_protein_content'].rank()
     if kg_need_for_prot >= kg_need_for_energy:
-        use_rank = energy_rank
-    elif kg_need_for_energy > kg_need_for_prot:
-        use_rank = protein_rank
-    best = use_rank
-    best = best.nsmallest(n=1)
-    best = best.index[0]
+        content = feed_state.energy
+    else:
+        content = feed_state.protein
+    in_use = np.flatnonzero(feed_state.in_use)
+    best = in_use[np.argmin(content[in_use])]
     return best
 
 
-def find_kg_need_for_prot(p_lab, p_yld, source_data, feed_needs_remain,
-                          harvest_stores):
+def find_kg_need(yields, harvest_stores, ranking, need):
     """
-    Determine persumed Kg amound of feed needed to satisfy protein need.
-
-    Parameters
-    ----------
-    p_lab : str
-        Name of best protein yielding crop.
-    p_yld : TYPE
-        Kg amount of protein yield per Kg of crop fed.
-    source_data : pd.Dataframe
-        Data frame containing all attributes relevant to selection of feed.
-    feed_needs : pd.Series
-        Countains the minimal nutrient needs for the current herd of animals at
-        this stage in the feeding algorithm.
-    harvest_stores : pd.Series
-        Contains all harvested crops and their stored amounts.
-
-    Returns
-    -------
-    kg_need_for_prot : float
-        The persumed Kg amount of feed needed to satisfy protein requirement.
-    """
-    prot_yield = 0.0
-    kg_needed = 0.0
-    fail = False  # might want to figure out better fail safe later
-    while prot_yield < feed_needs_remain['protein']:
-        prot_yield += harvest_stores[p_lab] * p_yld
-        kg_needed += harvest_stores[p_lab]
-        if prot_yield < feed_needs_remain['protein']:
-            source_data_popped = source_data.drop(p_lab)
-            if 0 >= len(source_data_popped):
-                fail = True
-                break
-            p_lab = find_best_prot_yielder(source_data_popped)
-            p_yld = source_data['feed_protein_content'].loc[p_lab]
-    surplus = prot_yield - feed_needs_remain['protein']
-    kg_needed -= surplus / p_yld
-    if fail:
-        kg_needed = 0
-    return kg_needed
-
+    Determine persumed Kg amount of feed needed to satisfy a nutrient need.
 
-def find_kg_need_for_energy(e_lab, e_yld, source_data, feed_needs_remain,
-                            harvest_stores):
-    """
-    Determine the persumed Kg amount of feed needed to satsify energy need.
+    Feeds are used from the best yielding one down, each up to its stored
+    amount. The feed the need is met in is found by a binary search over the
+    cumulative nutrient yield.
 
     Parameters
     ----------
-    e_lab : str
-        Name of best energy yielding crop
-    e_yld : float
-        MJ amount of energy yield per Kg of crop fed.
-    source_data : pd.Dataframe
-        Data frame containing all attributes relevant to selection of feed.
-    feed_needs : pd.Series
-        Countains the minimal nutrient needs for the current herd of animals at
-        this stage in the feeding algorithm.
-    harvest_stores : pd.Series
-        Contains all harvested crops and their stored amounts.
+    yields : np.ndarray
+        Nutrient yield per Kg of each crop.
+    harvest_stores : np.ndarray
+        Stored amount of each crop.
+    ranking : np.ndarray
+        Positions of the crops considered for feed, from best to worst
+        yielding.
+    need : float
+        Nutrient amount still needed.
 
     Returns
     -------
-    kg_need_for_energy : float
-        The persumed Kg amount of feed needed to satsify energy need.
-    """
-    energy_yield = 0.0
-    kg_needed = 0.0
-    fail = False  # might want to figure out better fail safe later
-    while energy_yield < feed_needs_remain['energy']:
-        energy_yield += harvest_stores[e_lab] * e_yld
-        kg_needed += harvest_stores[e_lab]
-        if energy_yield < feed_needs_remain['energy']:
-            source_data_popped = source_data.drop(e_lab)
-            if 0 >= len(source_data_popped):
-                fail = True
-                break
-            e_lab = find_best_energy_yielder(source_data_popped)
-            e_yld = source_data['feed_energy_content'].loc[e_lab]
-    surplus = energy_yield - feed_needs_remain['energy']
-    kg_needed -= surplus / e_yld
-    if fail:
+    kg_needed : float
+        The persumed Kg amount of feed needed to satisfy the need, 0 if all
+        feed in store can't satisfy it.
+    """
+    nutri_yield = yields[ranking]
+    stored = harvest_stores[ranking]
+    if need <= 0:
+        kg_needed = need / nutri_yield[0]
+        return kg_needed
+    cumulative_yield = np.cumsum(stored * nutri_yield)
+    last = np.searchsorted(cumulative_yield, need)
+    if last == len(cumulative_yield):
         kg_needed = 0
+        return kg_needed
+    surplus = cumulative_yield[last] - need
+    kg_needed = stored[:last + 1].sum() - surplus / nutri_yield[last]
     return kg_needed
 
 
@@ -438,7 +529,7 @@ def mk_feeds_to_use(nr_of_groups, harvest_stores):
     nr_of_groups : int
         Indicates current priority in crop types being considered for feed.
     harvest_stores : pd.Series
-        Contains all harvested crops and their stored amounts.
+        Kg amount in store of every material in the material registry.
 
     Returns
     -------
@@ -447,78 +538,74 @@ def mk_feeds_to_use(nr_of_groups, harvest_stores):
     """
     feeding_priority = gd.plant_data['feeding_priority']
     feeds_to_use = gd.plant_data.index
+    in_store = harvest_stores[feeds_to_use] > 0
     feeds_to_use = feeds_to_use.where(feeding_priority <= nr_of_groups)
     feeds_to_use = feeds_to_use.where(feeding_priority != 0)
-    feeds_to_use = feeds_to_use.where(harvest_stores > 0)
+    feeds_to_use = feeds_to_use.where(in_store.to_numpy())
     if len(feeds_to_use) > 1:
         feeds_to_use = feeds_to_use.drop(None)
     feeds_to_use = list(feeds_to_use)
     return feeds_to_use
 
 
-def mk_yields_from_groups(nr_of_groups, harvest_stores):
+def mk_group_yields(harvest_stores):
     """
-    Determine nutrient yields of current crop selection considered for feed.
+    Determine nutrient yields of the crops considered for feed per group.
+
+    Crops are grouped on their feeding priority; group g holds the crops first
+    considered when g feeding groups are used. A cumulative sum over the
+    groups then gives the yields for every amount of groups considered.
 
     Parameters
     ----------
-    nr_of_groups : int
-        Indicates current priority in crop types being considered for feed.
+    harvest_stores : pd.Series
+        Kg amount in store of every material in the material registry.
 
     Returns
     -------
-    feed_yields : pd.Series
-        Contains the nutrient yields (protein, energy and dry matter) of the
-        current crop selection considered for feed.
-    """
-    feeds_in_use = mk_feeds_to_use(nr_of_groups, harvest_stores)
-    feeds = harvest_stores.loc[feeds_in_use]
-    prot_stats = gd.plant_data['feed_protein_content'].loc[feeds_in_use]
-    energy_stats = gd.plant_data['feed_energy_content'].loc[feeds_in_use]
-    prot_yield = sum(feeds * prot_stats)
-    energy_yield = sum(feeds * energy_stats)
-    dm_yield = sum(feeds)
-    feed_yields = {'protein': prot_yield,
-                   'energy': energy_yield,
-                   'dm': dm_yield}
-    feed_yields = pd.Series(feed_yields)
-    return feed_yields
-
-
-def determine_feeding_groups(feed_needs, harvest_stores):
+    group_yields : np.ndarray
+        (3 x groups) matrix of the protein, energy and dry matter yields of
+        the crops considered when using up to 1, 2, ... feeding groups.
+    """
+    priority = gd.plant_data['feeding_priority'].to_numpy()
+    nr_of_groups = max(priority.max(), 1)
+    stored = harvest_stores[gd.plant_data.index].to_numpy(dtype='float')
+    usable = (priority != 0) & (stored > 0)
+    groups = np.maximum(priority[usable], 1) - 1
+    nutri_yields = [gd.plant_data['feed_protein_content'].to_numpy(),
+                    gd.plant_data['feed_energy_content'].to_numpy(), 1]
+    group_yields = [np.bincount(groups, weights=(stored * content)[usable],
+                                minlength=nr_of_groups)
+                    for content in nutri_yields]
+    group_yields = np.cumsum(group_yields, axis=1)
+    return group_yields
+
+
+def determine_feeding_groups(feed_needs, group_yields):
     """
     Determine the amount of feeding groups needed to satisfy feed needs.
 
+    Considering more groups never lowers the yields, so the first amount of
+    groups meeting all needs is found with a binary search.
+
     Parameters
     ----------
     feed_needs : pd.Series
         Countains the minimal nutrient needs for the current herd of animals.
+    group_yields : np.ndarray
+        Nutrient yields per amount of feeding groups, see mk_group_yields.
 
     Returns
     -------
     groups_considered : int
         specifies the priority ranking up to which certain crops will be
-        considered for feed purposes.
-    """
-    need_met = False
-    groups_considered = 1
-    feed_yields = mk_yields_from_groups(groups_considered, harvest_stores)
-    if feed_yields['protein'] >= feed_needs['protein']:
-        if feed_yields['energy'] >= feed_needs['energy']:
-            if feed_yields['dm'] >= feed_needs['dm']:
-                need_met = True
-
-    while not need_met:
-        groups_considered += 1
-        if groups_considered > max(gd.plant_data['feeding_priority']):
-            groups_considered = 0
-            break
-        feed_yields = mk_yields_from_groups(groups_considered, harvest_stores)
-        if feed_yields['protein'] >= feed_needs['protein']:
-            if feed_yields['energy'] >= feed_needs['energy']:
-                if feed_yields['dm'] >= feed_needs['dm']:
-                    need_met = True
-
+        considered for feed purposes, 0 if no amount of groups suffices.
+    """
+    needs = feed_needs[['protein', 'energy', 'dm']].to_numpy(dtype='float')
+    need_met = (group_yields >= needs[:, None]).all(axis=0)
+    groups_considered = int(np.searchsorted(need_met, True)) + 1
+    if groups_considered > len(need_met):
+        groups_considered = 0
     return groups_considered
 
 
@@ -575,81 +662,50 @@ def mk_feed_limits(animals_on_farm):
     return herd_feed_ceils
 
 
-def mk_yields_from_feed(label, amount, source_data):
+def find_la(nutris, feed_state):
     """
-    Determine nutrient yields of given crop in specified amount.
-
-    Parameters
-    ----------
-    label : str
-        Name of the crop being fed.
-    amount : float
-        Kg amount of the crop being fed.
-    source_data : pd.Dataframe
-        Data frame containing all attributes relevant to selection of feed.
-
-    Returns
-    -------
-    feed_yields : pd.Series
-        Contains the nutrient yields (protein, energy and dry matter) of the
-        current crop selection considered for feed.
-    """
-    prot_yield = source_data['feed_protein_content'].loc[label] * amount
-    energy_yield = source_data['feed_energy_content'].loc[label] * amount
-    dm_yield = amount
-
-    feed_yields = {'protein': prot_yield,
-                   'energy': energy_yield,
-                   'dm': dm_yield}
-    feed_yields = pd.Series(feed_yields)
-    return feed_yields
-
-
-def find_la(nutris, feed_needs_remain, harvest_stores):
-    """
-    Find label and amount of crop to feed at this step in the agorithm.
+    Find position and amount of crop to feed at this step in the agorithm.
 
     Parameters
     ----------
     nutris : NutrientData
         Class constructed with all relevant nutrient data for this function.
-    feed_needs_remain : pd.Series
-        Countains the minimal nutrient needs for the current herd of animals at
-        this stage in the feeding algorithm.
-    harvest_stores : pd.Series
-        Contains all harvested crops and their stored amounts.
+    feed_state : FeedState
+        State of the feed solver at this step.
 
     Returns
     -------
-    label : str
-        Name of the crop to feed.
+    pos : int
+        Position of the crop to feed.
     amount : float
         Kg amount of the crop to feed.
     """
+    feed_needs_remain = feed_state.needs_remain
+    harvest_stores = feed_state.stored
     if nutris.p_kg == nutris.first:
         if nutris.kg_tf * nutris.p_yld > (feed_needs_remain['protein'] + 1):
             nutris.kg_tf = feed_needs_remain['protein'] / nutris.p_yld / 100
             if nutris.kg_tf < 1:
                 nutris.kg_tf *= 100
-        if nutris.kg_tf > harvest_stores[nutris.p_lab]:
-            nutris.kg_tf = harvest_stores[nutris.p_lab]
-        label = nutris.p_lab
+        if nutris.kg_tf > harvest_stores[nutris.p_pos]:
+            nutris.kg_tf = harvest_stores[nutris.p_pos]
+        pos = nutris.p_pos
         amount = nutris.kg_tf
     if nutris.e_kg == nutris.first:
         if nutris.kg_tf * nutris.e_yld > (feed_needs_remain['energy'] + 1):
             nutris.kg_tf = feed_needs_remain['energy'] / nutris.e_yld / 100
             if nutris.kg_tf < 1:
                 nutris.kg_tf *= 100
-        if nutris.kg_tf > harvest_stores[nutris.e_lab]:
-            nutris.kg_tf = harvest_stores[nutris.e_lab]
-        label = nutris.e_lab
+        if nutris.kg_tf > harvest_stores[nutris.e_pos]:
+            nutris.kg_tf = harvest_stores[nutris.e_pos]
+        pos = nutris.e_pos
         amount = nutris.kg_tf
     if nutris.dm_kg == nutris.first:
-        if nutris.kg_tf > harvest_stores[nutris.dm_lab]:
-            nutris.kg_tf = harvest_stores[nutris.dm_lab]
-        label = nutris.dm_lab
+        if nutris.kg_tf > harvest_stores[nutris.dm_pos]:
+            nutris.kg_tf = harvest_stores[nutris.dm_pos]
+        pos = nutris.dm_pos
         amount = nutris.kg_tf
-    return label, amount
+    return pos, amount
 
 
 def get_grasses(feed_sources):
@@ -673,76 +729,74 @@ def get_grasses(feed_sources):
     return grasses
 
 
-def rm_grasses(feed_sources):
+def under_grass(fed_total, grass_fed, amount):
     """
-    Make a list of feed sources where grasses are removed.
+    Calculate grass that can be fed before pasture/barn ratio exceeds.
+
+    The amount is lowered in steps of 600 Kg while the grass fed is over its
+    share by more than 1200 Kg, and in steps of 50 Kg after that. Every Kg
+    less lowers the excess by the same part, so the amount of steps follows
+    directly from the excess.
 
     Parameters
     ----------
-    feed_sources : list
-        Names of the crops being considered for feed.
+    fed_total : float
+        Kg amount of all feed fed so far.
+    grass_fed : float
+        Kg amount of grasses fed so far.
+    amount : float
+        amount of crop/grass wanting to be fed.
 
     Returns
     -------
-    feed_sources : list
-        Names of the crops being considered for feed. Now without grasses.
+    amount : float
+        amount of crop/grass to be fed after limit is applied
     """
-    grasses = get_grasses(feed_sources)
-    for grass in grasses:
-        pos = feed_sources.index(grass)
-        feed_sources.pop(pos)
-    return feed_sources
+    excess = grass_fed + amount - (fed_total + amount) * gd.grass_share
+    excess_per_kg = 1 - gd.grass_share
+    big_steps = max(np.ceil((excess - 1200) / (600 * excess_per_kg)), 0)
+    excess -= big_steps * 600 * excess_per_kg
+    small_steps = max(np.ceil(excess / (50 * excess_per_kg)), 0)
+    amount -= big_steps * 600 + small_steps * 50
+    if amount < 0:
+        amount = 0
+    return amount
 
 
-def under_grass(feed_use, grasses, amount):
+def trace_grass_caps(feed_state):
     """
-    Calculate grass that can be fed before pasture/barn ratio exceeds.
+    Record how often the grass share capped the amount of each crop to feed.
 
     Parameters
     ----------
-    feed_use : pd.Series
-        Contains the kg amount determined for feed for each crop.
-    grasses : list
-        Names of those crops which can be considered grasses..
-    amount : float
-        amount of crop/grass wanting to be fed.
+    feed_state : FeedState
+        State of the feed solver after its last step.
 
     Returns
     -------
-    amount : float
-        amount of crop/grass to be fed after limit is applied
+    None.
     """
-    # Maybe add barn time to estate in future.
-    max_grass = (sum(feed_use) + amount) * (173 / 365)
-    grass_yield = sum(feed_use[grasses]) + amount
-    while grass_yield > max_grass:
-        if grass_yield - max_grass > 1200:
-            amount -= 600
-        else:
-            amount -= 50
-        max_grass = (sum(feed_use) + amount) * (173 / 365)
-        grass_yield = sum(feed_use[grasses]) + amount
-        if amount < 0:
-            amount = 0
-            break
-    return amount
+    if not tr.tracing():
+        return
+    for pos in np.flatnonzero(feed_state.grass_capped):
+        tr.record('grass_cap', feed_state.labels[pos],
+                  feed_state.grass_capped[pos], feed_state.grass_cut[pos])
 
 
-def check_margin(feed, feed_needs, feed_limits, source_data):
+def check_margin(fed_yields, feed_needs, feed_limits):
     """
     Check if current feed proposed fits within nutrient limits.
 
     Parameters
     ----------
-    feed : pd.Series
-        Contains the kg amount considered for feed for each crop.
+    fed_yields : dict
+        Contains the nutrient yields (protein, energy and dry matter) of the
+        feed proposed.
     feed_needs : pd.Series
         Contains the minimum required amount of nutrients in this feeding step.
     feed_limits : pd.Series
         Containing the maximum amount of nutrients that may be fed in this
         feeding step.
-    source_data : pd.Dataframe
-        Data frame containing all attributes relevant to selection of feed.
 
     Returns
     -------
@@ -750,9 +804,9 @@ def check_margin(feed, feed_needs, feed_limits, source_data):
         True if given feed amount fits within nutrient limits specified.
         False if not.
     """
-    prot_yield = sum(feed * source_data['feed_protein_content'])
-    energy_yield = sum(feed * source_data['feed_energy_content'])
-    dm_yield = sum(feed)
+    prot_yield = fed_yields['protein']
+    energy_yield = fed_yields['energy']
+    dm_yield = fed_yields['dm']
     if feed_limits['protein'] >= prot_yield >= feed_needs['protein']:
         if feed_limits['energy'] >= energy_yield >= feed_needs['energy']:
             if feed_limits['dm'] >= dm_yield >= feed_needs['dm']:
@@ -768,7 +822,7 @@ def find_feed_optim(harvest_stores, feed_needs, feed_limits,
     Parameters
     ----------
     harvest_stores : pd.Series
-        Contains all harvested crops and their stored amounts.
+        Kg amount in store of every material in the material registry.
     feed_needs : pd.Series
         Countains the minimal nutrient needs for the current herd of animals at
         this stage in the feeding algorithm.
@@ -784,59 +838,63 @@ def find_feed_optim(harvest_stores, feed_needs, feed_limits,
     feed_use : pd.Series
         Contains the kg amount determined for feed for each crop.
     """
-    harvest_stores = harvest_stores.copy()
-    feed_use = pd.Series(0.0, index=harvest_stores.index)
-    feed_sources = mk_feeds_to_use(feeding_groups_used, harvest_stores)
-    feed_sources = rm_grasses(feed_sources)
-    source_data = gd.plant_data.loc[feed_sources]
-    feed_needs_remain = feed_needs.copy()
-    feed_limits_remain = feed_limits.copy()
+    # Grasses are not considered for the first step.
+    feed_state = FeedState(harvest_stores, feed_needs, feed_limits,
+                           feeding_groups_used)
+    if kn.use_jit:
+        nutrients = ['protein', 'energy', 'dm']
+        feed_state.fed, limits_remain = kn.find_feed_optim(
+            feed_state.protein, feed_state.energy, feed_state.grass,
+            feed_state.stored, feed_state.p_order, feed_state.e_order,
+            feed_needs[nutrients].to_numpy(dtype='float'),
+            feed_limits[nutrients].to_numpy(dtype='float'), gd.grass_share,
+            feed_state.grass_capped, feed_state.grass_cut)
+        trace_grass_caps(feed_state)
+        feed_use = feed_state.mk_feed_use(harvest_stores.index)
+        feed_limits_remain = pd.Series(limits_remain, index=nutrients)
+        return feed_use, feed_limits_remain
     skip_grass = False
 
     # As long as feed does not match nutrient requirement add extra feed.
-    while not check_margin(feed_use, feed_needs, feed_limits, gd.plant_data):
+    while not check_margin(feed_state.fed_yields(), feed_needs, feed_limits):
         # If no feed sources are left, no proper feed amount could be found
         # this iteration.
-        if len(feed_sources) == 0:
-            feed_needs_remain = feed_needs.copy()
-            feed_limits_remain = feed_limits.copy()
-            feed_use[:] = 0
+        if not feed_state.in_use.any():
+            feed_state.reset(feed_needs, feed_limits)
             break
-        nutris = NutrientData(source_data, feed_needs_remain, harvest_stores)
+        nutris = NutrientData(feed_state)
         # If no feed needs are left, we overfed on feed limits; no proper feed
         # amount could be found this iteration.
         if nutris.first <= 0:
-            feed_needs_remain = feed_needs.copy()
-            feed_limits_remain = feed_limits.copy()
-            feed_use[:] = 0
+            feed_state.reset(feed_needs, feed_limits)
             break
         # Get amount and crop kind to add to feed.
-        label, amount = find_la(nutris, feed_needs_remain, harvest_stores)
+        pos, amount = find_la(nutris, feed_state)
         # If we can't consider grass for feed this step, make sure we don't
         # add too much feed.
         if skip_grass and amount > 100:
             amount /= 10
         skip_grass = False
-        grasses = get_grasses(feed_sources)
         # If we're trying to feed grass, make sure we're not feeding it while
         # animals would be in the barn.
-        if label in grasses:
-            max_grass = (sum(feed_use) + amount) * (173 / 365)
-            if sum(feed_use[grasses]) + amount > max_grass:
-                amount = under_grass(feed_use, grasses, amount)
+        if feed_state.grass[pos]:
+            fed_total = feed_state.fed_total()
+            grass_fed = feed_state.grass_fed()
+            max_grass = (fed_total + amount) * gd.grass_share
+            if grass_fed + amount > max_grass:
+                capped = under_grass(fed_total, grass_fed, amount)
+                feed_state.grass_capped[pos] += 1
+                feed_state.grass_cut[pos] += amount - capped
+                amount = capped
                 skip_grass = True
         # apply amount and crop to feed.
         amount = np.ceil(amount)
-        feed_use[label] += amount
-        nutri_yields_part = mk_yields_from_feed(label, amount, source_data)
-        feed_needs_remain -= nutri_yields_part
-        feed_limits_remain -= nutri_yields_part
-        harvest_stores[label] -= amount
-        feed_sources = mk_feeds_to_use(feeding_groups_used, harvest_stores)
+        feed_state.feed(pos, amount)
         # If animals are in barn remove grasses from feeds to consider.
-        if skip_grass:
-            feed_sources = rm_grasses(feed_sources)
-        source_data = gd.plant_data.loc[feed_sources]
+        feed_state.use_grass(not skip_grass)
+    trace_grass_caps(feed_state)
+    feed_use = feed_state.mk_feed_use(harvest_stores.index)
+    feed_limits_remain = pd.Series(feed_state.limits_remain)
     return feed_use, feed_limits_remain
 
 
@@ -844,10 +902,13 @@ def feed_animals(harvest_stores, animals_on_farm):
     """
     Calculate which crop products to feed to the animals.
 
+    Every trial ration is withdrawn from the stores right away and rolled
+    back when it turns out no proper feed composition was found.
+
     Parameters
     ----------
-    harvest_stores : pd.Series
-        Contains all harvested crops and their stored amounts.
+    harvest_stores : stores_functions.HarvestStores
+        Keeps the Kg amount in store of every material.
     animals_on_farm : pd.Series
         Keeps track of which animals are on the farm and in what amount they
         are present.
@@ -857,41 +918,48 @@ def feed_animals(harvest_stores, animals_on_farm):
     feed_use : pd.Series
         Contains the kg amount determined for feed for each crop.
     """
+    stock = harvest_stores.stock
     feed_needs = mk_feed_needs(animals_on_farm)
-    feeding_groups_used = determine_feeding_groups(feed_needs, harvest_stores)
+    group_yields = mk_group_yields(stock)
+    feeding_groups_used = determine_feeding_groups(feed_needs, group_yields)
     # While harvest stores cannot meet feed needs reduce herd size.
     while feeding_groups_used == 0:
-        al.reduce_animal(animals_on_farm)
+        al.reduce_animal(animals_on_farm, 'feed')
         feed_needs = mk_feed_needs(animals_on_farm)
         feeding_groups_used = determine_feeding_groups(feed_needs,
-                                                       harvest_stores)
+                                                       group_yields)
     feed_limits = mk_feed_limits(animals_on_farm)
-    feed_use = pd.Series(0.0, index=harvest_stores.index)
+    feed_use = pd.Series(0.0, index=stock.index)
+    harvest_stores.checkpoint()
+    first_groups = feeding_groups_used
 
     # Try to find feed composition meeting nutrient boundries.
     while sum(feed_use) == 0 and\
             feeding_groups_used <= max(gd.plant_data['feeding_priority']):
-        harvest_stores_temp = harvest_stores.copy()
-        feed_limits_temp = feed_limits.copy()
-        feed_needs_temp = feed_needs.copy()
+        harvest_stores.rollback()
         feed_use, feed_limits_remain =\
-            find_feed_optim(harvest_stores_temp, feed_needs_temp,
-                            feed_limits_temp, feeding_groups_used)
+            find_feed_optim(stock, feed_needs, feed_limits,
+                            feeding_groups_used)
+        harvest_stores.withdraw('feed', feed_use)
         feeding_groups_used += 1
 
     feeding_groups_used -= 1
+    tr.record('tier_escalation', count=feeding_groups_used - first_groups,
+              value=feeding_groups_used)
     minimal_herd = gd.estate_values['female_ratio'] * 3 +\
         gd.estate_values['male_ratio'] * 2
     # If no feed composition can be found reduce herd size to try and solve it.
     while sum(feed_use) == 0 and sum(animals_on_farm) > minimal_herd:
-        al.reduce_animal(animals_on_farm)
+        harvest_stores.rollback()
+        al.reduce_animal(animals_on_farm, 'feed')
         # maybe base reduce animal on overfeeding (feed_limit_remain)?
         feed_needs = mk_feed_needs(animals_on_farm)
         feed_limits = mk_feed_limits(animals_on_farm)
-        harvest_stores_temp = harvest_stores.copy()
         feed_use, feed_limits_remain =\
-            find_feed_optim(harvest_stores_temp, feed_needs, feed_limits,
+            find_feed_optim(stock, feed_needs, feed_limits,
                             feeding_groups_used)
+        harvest_stores.withdraw('feed', feed_use)
     if sum(feed_use) == 0:
         print('could not meet herd diet restraints')
+        tr.record('diet_failure', count=sum(animals_on_farm))
     return feed_use
@@ -0,0 +1,182 @@
+"""
+Author: Siebrant Hendriks.
+
+Supplementary script for booking the material flows of the farm
+
+Every Kg of matter going to a destination (feed, bedding, manure, biodigestor,
+mulch, sale, ...) yields the quantities in that destination's coefficient
+matrix, see global_data.mk_flow_coefficients. The flows of a year to one
+destination are booked with a single matrix product, and the flows of a whole
+run can be written out as a per-year flow table.
+"""
+import pandas as pd
+import global_data as gd
+
+# Quantities kept in the fertile molecule stores until the end of the year,
+# by their results column.
+FERTILE_MOLECULES = {'nitrogen_balance': 'nitrogen',
+                     'phosphorus_balance': 'phosphorus'}
+
+# Ledger entries holding the yearly amounts going to a destination.
+LEDGER_ENTRIES = {'bedding': 'bedding', 'feed': 'feed',
+                  'digestor': 'digestor', 'mulch': 'mulch', 'sale': 'sold'}
+
+
+def align_amounts(destination, amounts):
+    """
+    Align amounts of matter on the materials of a destination.
+
+    Parameters
+    ----------
+    destination : str
+        Name of the destination, as in gd.flow_coefficients.
+    amounts : pd.Series or pd.DataFrame
+        Kg amount by material, or a (years x materials) frame of them.
+
+    Returns
+    -------
+    amounts : pd.Series or pd.DataFrame
+        Kg amount of every material of the destination, 0 when missing.
+
+    """
+    materials = gd.flow_coefficients[destination].index
+    if isinstance(amounts, pd.DataFrame):
+        amounts = amounts.reindex(columns=materials, fill_value=0.0)
+    else:
+        amounts = amounts.reindex(materials, fill_value=0.0)
+    amounts = amounts.astype('float').fillna(0.0)
+    return amounts
+
+
+def flow_totals(destination, amounts):
+    """
+    Calculate the quantities yielded by matter going to a destination.
+
+    Parameters
+    ----------
+    destination : str
+        Name of the destination, as in gd.flow_coefficients.
+    amounts : pd.Series or pd.DataFrame
+        Kg amount by material, or a (years x materials) frame of them.
+
+    Returns
+    -------
+    totals : pd.Series or pd.DataFrame
+        Yielded amount by quantity, or a (years x quantities) frame of them.
+
+    """
+    coefficients = gd.flow_coefficients[destination]
+    totals = align_amounts(destination, amounts) @ coefficients
+    return totals
+
+
+def book(destination, amounts):
+    """
+    Book the quantities yielded by matter going to a destination this year.
+
+    Parameters
+    ----------
+    destination : str
+        Name of the destination, as in gd.flow_coefficients.
+    amounts : pd.Series
+        Kg amount of each material going to the destination.
+
+    Returns
+    -------
+    None;
+    Nitrogen and phosphorus get added to the fertile molecules, all other
+    quantities to this year's results.
+
+    """
+    coefficients = gd.flow_coefficients[destination]
+    totals = flow_totals(destination, amounts)
+    totals = totals[(coefficients != 0).any()]
+    for quantity, molecule in FERTILE_MOLECULES.items():
+        if quantity in totals.index:
+            gd.fertile_molecules[molecule] += totals.pop(quantity)
+    if len(totals) > 0:
+        gd.results.loc[f'year_{gd.year}', totals.index] += totals
+
+
+def ledger_amounts(ledger, destination):
+    """
+    Get the yearly amounts going to a destination from a run's trajectory.
+
+    Parameters
+    ----------
+    ledger : dict
+        Physical trajectory of a run, see recompute_functions.mk_ledger.
+    destination : str
+        Name of the destination, as in gd.flow_coefficients.
+
+    Returns
+    -------
+    amounts : pd.DataFrame
+        (years x materials) frame of Kg amounts.
+
+    """
+    years = ledger['herd'].index
+    if destination == 'harvest':
+        amounts = pd.DataFrame([ledger['harvest']] * len(years), index=years)
+    elif destination == 'manure':
+        amounts = ledger['herd'] * gd.animal_data['manure_pasture_production']
+    else:
+        amounts = ledger[LEDGER_ENTRIES[destination]]
+    return amounts
+
+
+def mk_flow_table(ledger):
+    """
+    Make a table of all material flows of a run.
+
+    Parameters
+    ----------
+    ledger : dict
+        Physical trajectory of a run, see recompute_functions.mk_ledger.
+
+    Returns
+    -------
+    flow_table : pd.DataFrame
+        One row per year, destination and material with the Kg amount going
+        there and every quantity it yields, e.g. for a Sankey diagram.
+
+    """
+    tables = []
+    for destination, coefficients in gd.flow_coefficients.items():
+        amounts = align_amounts(destination,
+                                ledger_amounts(ledger, destination))
+        flows = amounts.stack()
+        flows = flows[flows != 0]
+        flows.index.names = ['year', 'material']
+        table = coefficients.loc[flows.index.get_level_values('material')]
+        table = table.mul(flows.to_numpy(), axis=0)
+        table.index = flows.index
+        table.insert(0, 'Kg', flows.to_numpy())
+        table.insert(0, 'destination', destination)
+        tables.append(table)
+    flow_table = pd.concat(tables).reset_index()
+    flow_table = flow_table[['year', 'destination', 'material', 'Kg',
+                             *gd.FLOW_QUANTITIES]]
+    flow_table = flow_table.sort_values(
+        'year', kind='stable', key=lambda years: years.map(gd.sort_by_num))
+    return flow_table
+
+
+def write_flow_table(path, ledger):
+    """
+    Write the material flows of a run to a csv file.
+
+    Parameters
+    ----------
+    path : str
+        Name of the csv file to write.
+    ledger : dict
+        Physical trajectory of a run, see recompute_functions.mk_ledger.
+
+    Returns
+    -------
+    None.
+
+    """
+    mk_flow_table(ledger).to_csv(path, index=False)
+    print(f'material flows written to {path}')
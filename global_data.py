@@ -3,173 +3,520 @@ Author: Siebrant Hendriks.
 
 generates global data used by farm squire.
 """
+import os
 from sys import argv
 import re
 import numpy as np
 import pandas as pd
 
+# Days per year animals spend in the barn, when the estate sheet has no
+# barn_days.
+DEFAULT_BARN_DAYS = 192
+
+# Part of the nitrogen in applied matter that ends up in the soil, when the
+# estate sheet has no row of the same name.
+DEFAULT_N_RETENTION = {'manure_N_retention': 0.63,
+                       'digestate_N_retention': 0.52,
+                       'mulch_N_retention': 0.8,
+                       'deep_litter_N_retention': 0.7}
+
+# Kinds of animal matter kept in store next to the crops.
+ANIMAL_MATTER = ['chicken_manure', 'horse_manure', 'deep_litter']
+
+# Quantities booked for matter going to a destination, by results column.
+FLOW_QUANTITIES = ['nitrogen_balance', 'phosphorus_balance',
+                   'manure_methane_emissions', 'digestate_produced',
+                   'electricity_balance', 'biomethane_produced',
+                   'revenue_balance_crops', 'food_energy_produced',
+                   'food_protein_produced', 'food_fat_produced']
+
+
+def read_input(filename):
+    """
+    Read the four sheets of an input file.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the input file.
+
+    Returns
+    -------
+    input_sheets : dict
+        Contains the estate, crops, animal and biodigestor sheets as they are
+        in the input file.
+
+    """
+    input_file = pd.ExcelFile(filename)
+    input_sheets = {}
+    for sheet_name in ['estate', 'crops', 'animal', 'biodigestor']:
+        input_sheets[sheet_name] = pd.read_excel(input_file,
+                                                 sheet_name=sheet_name,
+                                                 index_col=0)
+    input_file.close()
+    return input_sheets
+
+
+def get_input_sheets():
+    """
+    Get the input sheets the current run is based on.
+
+    Returns
+    -------
+    input_sheets : dict
+        Contains the estate, crops, animal and biodigestor sheets as they are
+        in the input file.
+
+    """
+    input_sheets = {'estate': estate_data_ori,
+                    'crops': plant_data_ori,
+                    'animal': animal_data_ori,
+                    'biodigestor': biodigestor_data_ori}
+    return input_sheets
+
+
+def split_field(field):
+    """
+    Find where an input field is in the input sheets.
+
+    Parameters
+    ----------
+    field : str
+        Input field written as 'estate:property' for estate fields and as
+        'sheet:property:item' for fields of a single crop, animal or
+        biodigestor input, e.g. 'estate:fuel_price' or
+        'crops:yield_DM:Oat_hay'.
+
+    Raises
+    ------
+    ValueError
+        When the field is not written in either form.
+
+    Returns
+    -------
+    sheet_name : str
+        Name of the input sheet.
+    prop : str
+        Row (property) of the field.
+    item : str
+        Column of the field, 'amount' for estate fields.
+
+    """
+    parts = field.split(':')
+    if parts[0] == 'estate' and len(parts) == 2:
+        return parts[0], parts[1], 'amount'
+    if parts[0] in ['crops', 'animal', 'biodigestor'] and len(parts) == 3:
+        return parts[0], parts[1], parts[2]
+    raise ValueError(f'input field {field} is not of the form '
+                     'estate:property or sheet:property:item')
+
+
+def get_input_value(input_sheets, field):
+    """
+    Get the value of an input field.
+
+    Parameters
+    ----------
+    input_sheets : dict
+        Contains the estate, crops, animal and biodigestor sheets as they are
+        in the input file.
+    field : str
+        Input field, see split_field.
+
+    Raises
+    ------
+    ValueError
+        When the field does not exist in the input sheets.
+
+    Returns
+    -------
+    value : float
+        Value of the field.
+
+    """
+    sheet_name, prop, item = split_field(field)
+    sheet = input_sheets[sheet_name]
+    if prop not in sheet.index or item not in sheet.columns:
+        raise ValueError(f'input field {field} does not exist')
+    value = float(sheet.loc[prop, item])
+    return value
+
+
+def override_input(input_sheets, overrides):
+    """
+    Make a copy of the input sheets with some input fields changed.
+
+    Parameters
+    ----------
+    input_sheets : dict
+        Contains the estate, crops, animal and biodigestor sheets as they are
+        in the input file.
+    overrides : dict
+        New values by input field, see split_field.
+
+    Raises
+    ------
+    ValueError
+        When a field does not exist in the input sheets.
+
+    Returns
+    -------
+    new_sheets : dict
+        Copy of the input sheets with the new values filled in.
+
+    """
+    new_sheets = {name: sheet.copy() for name, sheet in input_sheets.items()}
+    for field, value in overrides.items():
+        sheet_name, prop, item = split_field(field)
+        sheet = new_sheets[sheet_name]
+        if prop not in sheet.index or item not in sheet.columns:
+            raise ValueError(f'input field {field} does not exist')
+        if sheet[item].dtype != 'float':
+            sheet[item] = sheet[item].astype('float')
+        sheet.loc[prop, item] = value
+    return new_sheets
+
 
-print('startup, please wait...')
-# read input file, defaults to example if no other file is given.
-if len(argv) > 1:
-    FILENAME = argv[1]
-else:
-    FILENAME = 'input_example.xlsx'
-input_file = pd.ExcelFile(FILENAME)
-
-estate_data = pd.read_excel(input_file, sheet_name='estate', index_col=0)
-plant_data = pd.read_excel(input_file, sheet_name='crops', index_col=0)
-animal_data = pd.read_excel(input_file, sheet_name='animal', index_col=0)
-biodigestor_data = pd.read_excel(input_file, sheet_name='biodigestor',
-                                 index_col=0)
-input_file.close()
-
-estate_data_ori = estate_data.copy()
-plant_data_ori = plant_data.copy()
-animal_data_ori = animal_data.copy()
-biodigestor_data_ori = biodigestor_data.copy()
-
-# format input files for internal use
-estate_units = estate_data['unit_of_measurement']
-estate_values = estate_data['amount']
-
-plant_units = plant_data.pop('unit_of_measurement')
-plant_data = plant_data.T
-plant_data = plant_data.astype('float')
-
-type_dict = {'feeding_priority': 'int',
-             'bedding_use': 'bool',
-             'bioprocessor_use': 'bool',
-             'mulch_use': 'bool',
-             'sale_use': 'bool'}
-plant_data = plant_data.astype(type_dict)
-
-UNIT_CHANGE = 'feed_protein_content'
-plant_data[UNIT_CHANGE] = plant_data[UNIT_CHANGE] / 1000
-plant_units[UNIT_CHANGE] = 'Kg/Kg'
-
-animal_units = animal_data.pop('unit_of_measurement')
-animal_data = animal_data.T
-animal_data = animal_data.astype({'initial_animal_count': 'int'})
-
-biodigestor_units = biodigestor_data.pop('unit_of_measurement')
-biodigestor_data = biodigestor_data.T
-
-# calculate yearly harvest yield
-grassland_ratio_total = sum(plant_data['grassland_ratio'])
-cropping_ratio_total = sum(plant_data['cropping_ratio'])
-
-plant_data['grassland_ratio'] = (plant_data['grassland_ratio'] /
-                                 grassland_ratio_total)
-plant_data['cropping_ratio'] = (plant_data['cropping_ratio'] /
-                                cropping_ratio_total)
-
-grassland_yields = (plant_data['grassland_ratio'] *
-                    estate_values['cultivated_grasslands'] *
-                    plant_data['yield_DM'])
-cropping_yields = (plant_data['cropping_ratio'] *
-                   estate_values['cropping_area'] *
-                   plant_data['yield_DM'])
-
-harvest_yield = np.floor(grassland_yields + cropping_yields)
-harvest_yield = harvest_yield.astype('int')
-
-# calculate yearly flat crop money balance
-grassland_ha = plant_data['grassland_ratio'] *\
-    estate_values['cultivated_grasslands']
-cropping_ha = plant_data['cropping_ratio'] *\
-    estate_values['cropping_area']
-harvest_ha = grassland_ha + cropping_ha
-crop_balance = sum(plant_data['subsidies'] * harvest_ha)
-crop_balance -= estate_values['rented_land'] * estate_values['land_rent']
-crop_balance -= sum(harvest_yield * plant_data['cultivation_costs'])
-crop_balance -= sum(harvest_yield * plant_data['contract_work_costs'])
-labour = sum(harvest_yield * plant_data['general_labour_needed'])
-regular_labour_avail = estate_values['max_yearly_regular_labour']
-if labour > regular_labour_avail:
-    labour -= regular_labour_avail
-    labour_cost = regular_labour_avail * estate_values['regular_labour_cost']
-    labour_cost += labour * estate_values['casual_labour_cost']
-else:
-    labour_cost = labour * estate_values['regular_labour_cost']
-crop_balance -= labour_cost
-fuel_use = estate_values['fuel_use_harvester_grassland'] *\
-    estate_values['cultivated_grasslands']
-fuel_use += estate_values['fuel_use_harvester_meadow'] *\
-    estate_values['dry_meadow/field']
-fuel_use += estate_values['fuel_use_harvester_cropping'] *\
-    estate_values['cropping_area']
-fuel_cost = fuel_use * estate_values['fuel_price']
-crop_balance -= fuel_cost
-
-# check brewery
-brewery = False
-if harvest_ha['Barley'] + harvest_ha['Barley_straw'] >=\
-        estate_values['BSG/BSY_from_barley_only_at']:
-    brewery = True
-if brewery:
-    harvest_yield['BS_grain'] = int(np.floor(estate_values['import_BSG_DM']))
-    harvest_yield['BS_yeast'] = int(np.floor(estate_values['import_BSY_DM']))
-
-# calculate yearly phosphorus and nitrogen needed to fertilize crops
-p_use = 0.0
-n_use = 0.0
-for label, amount in harvest_yield.items():
-    p_use += plant_data['P_content'].loc[label] * amount
-    n_use += plant_data['N_content'].loc[label] * amount
-
-# make intermediate pd.Series used for tracking nitrogen and phosphorus changes
-fertile_molecules = pd.Series(0.0, index=['phosphorus', 'nitrogen'])
-
-# split initial herd from data
-animals_on_farm = animal_data.pop('initial_animal_count')
-
-# divide animal types in male, castrated and female
-CATEGORIES = ' '.join(animals_on_farm.index)
-castrated_labs = re.findall(r'(?: |^)(male_castrated_\d+_year)', CATEGORIES)
-male_labs = re.findall(r'(?: |^)(male_\d+_year)', CATEGORIES)
-female_labs = re.findall(r'(?: |^)(female_\d+_year)', CATEGORIES)
 def sort_by_num(entry):
     number = re.search(r'\d+', entry)
     return int(number.group())
-castrated_labs.sort(reverse=True, key=sort_by_num)
-male_labs.sort(reverse=True, key=sort_by_num)
-female_labs.sort(reverse=True, key=sort_by_num)
-
-# calculate livestock units the farm can support
-grass_size = estate_values['cultivated_grasslands']
-grass_sr = estate_values['stocking_rate_grasslands']
-meadow_size = estate_values['dry_meadow/field']
-meadow_sr = estate_values['stocking_rate_meadow']
-livestock_units_max = grass_size * grass_sr + meadow_size * meadow_sr
-
-# initialize result dataframes
-year = 1
-result_init = {'revenue_balance_animal': '€', 'revenue_balance_crops': '€',
-               'food_energy_produced': 'Kcal',
-               'food_protein_produced': 'gr/Kg', 'food_fat_produced': 'gr/Kg',
-               'electricity_balance': 'MJ', 'digestate_produced': 'Kg',
-               'biomethane_produced': 'g_CH4', 'phosphorus_balance': 'g_P',
-               'nitrogen_balance': 'g_N',
-               'digestion_methane_emissions': 'g_CH4',
-               'manure_methane_emissions': 'g_CH4'}
-results = pd.DataFrame(result_init, index=['unit'])
-result_rows = []
-for yr in range(1, int(estate_values['runtime'])+1, 1):
-    new_row = pd.Series(0.0, index=results.columns, name=f'year_{yr}')
-    result_rows.append(new_row.copy())
-results_empty = pd.DataFrame(result_rows)
-results = pd.concat([results, results_empty], axis=0, copy=False)
-
-animals_on_farm.name = 'year_1'
-herd_results = [animals_on_farm.copy()]
-
-crops_sold = []
-feed_used = []
-digestor_used = []
-mulch_used = []
-bedding_used = []
 
+
+def mk_flow_coefficients(n_retention):
+    """
+    Make the quantities yielded per Kg of matter going to each destination.
+
+    Parameters
+    ----------
+    n_retention : dict
+        Part of the nitrogen that ends up in the soil, by retention name (see
+        DEFAULT_N_RETENTION).
+
+    Returns
+    -------
+    flow_coefficients : dict
+        (materials x FLOW_QUANTITIES) pd.DataFrame by destination: harvest,
+        bedding, feed, manure (by animal), digestor, mulch and sale.
+
+    """
+    n_content = plant_data['N_content'].copy()
+    p_content = plant_data['P_content'].copy()
+    for label in ANIMAL_MATTER:
+        n_content[label] = estate_values[f'{label}_N_content']
+        p_content[label] = estate_values[f'{label}_P_content']
+    crops = plant_data.index
+    digestor = biodigestor_data.index
+    mulch = crops.append(pd.Index(['deep_litter']))
+    flow_coefficients = {
+        destination: pd.DataFrame(0.0, index=materials,
+                                  columns=FLOW_QUANTITIES)
+        for destination, materials in [('harvest', crops), ('bedding', crops),
+                                       ('feed', crops),
+                                       ('manure', animal_data.index),
+                                       ('digestor', digestor),
+                                       ('mulch', mulch), ('sale', crops)]}
+
+    harvest = flow_coefficients['harvest']
+    harvest['nitrogen_balance'] = plant_data['N_fixation']
+    harvest['phosphorus_balance'] = plant_data['P_fixation']
+
+    manure = flow_coefficients['manure']
+    manure['nitrogen_balance'] = animal_data['manure_nitrogen_content'] *\
+        n_retention['manure_N_retention']
+    manure['phosphorus_balance'] = animal_data['manure_phosphorus_content']
+    manure['manure_methane_emissions'] = animal_data['manure_methane_content']
+
+    digested = flow_coefficients['digestor']
+    digested['nitrogen_balance'] = n_content.reindex(digestor) *\
+        n_retention['digestate_N_retention']
+    digested['phosphorus_balance'] = p_content.reindex(digestor)
+    digested['digestate_produced'] = biodigestor_data['digestate']
+    digested['electricity_balance'] = biodigestor_data['electricity']
+    digested['biomethane_produced'] = biodigestor_data['biomethane']
+
+    mulched = flow_coefficients['mulch']
+    mulched['nitrogen_balance'] = n_content.reindex(mulch) *\
+        n_retention['mulch_N_retention']
+    mulched.loc['deep_litter', 'nitrogen_balance'] =\
+        n_content['deep_litter'] * n_retention['deep_litter_N_retention']
+    mulched['phosphorus_balance'] = p_content.reindex(mulch)
+
+    sale = flow_coefficients['sale']
+    sale['revenue_balance_crops'] = plant_data['sale_value']
+    sale['food_energy_produced'] = plant_data['food_energy_content']
+    sale['food_protein_produced'] = plant_data['food_protein_content']
+    sale['food_fat_produced'] = plant_data['food_fat_content']
+
+    for destination, coefficients in flow_coefficients.items():
+        flow_coefficients[destination] =\
+            coefficients.astype('float').fillna(0.0)
+    return flow_coefficients
+
+
+def setup(input_sheets):
+    """
+    Format input data for internal use and calculate all yearly constants.
+
+    Parameters
+    ----------
+    input_sheets : dict
+        Contains the estate, crops, animal and biodigestor sheets as they are
+        in the input file.
+
+    Returns
+    -------
+    None;
+    All data gets set in global variables, and the run is reset.
+
+    """
+    global estate_data, plant_data, animal_data, biodigestor_data
+    global estate_data_ori, plant_data_ori, animal_data_ori
+    global biodigestor_data_ori, estate_units, estate_values, plant_units
+    global animal_units, biodigestor_units, grassland_yields, cropping_yields
+    global harvest_yield, harvest_ha, crop_balance, fuel_use, brewery
+    global p_use, n_use, initial_herd, castrated_labs, male_labs, female_labs
+    global livestock_units_max, barn_days, grass_share, n_retention
+    global flow_coefficients
+    global materials, material_uses
+
+    estate_data = input_sheets['estate'].copy()
+    plant_data = input_sheets['crops'].copy()
+    animal_data = input_sheets['animal'].copy()
+    biodigestor_data = input_sheets['biodigestor'].copy()
+
+    estate_data_ori = estate_data.copy()
+    plant_data_ori = plant_data.copy()
+    animal_data_ori = animal_data.copy()
+    biodigestor_data_ori = biodigestor_data.copy()
+
+    # format input files for internal use
+    estate_units = estate_data['unit_of_measurement']
+    estate_values = estate_data['amount']
+
+    plant_units = plant_data.pop('unit_of_measurement')
+    plant_data = plant_data.T
+    plant_data = plant_data.astype('float')
+
+    type_dict = {'feeding_priority': 'int',
+                 'bedding_use': 'bool',
+                 'bioprocessor_use': 'bool',
+                 'mulch_use': 'bool',
+                 'sale_use': 'bool'}
+    plant_data = plant_data.astype(type_dict)
+
+    unit_change = 'feed_protein_content'
+    plant_data[unit_change] = plant_data[unit_change] / 1000
+    plant_units[unit_change] = 'Kg/Kg'
+
+    animal_units = animal_data.pop('unit_of_measurement')
+    animal_data = animal_data.T
+    animal_data = animal_data.astype({'initial_animal_count': 'int'})
+
+    biodigestor_units = biodigestor_data.pop('unit_of_measurement')
+    biodigestor_data = biodigestor_data.T
+
+    # calculate yearly harvest yield
+    grassland_ratio_total = sum(plant_data['grassland_ratio'])
+    cropping_ratio_total = sum(plant_data['cropping_ratio'])
+
+    plant_data['grassland_ratio'] = (plant_data['grassland_ratio'] /
+                                     grassland_ratio_total)
+    plant_data['cropping_ratio'] = (plant_data['cropping_ratio'] /
+                                    cropping_ratio_total)
+
+    grassland_yields = (plant_data['grassland_ratio'] *
+                        estate_values['cultivated_grasslands'] *
+                        plant_data['yield_DM'])
+    cropping_yields = (plant_data['cropping_ratio'] *
+                       estate_values['cropping_area'] *
+                       plant_data['yield_DM'])
+
+    harvest_yield = np.floor(grassland_yields + cropping_yields)
+    harvest_yield = harvest_yield.astype('int')
+
+    # calculate yearly flat crop money balance
+    grassland_ha = plant_data['grassland_ratio'] *\
+        estate_values['cultivated_grasslands']
+    cropping_ha = plant_data['cropping_ratio'] *\
+        estate_values['cropping_area']
+    harvest_ha = grassland_ha + cropping_ha
+    crop_balance = sum(plant_data['subsidies'] * harvest_ha)
+    crop_balance -= estate_values['rented_land'] * estate_values['land_rent']
+    crop_balance -= sum(harvest_yield * plant_data['cultivation_costs'])
+    crop_balance -= sum(harvest_yield * plant_data['contract_work_costs'])
+    labour = sum(harvest_yield * plant_data['general_labour_needed'])
+    regular_labour_avail = estate_values['max_yearly_regular_labour']
+    if labour > regular_labour_avail:
+        labour -= regular_labour_avail
+        labour_cost = regular_labour_avail *\
+            estate_values['regular_labour_cost']
+        labour_cost += labour * estate_values['casual_labour_cost']
+    else:
+        labour_cost = labour * estate_values['regular_labour_cost']
+    crop_balance -= labour_cost
+    fuel_use = estate_values['fuel_use_harvester_grassland'] *\
+        estate_values['cultivated_grasslands']
+    fuel_use += estate_values['fuel_use_harvester_meadow'] *\
+        estate_values['dry_meadow/field']
+    fuel_use += estate_values['fuel_use_harvester_cropping'] *\
+        estate_values['cropping_area']
+    fuel_cost = fuel_use * estate_values['fuel_price']
+    crop_balance -= fuel_cost
+
+    # check brewery
+    brewery = False
+    if harvest_ha['Barley'] + harvest_ha['Barley_straw'] >=\
+            estate_values['BSG/BSY_from_barley_only_at']:
+        brewery = True
+    if brewery:
+        harvest_yield['BS_grain'] =\
+            int(np.floor(estate_values['import_BSG_DM']))
+        harvest_yield['BS_yeast'] =\
+            int(np.floor(estate_values['import_BSY_DM']))
+
+    # material registry: all crops followed by the animal matter, each at a
+    # fixed position, with the uses set on the crops sheet (none for the
+    # animal matter, its use is fixed).
+    materials = harvest_yield.index.append(pd.Index(ANIMAL_MATTER))
+    material_uses = plant_data[['bedding_use', 'bioprocessor_use', 'mulch_use',
+                                'sale_use']].reindex(materials,
+                                                     fill_value=False)
+
+    # calculate yearly phosphorus and nitrogen needed to fertilize crops
+    p_use = 0.0
+    n_use = 0.0
+    for label, amount in harvest_yield.items():
+        p_use += plant_data['P_content'].loc[label] * amount
+        n_use += plant_data['N_content'].loc[label] * amount
+
+    # split initial herd from data
+    initial_herd = animal_data.pop('initial_animal_count')
+
+    # divide animal types in male, castrated and female
+    categories = ' '.join(initial_herd.index)
+    castrated_labs = re.findall(r'(?: |^)(male_castrated_\d+_year)',
+                                categories)
+    male_labs = re.findall(r'(?: |^)(male_\d+_year)', categories)
+    female_labs = re.findall(r'(?: |^)(female_\d+_year)', categories)
+    castrated_labs.sort(reverse=True, key=sort_by_num)
+    male_labs.sort(reverse=True, key=sort_by_num)
+    female_labs.sort(reverse=True, key=sort_by_num)
+
+    # calculate livestock units the farm can support
+    grass_size = estate_values['cultivated_grasslands']
+    grass_sr = estate_values['stocking_rate_grasslands']
+    meadow_size = estate_values['dry_meadow/field']
+    meadow_sr = estate_values['stocking_rate_meadow']
+    livestock_units_max = grass_size * grass_sr + meadow_size * meadow_sr
+
+    # share of the feed that may be grass, i.e. the part of the year animals
+    # are not in the barn. Input files without barn days use the default.
+    barn_days = estate_values.get('barn_days', DEFAULT_BARN_DAYS)
+    grass_share = (365 - barn_days) / 365
+
+    # quantities yielded by matter going to each destination, like the
+    # nitrogen and phosphorus in mulch or the revenue of crops sold.
+    n_retention = {name: estate_values.get(name, default)
+                   for name, default in DEFAULT_N_RETENTION.items()}
+    flow_coefficients = mk_flow_coefficients(n_retention)
+
+    reset_run()
+
+
+def reset_run():
+    """
+    Reset all data that changes during a run to the start of year one.
+
+    Returns
+    -------
+    None;
+    All data gets set in global variables.
+
+    """
+    global year, results, herd_results, animals_on_farm, fertile_molecules
+    global crops_sold, feed_used, digestor_used, mulch_used, bedding_used
+    global report_order, slaughter_count, herd_year_end, animals_slaughtered
+
+    # make intermediate pd.Series used for tracking nitrogen and phosphorus
+    # changes
+    fertile_molecules = pd.Series(0.0, index=['phosphorus', 'nitrogen'])
+
+    animals_on_farm = initial_herd.copy()
+
+    # initialize result dataframes
+    year = 1
+    result_init = {'revenue_balance_animal': '€',
+                   'revenue_balance_crops': '€',
+                   'food_energy_produced': 'Kcal',
+                   'food_protein_produced': 'gr/Kg',
+                   'food_fat_produced': 'gr/Kg',
+                   'electricity_balance': 'MJ', 'digestate_produced': 'Kg',
+                   'biomethane_produced': 'g_CH4',
+                   'phosphorus_balance': 'g_P', 'nitrogen_balance': 'g_N',
+                   'digestion_methane_emissions': 'g_CH4',
+                   'manure_methane_emissions': 'g_CH4'}
+    results = pd.DataFrame(result_init, index=['unit'])
+    result_rows = []
+    for yr in range(1, int(estate_values['runtime'])+1, 1):
+        new_row = pd.Series(0.0, index=results.columns, name=f'year_{yr}')
+        result_rows.append(new_row.copy())
+    results_empty = pd.DataFrame(result_rows)
+    results = pd.concat([results, results_empty], axis=0, copy=False)
+
+    animals_on_farm.name = 'year_1'
+    herd_results = [animals_on_farm.copy()]
+
+    # (runtime x materials) report matrices, one row written per year and
+    # NaN where a material was not considered that year. The order gives for
+    # each material the rank in which it first appeared in a report, -1 if
+    # it never did.
+    report_shape = (int(estate_values['runtime']), len(materials))
+    crops_sold = np.full(report_shape, np.nan)
+    feed_used = np.full(report_shape, np.nan)
+    digestor_used = np.full(report_shape, np.nan)
+    mulch_used = np.full(report_shape, np.nan)
+    bedding_used = np.full(report_shape, np.nan)
+    report_order = {report: np.full(len(materials), -1)
+                    for report in ['crops_sold', 'feed_used', 'digestor_used',
+                                   'mulch_used', 'bedding_used']}
+
+    # physical trajectory of the run: herd at the end of each year and the
+    # animals slaughtered during it.
+    slaughter_count = pd.Series(0, index=animals_on_farm.index)
+    herd_year_end = []
+    animals_slaughtered = []
+
+
+def use_input_file(filename):
+    """
+    Run on the given input file, reading it unless it was read at startup.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the input file.
+
+    Returns
+    -------
+    None;
+    All data gets set in global variables, and the run is reset.
+
+    """
+    global FILENAME
+    if filename != FILENAME:
+        FILENAME = filename
+        setup(read_input(filename))
+
+
+print('startup, please wait...')
+# read input file, defaults to example if no other file is given. A directory
+# or pattern of input files (see squire_batch) is not read here.
+if len(argv) > 1 and not argv[1].startswith('-') and\
+        not os.path.isdir(argv[1]) and not set('*?[') & set(argv[1]):
+    FILENAME = argv[1]
+else:
+    FILENAME = 'input_example.xlsx'
+setup(read_input(FILENAME))
 print('startup complete\n')
 
 
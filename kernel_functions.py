@@ -0,0 +1,475 @@
+"""
+Author: Siebrant Hendriks.
+
+Supplementary script with compiled kernels for the hottest loops
+
+Aging the herd and the greedy feed loop do scalar arithmetic step by step,
+which is slow in Python. When Numba is installed both are compiled from the
+kernels below, working on arrays of the herd, stores and crop attributes. The
+kernels repeat every operation of the Python code in the same order, so both
+give exactly the same results under the same seed. Without Numba the Python
+code is used.
+"""
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Use the compiled kernels, only possible when Numba is installed.
+use_jit = numba is not None
+
+# Reasons animals get slaughtered while aging the herd, by their row in the
+# slaughtered matrix of age_herd.
+SLAUGHTER_REASONS = ['max_age', 'not_pregnant', 'male_surplus']
+
+
+def jit(function):
+    """
+    Compile a kernel with Numba, if it is installed.
+
+    Parameters
+    ----------
+    function : function
+        Kernel written in the subset of Python Numba compiles.
+
+    Returns
+    -------
+    function
+        The compiled kernel, or the kernel itself without Numba.
+
+    """
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+
+@jit
+def pairwise_sum(values):
+    """
+    Sum values exactly like np.sum does, using pairwise summation.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Contiguous float values.
+
+    Returns
+    -------
+    total : float
+        Sum of the values.
+
+    """
+    size = len(values)
+    if size < 8:
+        total = -0.0
+        for pos in range(size):
+            total += values[pos]
+        return total
+    if size <= 128:
+        partial = values[:8].copy()
+        pos = 8
+        while pos < size - size % 8:
+            for lane in range(8):
+                partial[lane] += values[pos + lane]
+            pos += 8
+        total = ((partial[0] + partial[1]) + (partial[2] + partial[3])) +\
+            ((partial[4] + partial[5]) + (partial[6] + partial[7]))
+        while pos < size:
+            total += values[pos]
+            pos += 1
+        return total
+    half = size // 2
+    half -= half % 8
+    return pairwise_sum(values[:half]) + pairwise_sum(values[half:])
+
+
+@jit
+def slaughter(herd_pos, amount, reason, head_yields, totals, slaughtered):
+    """
+    Book the yields of slaughtered animals head by head.
+
+    Parameters
+    ----------
+    herd_pos : int
+        Position of the animal type in the herd.
+    amount : int
+        Amount of animals slaughtered.
+    reason : int
+        Why they were slaughtered, a row of slaughtered.
+    head_yields : np.ndarray
+        (animals x 4) revenue, food energy, protein and fat of one head.
+    totals : np.ndarray
+        Revenue, food energy, protein and fat produced this year.
+    slaughtered : np.ndarray
+        (reasons x animals) amount of animals slaughtered this year, see
+        SLAUGHTER_REASONS.
+
+    Returns
+    -------
+    None;
+    totals and slaughtered get altered in place.
+
+    """
+    for _ in range(amount):
+        slaughtered[reason, herd_pos] += 1
+        for column in range(4):
+            totals[column] += head_yields[herd_pos, column]
+
+
+@jit
+def age_herd(herd, castrated, females, males, fertility, fertility_draws,
+             sex_draws, male_ratio, newborns, head_yields, totals,
+             slaughtered):
+    """
+    Age the herd by one year, see animal_lifecycle_functions.age_herd.
+
+    Parameters
+    ----------
+    herd : np.ndarray
+        Amount of animals of every type.
+    castrated : np.ndarray
+        Herd positions of the castrated males, oldest first.
+    females : np.ndarray
+        Herd positions of the females, oldest first.
+    males : np.ndarray
+        Herd positions of the fertile males but the newborns, oldest first.
+    fertility : np.ndarray
+        Fertility rate of every animal type.
+    fertility_draws : np.ndarray
+        Random number rounding the births of each female type.
+    sex_draws : np.ndarray
+        Random number deciding the sex of the odd newborn of each female type.
+    male_ratio : float
+        Fertile females per fertile male wanted.
+    newborns : np.ndarray
+        Herd positions of male_0_year, female_0_year, male_1_year and
+        male_castrated_1_year.
+    head_yields : np.ndarray
+        (animals x 4) revenue, food energy, protein and fat of one head.
+    totals : np.ndarray
+        Revenue, food energy, protein and fat produced this year.
+    slaughtered : np.ndarray
+        (reasons x animals) amount of animals slaughtered this year, see
+        SLAUGHTER_REASONS.
+
+    Returns
+    -------
+    None;
+    All arrays but the inputs get altered in place.
+
+    """
+    newborn_male = 0.0
+    newborn_female = 0.0
+    for pos in range(len(castrated)):
+        amount = herd[castrated[pos]]
+        if pos == 0:
+            slaughter(castrated[pos], amount, 0, head_yields, totals,
+                      slaughtered)
+        else:
+            herd[castrated[pos - 1]] = amount
+
+    for pos in range(len(females)):
+        label = females[pos]
+        fert = fertility[label]
+        non_whole = herd[label] * fert
+        whole = np.floor(non_whole)
+        rest = non_whole - whole
+        if fertility_draws[pos] < rest:
+            succes = whole + 1
+        else:
+            succes = whole
+        if sex_draws[pos] < 0.5:
+            newborn_male += np.ceil(succes * 0.5)
+            newborn_female += np.floor(succes * 0.5)
+        else:
+            newborn_male += np.floor(succes * 0.5)
+            newborn_female += np.ceil(succes * 0.5)
+        if fert == 0:
+            succes = float(herd[label])
+        fail = herd[label] - succes
+        if pos == 0:
+            slaughter(label, herd[label], 0, head_yields, totals,
+                      slaughtered)
+        else:
+            slaughter(label, int(fail), 1, head_yields, totals, slaughtered)
+            herd[females[pos - 1]] = int(succes)
+
+    for pos in range(len(males)):
+        amount = herd[males[pos]]
+        if pos == 0:
+            slaughter(males[pos], amount, 0, head_yields, totals,
+                      slaughtered)
+        else:
+            herd[males[pos - 1]] = amount
+
+    male_limit = herd[females[:-1]].sum() / male_ratio
+    males_present = herd[males].sum()
+    while males_present > male_limit:
+        for label in males:
+            if herd[label] > 0:
+                herd[label] -= 1
+                slaughter(label, 1, 2, head_yields, totals, slaughtered)
+        males_present = herd[males].sum()
+    males_to_add = 0.0
+    if males_present < male_limit:
+        males_to_add = np.ceil(male_limit) - males_present
+    if males_to_add > herd[newborns[0]]:
+        males_to_add = float(herd[newborns[0]])
+    males_to_castrate = herd[newborns[0]] - males_to_add
+    herd[newborns[2]] = int(males_to_add)
+    herd[newborns[3]] = int(males_to_castrate)
+    herd[newborns[0]] = int(newborn_male)
+    herd[newborns[1]] = int(newborn_female)
+
+
+@jit
+def rank_in_use(stored, grass, grass_used, p_order, e_order):
+    """
+    Limit the rankings to the crops considered, see FeedState.
+
+    Parameters
+    ----------
+    stored : np.ndarray
+        The kg amount of each crop left in store.
+    grass : np.ndarray
+        True for the crops which can be considered grasses.
+    grass_used : bool
+        True if grasses are considered for feed.
+    p_order : np.ndarray
+        Positions of the crops from most to least protein yielding.
+    e_order : np.ndarray
+        Positions of the crops from most to least energy yielding.
+
+    Returns
+    -------
+    in_use : np.ndarray
+        True for the crops considered for feed.
+    p_rank : np.ndarray
+        p_order limited to the crops considered.
+    e_rank : np.ndarray
+        e_order limited to the crops considered.
+
+    """
+    in_use = stored > 0
+    if not grass_used:
+        in_use = np.logical_and(in_use, np.logical_not(grass))
+    p_rank = p_order[in_use[p_order]]
+    e_rank = e_order[in_use[e_order]]
+    return in_use, p_rank, e_rank
+
+
+@jit
+def find_kg_need(yields, stored, ranking, need):
+    """
+    Kg amount of feed needed for a nutrient, see feed_functions.find_kg_need.
+
+    Parameters
+    ----------
+    yields : np.ndarray
+        Nutrient yield per Kg of each crop.
+    stored : np.ndarray
+        Stored amount of each crop.
+    ranking : np.ndarray
+        Positions of the crops considered, from best to worst yielding.
+    need : float
+        Nutrient amount still needed.
+
+    Returns
+    -------
+    float
+        The persumed Kg amount of feed needed, 0 if the stores can't
+        satisfy it.
+
+    """
+    nutri_yield = yields[ranking]
+    in_store = stored[ranking]
+    if need <= 0:
+        return need / nutri_yield[0]
+    cumulative_yield = np.cumsum(in_store * nutri_yield)
+    last = np.searchsorted(cumulative_yield, need)
+    if last == len(cumulative_yield):
+        return 0.0
+    surplus = cumulative_yield[last] - need
+    return pairwise_sum(in_store[:last + 1]) - surplus / nutri_yield[last]
+
+
+@jit
+def sequential_sum(values):
+    """
+    Sum values one by one, like the built-in sum on their list.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Float values.
+
+    Returns
+    -------
+    total : float
+        Sum of the values.
+
+    """
+    total = 0.0
+    for value in values:
+        total += value
+    return total
+
+
+@jit
+def find_feed_optim(protein, energy, grass, stored, p_order, e_order, needs,
+                    limits, grass_share, grass_capped, grass_cut):
+    """
+    Run the greedy feed loop, see feed_functions.find_feed_optim.
+
+    Parameters
+    ----------
+    protein : np.ndarray
+        The kg amount of protein 1 kg of each crop yields.
+    energy : np.ndarray
+        The MJ amount of energy 1 kg of each crop yields.
+    grass : np.ndarray
+        True for the crops which can be considered grasses.
+    stored : np.ndarray
+        The kg amount of each crop in store, altered in place.
+    p_order : np.ndarray
+        Positions of the crops from most to least protein yielding.
+    e_order : np.ndarray
+        Positions of the crops from most to least energy yielding.
+    needs : np.ndarray
+        Minimal protein, energy and dry matter to feed.
+    limits : np.ndarray
+        Maximum protein, energy and dry matter to feed.
+    grass_share : float
+        Share of the feed that may be grass.
+    grass_capped : np.ndarray
+        Times the amount of each crop was capped by the grass share, altered
+        in place.
+    grass_cut : np.ndarray
+        Kg amount of each crop the grass share cut off, altered in place.
+
+    Returns
+    -------
+    fed : np.ndarray
+        The kg amount of each crop fed, all 0 if no proper feed was found.
+    limits_remain : np.ndarray
+        The remaining protein, energy and dry matter limits.
+
+    """
+    fed = np.zeros(len(stored))
+    needs_remain = needs.copy()
+    limits_remain = limits.copy()
+    grass_used = False
+    in_use, p_rank, e_rank = rank_in_use(stored, grass, grass_used, p_order,
+                                         e_order)
+    skip_grass = False
+    while True:
+        fed_protein = sequential_sum(fed * protein)
+        fed_energy = sequential_sum(fed * energy)
+        fed_dm = sequential_sum(fed)
+        if limits[0] >= fed_protein >= needs[0] and\
+                limits[1] >= fed_energy >= needs[1] and\
+                limits[2] >= fed_dm >= needs[2]:
+            break
+        if not in_use.any():
+            fed[:] = 0.0
+            limits_remain = limits.copy()
+            break
+        # Nutrient data of this step.
+        p_pos = p_rank[0]
+        e_pos = e_rank[0]
+        p_yld = protein[p_pos]
+        e_yld = energy[e_pos]
+        p_kg = find_kg_need(protein, stored, p_rank, needs_remain[0])
+        e_kg = find_kg_need(energy, stored, e_rank, needs_remain[1])
+        if p_kg >= e_kg:
+            content = energy
+        else:
+            content = protein
+        positions = np.flatnonzero(in_use)
+        dm_pos = positions[np.argmin(content[positions])]
+        dm_kg = needs_remain[2]
+        if dm_kg < 0:
+            dm_kg = 0.0
+        ranked = np.sort(np.array([p_kg, e_kg, dm_kg]))
+        first = ranked[2]
+        second = ranked[1]
+        third = ranked[0]
+        if first < second + 100:
+            if second == dm_kg:
+                kg_tf = first - third
+            else:
+                kg_tf = 100.0
+        else:
+            kg_tf = first - second
+        if first <= 0:
+            fed[:] = 0.0
+            limits_remain = limits.copy()
+            break
+        # Position and amount of crop to feed.
+        pos = -1
+        amount = 0.0
+        if p_kg == first:
+            if kg_tf * p_yld > needs_remain[0] + 1:
+                kg_tf = needs_remain[0] / p_yld / 100
+                if kg_tf < 1:
+                    kg_tf *= 100
+            if kg_tf > stored[p_pos]:
+                kg_tf = stored[p_pos]
+            pos = p_pos
+            amount = kg_tf
+        if e_kg == first:
+            if kg_tf * e_yld > needs_remain[1] + 1:
+                kg_tf = needs_remain[1] / e_yld / 100
+                if kg_tf < 1:
+                    kg_tf *= 100
+            if kg_tf > stored[e_pos]:
+                kg_tf = stored[e_pos]
+            pos = e_pos
+            amount = kg_tf
+        if dm_kg == first:
+            if kg_tf > stored[dm_pos]:
+                kg_tf = stored[dm_pos]
+            pos = dm_pos
+            amount = kg_tf
+        if skip_grass and amount > 100:
+            amount /= 10
+        skip_grass = False
+        if grass[pos]:
+            fed_total = sequential_sum(fed)
+            grass_fed = sequential_sum(fed[np.logical_and(in_use, grass)])
+            max_grass = (fed_total + amount) * grass_share
+            if grass_fed + amount > max_grass:
+                # Grass that can be fed before the pasture share exceeds.
+                excess = grass_fed + amount - (fed_total + amount) *\
+                    grass_share
+                excess_per_kg = 1 - grass_share
+                big_steps = max(np.ceil((excess - 1200) /
+                                        (600 * excess_per_kg)), 0.0)
+                excess -= big_steps * 600 * excess_per_kg
+                small_steps = max(np.ceil(excess / (50 * excess_per_kg)),
+                                  0.0)
+                capped = amount - (big_steps * 600 + small_steps * 50)
+                if capped < 0:
+                    capped = 0.0
+                grass_capped[pos] += 1
+                grass_cut[pos] += amount - capped
+                amount = capped
+                skip_grass = True
+        amount = np.ceil(amount)
+        fed[pos] += amount
+        stored[pos] -= amount
+        prot_yield = protein[pos] * amount
+        energy_yield = energy[pos] * amount
+        needs_remain[0] -= prot_yield
+        needs_remain[1] -= energy_yield
+        needs_remain[2] -= amount
+        limits_remain[0] -= prot_yield
+        limits_remain[1] -= energy_yield
+        limits_remain[2] -= amount
+        if stored[pos] <= 0 or grass_used == skip_grass:
+            grass_used = not skip_grass
+            in_use, p_rank, e_rank = rank_in_use(stored, grass, grass_used,
+                                                 p_order, e_order)
+    return fed, limits_remain
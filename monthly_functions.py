@@ -0,0 +1,212 @@
+"""
+Author: Siebrant Hendriks.
+
+Supplementary script for splitting the years of a run into months
+
+The animals spend the middle of the year on pasture and the rest of it in the
+barn (see barn_days on the estate sheet). Grass is grazed in the pasture
+months, stored feed makes up the rest of the ration, manure is dropped on
+pasture while the animals are out and deep litter piles up while they are in,
+and the biodigestor turns its matter into digestate in the months that matter
+appears. Each of these is worked out for all years and all 12 months of a run
+at once, as a single array operation on the physical trajectory of the run.
+
+The simulation feeds the herd once a year, so the months are an estimated
+split of the yearly totals under the assumptions above, not simulated months.
+In particular the estimated feed balances only show how a year's ration is
+likely spread against the herd's needs; they add up to the yearly feed
+balance, but a month short of feed does not mean the run ran out of stock.
+"""
+import numpy as np
+import pandas as pd
+import global_data as gd
+import feed_functions as fd
+import flow_functions as fl
+
+MONTHS = ['January', 'February', 'March', 'April', 'May', 'June', 'July',
+          'August', 'September', 'October', 'November', 'December']
+DAYS_IN_MONTH = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+# Matter produced in the barn, it only appears in the months animals are in.
+BARN_MATTER = ['deep_litter']
+
+# Columns of the monthly table, after year and month.
+MONTHLY_QUANTITIES = ['barn_days', 'pasture_days', 'grass_fed',
+                      'stored_feed_fed', 'estimated_protein_balance',
+                      'estimated_energy_balance', 'estimated_dm_balance',
+                      'manure_on_pasture',
+                      'deep_litter_produced', 'digestate_produced']
+
+
+def mk_calendar():
+    """
+    Determine the days animals spend on pasture and in the barn each month.
+
+    The pasture season is one stretch of 365 - barn_days days around the
+    middle of the year.
+
+    Returns
+    -------
+    pasture_days : np.ndarray
+        Days on pasture in each month.
+    barn_days : np.ndarray
+        Days in the barn in each month.
+
+    """
+    month_end = np.cumsum(DAYS_IN_MONTH)
+    month_start = month_end - DAYS_IN_MONTH
+    season = min(max(365 - gd.barn_days, 0), 365)
+    season_start = (365 - season) / 2
+    season_end = season_start + season
+    pasture_days = np.clip(np.minimum(month_end, season_end) -
+                           np.maximum(month_start, season_start), 0, None)
+    barn_days = DAYS_IN_MONTH - pasture_days
+    return pasture_days, barn_days
+
+
+def month_weights(days):
+    """
+    Determine the part of a yearly amount falling in each month.
+
+    Parameters
+    ----------
+    days : np.ndarray
+        Days in each month the amount comes about.
+
+    Returns
+    -------
+    np.ndarray
+        Part of the amount in each month, spread over the whole year when
+        there are no such days.
+
+    """
+    if days.sum() > 0:
+        return days / days.sum()
+    return DAYS_IN_MONTH / 365
+
+
+def split_feed(feed, needs, on_pasture):
+    """
+    Estimate how the yearly rations are spread over the months.
+
+    Grass is grazed on the pasture days. Stored feed is assumed to make up the
+    rest of every month's share of the ration, so it is mostly fed in the barn
+    months. Needs are spread over the months by their days.
+
+    Parameters
+    ----------
+    feed : pd.DataFrame
+        (years x crops) Kg amount of each crop fed.
+    needs : np.ndarray
+        (years x 3) protein, energy and dry matter needs of the herd.
+    on_pasture : np.ndarray
+        Part of the pasture days in each month.
+
+    Returns
+    -------
+    grass_fed : np.ndarray
+        (years x 12) Kg amount of grass fed.
+    stored_fed : np.ndarray
+        (years x 12) Kg amount of stored feed fed.
+    balance : np.ndarray
+        (years x 12 x 3) estimated protein, energy and dry matter fed minus
+        needed.
+
+    """
+    grass = feed.columns.isin(fd.get_grasses(list(feed.columns)))
+    contents = gd.plant_data.loc[feed.columns, ['feed_protein_content',
+                                                'feed_energy_content']]
+    contents = np.column_stack([contents.to_numpy(dtype='float'),
+                                np.ones(len(feed.columns))])
+    fed = feed.to_numpy(dtype='float')
+    # (years x 3) nutrients in the grass and the stored feed fed each year.
+    grass_nutrients = fed[:, grass] @ contents[grass]
+    stored_nutrients = fed[:, ~grass] @ contents[~grass]
+    uniform = DAYS_IN_MONTH / 365
+    grass_fed = grass_nutrients[:, 2, None] * on_pasture
+    # Stored feed fills what the grass leaves of each month's share.
+    shortfall = np.clip(fed.sum(axis=1)[:, None] * uniform - grass_fed, 0,
+                        None)
+    total = shortfall.sum(axis=1, keepdims=True)
+    in_stored = np.divide(shortfall, total, out=np.tile(uniform,
+                                                        (len(fed), 1)),
+                          where=total > 0)
+    stored_fed = stored_nutrients[:, 2, None] * in_stored
+    balance = grass_nutrients[:, None, :] * on_pasture[None, :, None] +\
+        stored_nutrients[:, None, :] * in_stored[:, :, None] -\
+        needs[:, None, :] * uniform[None, :, None]
+    return grass_fed, stored_fed, balance
+
+
+def mk_monthly_table(ledger):
+    """
+    Make a table of the estimated monthly split of a run.
+
+    Parameters
+    ----------
+    ledger : dict
+        Physical trajectory of a run, see recompute_functions.mk_ledger.
+
+    Returns
+    -------
+    monthly_table : pd.DataFrame
+        One row per year and month with the days in the barn and on pasture,
+        the Kg grass and stored feed fed, the estimated nutrients fed minus
+        needed and the Kg manure, deep litter and digestate produced.
+
+    """
+    herd = ledger['herd']
+    years = herd.index
+    pasture_days, barn_days = mk_calendar()
+    on_pasture = month_weights(pasture_days)
+    in_barn = month_weights(barn_days)
+    uniform = DAYS_IN_MONTH / 365
+
+    animal_data = gd.animal_data.loc[herd.columns]
+    needs = herd.to_numpy(dtype='float') @ animal_data[
+        ['protein_requirement', 'feed_energy_requirement',
+         'DM_requirement']].to_numpy(dtype='float')
+    grass_fed, stored_fed, balance = split_feed(ledger['feed'], needs,
+                                                on_pasture)
+    production = herd.to_numpy(dtype='float') @ animal_data[
+        ['manure_pasture_production',
+         'deep_litter_production']].to_numpy(dtype='float')
+    digestate = fl.align_amounts('digestor', ledger['digestor']) *\
+        gd.flow_coefficients['digestor']['digestate_produced']
+    barn_matter = digestate.columns.isin(BARN_MATTER)
+    digestate = digestate.to_numpy(dtype='float')
+    digestate = digestate[:, barn_matter].sum(axis=1)[:, None] * in_barn +\
+        digestate[:, ~barn_matter].sum(axis=1)[:, None] * uniform
+
+    columns = [np.broadcast_to(barn_days, grass_fed.shape),
+               np.broadcast_to(pasture_days, grass_fed.shape),
+               grass_fed, stored_fed, *np.moveaxis(balance, 2, 0),
+               production[:, 0, None] * on_pasture,
+               production[:, 1, None] * in_barn, digestate]
+    index = pd.MultiIndex.from_product([years, MONTHS],
+                                       names=['year', 'month'])
+    monthly_table = pd.DataFrame(
+        np.stack(columns, axis=2).reshape(len(index), len(columns)),
+        index=index, columns=MONTHLY_QUANTITIES)
+    monthly_table = monthly_table.reset_index()
+    return monthly_table
+
+
+def write_monthly_table(path, ledger):
+    """
+    Write the estimated monthly split of a run to a csv file.
+
+    Parameters
+    ----------
+    path : str
+        Name of the csv file to write.
+    ledger : dict
+        Physical trajectory of a run, see recompute_functions.mk_ledger.
+
+    Returns
+    -------
+    None.
+
+    """
+    mk_monthly_table(ledger).to_csv(path, index=False)
+    print(f'monthly estimates written to {path}')
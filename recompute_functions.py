@@ -0,0 +1,482 @@
+"""
+Author: Siebrant Hendriks.
+
+Supplementary script for recomputing results from a previous run's trajectory
+
+The herd, feed and nutrient flows of a run only depend on a part of the input
+fields. When solely fields that are used for accounting (prices, costs,
+nutrient contents, ...) change, the physical trajectory of the previous run
+stays the same and only the accounting stages reading those fields have to be
+recomputed.
+"""
+import os
+import pickle
+import zlib
+import pandas as pd
+import global_data as gd
+import animal_lifecycle_functions as al
+import utility_functions as ul
+import flow_functions as fl
+
+TRAJECTORY_VERSION = 2
+
+# Input fields read by the stages that decide the physical trajectory of the
+# run: harvest, herd, bedding, feed, biodigestor, mulch and sales.
+# Changing any of these means the whole simulation has to be run again.
+TRAJECTORY_INPUTS = {
+    'harvest': {'estate': ['runtime', 'cultivated_grasslands', 'cropping_area',
+                           'BSG/BSY_from_barley_only_at', 'import_BSG_DM',
+                           'import_BSY_DM'],
+                'crops': ['grassland_ratio', 'cropping_ratio', 'yield_DM']},
+    'age_herd': {'estate': ['female_ratio', 'male_ratio'],
+                 'animal': ['initial_animal_count', 'fertility_rate']},
+    'reduce_animal': {'estate': ['newborn_ratio', 'female_ratio',
+                                 'male_ratio'],
+                      'animal': ['fertility_rate']},
+    'apply_stocking_limits': {'estate': ['cultivated_grasslands',
+                                         'stocking_rate_grasslands',
+                                         'dry_meadow/field',
+                                         'stocking_rate_meadow'],
+                              'animal': ['livestock_units']},
+    'assign_bedding': {'estate': ['bedding_required'],
+                       'crops': ['bedding_use']},
+    'feed_animals': {'estate': ['female_ratio', 'male_ratio', 'barn_days'],
+                     'crops': ['feeding_priority', 'feed_protein_content',
+                               'feed_energy_content'],
+                     'animal': ['protein_requirement',
+                                'feed_energy_requirement', 'DM_requirement',
+                                'protein_limit', 'feed_energy_limit',
+                                'DM_limit']},
+    'biopro_to_use': {'estate': ['import_chicken_manure',
+                                 'import_horse_manure',
+                                 'maximum_digestate_spreadable'],
+                      'crops': ['bioprocessor_use', 'mulch_use'],
+                      'animal': ['deep_litter_production'],
+                      'biodigestor': ['digestate']},
+    'select_mulch': {'crops': ['mulch_use']},
+    'select_cash_crops': {'crops': ['sale_use']}}
+
+# Input fields read by the accounting stages, and the results columns they
+# write to. These can be recomputed from the trajectory of a previous run.
+STAGE_INPUTS = {
+    'apply_crop_balance': {
+        'estate': ['rented_land', 'land_rent', 'max_yearly_regular_labour',
+                   'regular_labour_cost', 'casual_labour_cost',
+                   'fuel_use_harvester_grassland', 'fuel_use_harvester_meadow',
+                   'fuel_use_harvester_cropping', 'fuel_price'],
+        'crops': ['subsidies', 'cultivation_costs', 'contract_work_costs',
+                  'general_labour_needed']},
+    'apply_slaughter_yield': {
+        'estate': ['meat_diet_energy_content', 'meat_diet_protein_content',
+                   'meat_diet_fat_content'],
+        'animal': ['slaughter_meat_yield', 'meat_sale_value']},
+    'apply_cash_crop_yield': {
+        'crops': ['sale_value', 'food_energy_content', 'food_fat_content',
+                  'food_protein_content']},
+    'apply_digestate': {'estate': ['digestate_application_cost']},
+    'apply_animal_balance': {
+        'estate': ['casual_labour_cost', 'animal_maintenance'],
+        'animal': ['subsidies_gained', 'general_labour_costs',
+                   'livestock_units', 'electricity_use']},
+    'apply_electricity_use': {
+        'estate': ['general_electricity_consumption',
+                   'brewery_electricity_requirement']},
+    'make_biopro_products': {
+        'biodigestor': ['digestate', 'electricity', 'biomethane']},
+    'apply_digestion_methane_emission': {
+        'animal': ['digestion_methane_emission']},
+    'apply_manure': {
+        'estate': ['manure_N_retention'],
+        'animal': ['manure_pasture_production', 'manure_nitrogen_content',
+                   'manure_phosphorus_content', 'manure_methane_content']},
+    'fixate_fm': {'crops': ['P_fixation', 'N_fixation']},
+    'extract_fm': {
+        'estate': ['chicken_manure_P_content', 'chicken_manure_N_content',
+                   'horse_manure_P_content', 'horse_manure_N_content',
+                   'deep_litter_P_content', 'deep_litter_N_content',
+                   'digestate_N_retention'],
+        'crops': ['P_content', 'N_content']},
+    'apply_mulch': {'estate': ['deep_litter_P_content',
+                               'deep_litter_N_content', 'mulch_N_retention',
+                               'deep_litter_N_retention'],
+                    'crops': ['P_content', 'N_content']},
+    'fertilize_fm': {'crops': ['P_content', 'N_content']}}
+
+STAGE_RESULTS = {
+    'apply_crop_balance': ['revenue_balance_crops'],
+    'apply_slaughter_yield': ['revenue_balance_animal', 'food_energy_produced',
+                              'food_protein_produced', 'food_fat_produced'],
+    'apply_cash_crop_yield': ['revenue_balance_crops', 'food_energy_produced',
+                              'food_protein_produced', 'food_fat_produced'],
+    'apply_digestate': ['revenue_balance_crops'],
+    'apply_animal_balance': ['revenue_balance_animal', 'electricity_balance'],
+    'apply_electricity_use': ['electricity_balance'],
+    'make_biopro_products': ['digestate_produced', 'electricity_balance',
+                             'biomethane_produced'],
+    'apply_digestion_methane_emission': ['digestion_methane_emissions'],
+    'apply_manure': ['manure_methane_emissions', 'nitrogen_balance',
+                     'phosphorus_balance'],
+    'fixate_fm': ['nitrogen_balance', 'phosphorus_balance'],
+    'extract_fm': ['nitrogen_balance', 'phosphorus_balance'],
+    'apply_mulch': ['nitrogen_balance', 'phosphorus_balance'],
+    'fertilize_fm': ['nitrogen_balance', 'phosphorus_balance']}
+
+# Accounting stages booking the matter going to a destination, see
+# flow_functions.
+STAGE_FLOWS = {'apply_cash_crop_yield': 'sale',
+               'make_biopro_products': 'digestor',
+               'apply_manure': 'manure',
+               'fixate_fm': 'harvest',
+               'extract_fm': 'digestor',
+               'apply_mulch': 'mulch'}
+
+
+def values_differ(old_values, new_values):
+    """
+    Check if two rows of input values differ, treating empty cells as equal.
+
+    Parameters
+    ----------
+    old_values : pd.Series
+        Input values of a property in the previous run.
+    new_values : pd.Series
+        Input values of the same property in the current run.
+
+    Returns
+    -------
+    bool
+        True if any of the values differ, False if not.
+
+    """
+    for old, new in zip(old_values, new_values):
+        if pd.isna(old) and pd.isna(new):
+            continue
+        if old != new:
+            return True
+    return False
+
+
+def find_changed_fields(old_sheets):
+    """
+    Find which input fields changed compared to the previous run.
+
+    Parameters
+    ----------
+    old_sheets : dict
+        Input sheets of the previous run by their name in the input file.
+
+    Returns
+    -------
+    changed : set
+        Contains (sheet name, property) pairs of all changed fields.
+        None if crops, animals or properties were added or removed.
+
+    """
+    changed = set()
+    for name, new_sheet in gd.get_input_sheets().items():
+        old_sheet = old_sheets[name]
+        if not old_sheet.index.equals(new_sheet.index) or\
+                not old_sheet.columns.equals(new_sheet.columns):
+            return None
+        columns = new_sheet.columns.drop('unit_of_measurement')
+        for prop in new_sheet.index:
+            if values_differ(old_sheet.loc[prop, columns],
+                             new_sheet.loc[prop, columns]):
+                changed.add((name, prop))
+    return changed
+
+
+def find_affected_stages(changed):
+    """
+    Determine which accounting stages need to be recomputed.
+
+    Parameters
+    ----------
+    changed : set
+        Contains (sheet name, property) pairs of all changed fields.
+
+    Returns
+    -------
+    stages : list
+        Names of the accounting stages reading any of the changed fields.
+        None if a field affecting the physical trajectory changed.
+
+    """
+    known = set()
+    for stage_inputs in [*TRAJECTORY_INPUTS.values(), *STAGE_INPUTS.values()]:
+        for sheet, fields in stage_inputs.items():
+            known.update((sheet, field) for field in fields)
+    for stage_inputs in TRAJECTORY_INPUTS.values():
+        for sheet, fields in stage_inputs.items():
+            if changed & {(sheet, field) for field in fields}:
+                return None
+    # Fields no stage is known to read might steer the trajectory.
+    if changed - known:
+        return None
+    stages = []
+    for stage, stage_inputs in STAGE_INPUTS.items():
+        for sheet, fields in stage_inputs.items():
+            if changed & {(sheet, field) for field in fields}:
+                stages.append(stage)
+                break
+    return stages
+
+
+def mk_year_frame(reports, columns):
+    """
+    Make a (years x columns) frame of yearly reported amounts.
+
+    Parameters
+    ----------
+    reports : list or pd.DataFrame
+        Yearly reported pd.Series, or the dataframe made from them.
+    columns : pd.Index
+        Labels to align the reported amounts on.
+
+    Returns
+    -------
+    frame : pd.DataFrame
+        Reported amounts, missing entries set to 0.
+
+    """
+    frame = pd.DataFrame(reports)
+    frame = frame.reindex(columns=columns, fill_value=0.0).fillna(0.0)
+    frame.index = gd.results.index[1:len(frame) + 1]
+    frame = frame.astype('float')
+    return frame
+
+
+def mk_ledger():
+    """
+    Collect the physical trajectory of the finished run.
+
+    Returns
+    -------
+    ledger : dict
+        Contains per year the herd, the animals slaughtered, the crops used
+        for bedding, feed and sold and the matter used by the biodigestor and
+        as mulch, together with the harvest and the digestate produced.
+
+    """
+    animals = gd.animal_data.index
+    materials = gd.biodigestor_data.index.union(gd.harvest_yield.index,
+                                                sort=False)
+    ledger = {'herd': mk_year_frame(gd.herd_year_end, animals),
+              'slaughtered': mk_year_frame(gd.animals_slaughtered, animals),
+              'bedding': mk_year_frame(gd.bedding_used,
+                                       gd.harvest_yield.index),
+              'feed': mk_year_frame(gd.feed_used, gd.harvest_yield.index),
+              'sold': mk_year_frame(gd.crops_sold, gd.harvest_yield.index),
+              'digestor': mk_year_frame(gd.digestor_used, materials),
+              'mulch': mk_year_frame(gd.mulch_used, materials),
+              'harvest': gd.harvest_yield.astype('float'),
+              'brewery': gd.brewery,
+              'digestate_produced':
+                  gd.results['digestate_produced'].iloc[1:].astype('float')}
+    return ledger
+
+
+def mk_contribution(stage, ledger):
+    """
+    Calculate yearly contributions of an accounting stage to the results.
+
+    Parameters
+    ----------
+    stage : str
+        Name of the accounting stage, as in STAGE_INPUTS.
+    ledger : dict
+        Physical trajectory of a run, as made by mk_ledger.
+
+    Returns
+    -------
+    contribution : pd.DataFrame
+        Amounts the stage added to each of its results columns per year.
+
+    """
+    years = ledger['herd'].index
+    herd = ledger['herd']
+    contribution = pd.DataFrame(0.0, index=years,
+                                columns=STAGE_RESULTS[stage])
+    if stage == 'apply_crop_balance':
+        contribution['revenue_balance_crops'] = gd.crop_balance
+    elif stage == 'apply_slaughter_yield':
+        meat = ledger['slaughtered'] * gd.animal_data['slaughter_meat_yield']
+        contribution['revenue_balance_animal'] =\
+            meat @ gd.animal_data['meat_sale_value'].astype('float')
+        meat = meat.sum(axis=1)
+        contribution['food_energy_produced'] =\
+            meat * gd.estate_values['meat_diet_energy_content']
+        contribution['food_protein_produced'] =\
+            meat * gd.estate_values['meat_diet_protein_content']
+        contribution['food_fat_produced'] =\
+            meat * gd.estate_values['meat_diet_fat_content']
+    elif stage == 'apply_digestate':
+        contribution['revenue_balance_crops'] =\
+            -ledger['digestate_produced'] *\
+            gd.estate_values['digestate_application_cost']
+    elif stage == 'apply_animal_balance':
+        animals = gd.animal_data
+        labour = herd @ animals['general_labour_costs']
+        livestock_units = herd @ animals['livestock_units']
+        contribution['revenue_balance_animal'] =\
+            herd @ animals['subsidies_gained'] -\
+            labour * gd.estate_values['casual_labour_cost'] -\
+            livestock_units * gd.estate_values['animal_maintenance']
+        contribution['electricity_balance'] =\
+            -(herd @ animals['electricity_use'])
+    elif stage == 'apply_electricity_use':
+        electricity = gd.estate_values['general_electricity_consumption']
+        if ledger['brewery']:
+            electricity += gd.estate_values['brewery_electricity_requirement']
+        contribution['electricity_balance'] = -electricity
+    elif stage == 'apply_digestion_methane_emission':
+        contribution['digestion_methane_emissions'] =\
+            herd @ gd.animal_data['digestion_methane_emission']
+    elif stage in STAGE_FLOWS:
+        destination = STAGE_FLOWS[stage]
+        totals = fl.flow_totals(destination,
+                                fl.ledger_amounts(ledger, destination))
+        contribution[STAGE_RESULTS[stage]] = totals[STAGE_RESULTS[stage]]
+    elif stage == 'fertilize_fm':
+        contribution['nitrogen_balance'] = -gd.n_use
+        contribution['phosphorus_balance'] = -gd.p_use
+    return contribution
+
+
+def save_trajectory(path):
+    """
+    Save the finished run's inputs, results and trajectory for later reuse.
+
+    Parameters
+    ----------
+    path : str
+        Name of the trajectory file to write.
+
+    Returns
+    -------
+    None.
+
+    """
+    ledger = mk_ledger()
+    contributions = {stage: mk_contribution(stage, ledger)
+                     for stage in STAGE_INPUTS}
+    trajectory = {'version': TRAJECTORY_VERSION,
+                  'sheets': gd.get_input_sheets(),
+                  'run_seed': al.run_seed,
+                  'ledger': ledger,
+                  'contributions': contributions,
+                  'results': gd.results,
+                  'herd_results': gd.herd_results,
+                  'feed_used': gd.feed_used,
+                  'bedding_used': gd.bedding_used,
+                  'crops_sold': gd.crops_sold,
+                  'digestor_used': gd.digestor_used,
+                  'mulch_used': gd.mulch_used,
+                  'herd_year_end': gd.herd_year_end,
+                  'animals_slaughtered': gd.animals_slaughtered}
+    data = zlib.compress(pickle.dumps(trajectory, pickle.HIGHEST_PROTOCOL))
+    ul.write_atomic(path, data)
+
+
+def load_trajectory(path):
+    """
+    Read the trajectory of a previous run.
+
+    Parameters
+    ----------
+    path : str
+        Name of the trajectory file to read.
+
+    Returns
+    -------
+    trajectory : dict
+        Inputs, results and trajectory of the previous run.
+        None if the file does not exist or has another version.
+
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as trajectory_file:
+        trajectory = pickle.loads(zlib.decompress(trajectory_file.read()))
+    if trajectory['version'] != TRAJECTORY_VERSION:
+        return None
+    return trajectory
+
+
+def recompute_results(trajectory, stages):
+    """
+    Recompute the results of a previous run for the current input data.
+
+    Only the contributions of the given stages are recomputed, all other
+    contributions are taken over from the previous run. The reports of the
+    previous run are restored in global variables as they stay unchanged.
+
+    Parameters
+    ----------
+    trajectory : dict
+        Inputs, results and trajectory of the previous run.
+    stages : list
+        Names of the accounting stages to recompute.
+
+    Returns
+    -------
+    None;
+    Results and reports get set in global variables.
+
+    """
+    results = trajectory['results'].copy()
+    for stage in stages:
+        old = trajectory['contributions'][stage]
+        new = mk_contribution(stage, trajectory['ledger'])
+        trajectory['contributions'][stage] = new
+        columns = new.columns
+        updated = results.loc[new.index, columns].astype('float')
+        updated += new - old
+        results.loc[new.index, columns] = updated
+    gd.results = results
+    gd.herd_results = trajectory['herd_results']
+    gd.feed_used = trajectory['feed_used']
+    gd.bedding_used = trajectory['bedding_used']
+    gd.crops_sold = trajectory['crops_sold']
+    gd.digestor_used = trajectory['digestor_used']
+    gd.mulch_used = trajectory['mulch_used']
+    gd.herd_year_end = trajectory['herd_year_end']
+    gd.animals_slaughtered = trajectory['animals_slaughtered']
+
+
+def try_recompute(path):
+    """
+    Recompute the results from a previous run's trajectory if possible.
+
+    Parameters
+    ----------
+    path : str
+        Name of the trajectory file of the previous run.
+
+    Returns
+    -------
+    bool
+        True if the results could be recomputed, False if the whole
+        simulation has to be run.
+
+    """
+    trajectory = load_trajectory(path)
+    if trajectory is None:
+        return False
+    # Another seed or replicate draws other random numbers, so the herd
+    # differs.
+    if trajectory['run_seed'] != al.run_seed:
+        print('seed or replicate changed, simulating again')
+        return False
+    changed = find_changed_fields(trajectory['sheets'])
+    if changed is None:
+        print('crops, animals or properties changed, simulating again')
+        return False
+    stages = find_affected_stages(changed)
+    if stages is None:
+        print('herd or harvest use would change, simulating again')
+        return False
+    print(f'{len(changed)} input field(s) changed, recomputing: '
+          f'{", ".join(stages) if stages else "nothing"}')
+    recompute_results(trajectory, stages)
+    return True
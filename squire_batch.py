@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Author: Siebrant Hendriks.
+
+Simulate many farm squire input files in one go.
+
+The input files are read concurrently on a thread pool and every file is
+simulated as soon as it is read, in parallel on a process pool. Each input file
+gets its own results workbook, and a summary compares all of them.
+"""
+import os
+import glob
+import argparse
+import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import as_completed
+import pandas as pd
+import global_data as gd
+import farm_squire as fs
+import export_functions as ex
+import cache_functions as cr
+
+
+def parse_arguments():
+    """
+    Read the command line options.
+
+    Returns
+    -------
+    args : argparse.Namespace
+        Contains the input files and batch settings.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='Simulate many farm squire input files.')
+    parser.add_argument('inputs', nargs='+',
+                        help='input workbooks, directories of them or glob '
+                        'patterns like "clients/*.xlsx"')
+    parser.add_argument('--output-dir', default='.', metavar='DIR',
+                        help='directory the results are written to')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='amount of simulations run in parallel')
+    parser.add_argument('--readers', type=int, default=4,
+                        help='amount of input files read in parallel')
+    parser.add_argument('--result-cache', metavar='DIR',
+                        help='take runs from the result cache in DIR if they '
+                        'were simulated before, and store them there')
+    parser.add_argument('--result-cache-size', type=float,
+                        default=cr.DEFAULT_CACHE_SIZE, metavar='MB',
+                        help='size limit of the result cache')
+    args = parser.parse_args()
+    return args
+
+
+def find_input_files(inputs):
+    """
+    Find all input files named by the command line.
+
+    Temporary excel files and farm squire output files are skipped, so results
+    may be written next to the input files.
+
+    Parameters
+    ----------
+    inputs : list
+        Input workbooks, directories of them or glob patterns.
+
+    Returns
+    -------
+    input_files : list
+        Names of the input files, without duplicates.
+
+    """
+    input_files = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            entry = os.path.join(entry, '*.xlsx')
+        matches = sorted(glob.glob(entry))
+        if not matches:
+            print(f'no input files found for {entry}')
+        input_files += [match for match in matches
+                        if not os.path.basename(match).startswith(
+                            ('~$', 'squire_'))]
+    input_files = list(dict.fromkeys(input_files))
+    return input_files
+
+
+def mk_unique_stems(input_files):
+    """
+    Name every input file by its stem, numbering repeated stems.
+
+    Parameters
+    ----------
+    input_files : list
+        Names of the input files.
+
+    Returns
+    -------
+    stems : dict
+        Unique stem by input file.
+
+    """
+    stems = {}
+    taken = set()
+    for input_file in input_files:
+        stem = os.path.splitext(os.path.basename(input_file))[0]
+        name = stem
+        count = 1
+        # Input files of the same name in different directories.
+        while name in taken:
+            count += 1
+            name = f'{stem}_{count}'
+        taken.add(name)
+        stems[input_file] = name
+    return stems
+
+
+def mk_output_names(input_files, output_dir):
+    """
+    Name the results workbook of every input file.
+
+    Parameters
+    ----------
+    input_files : list
+        Names of the input files.
+    output_dir : str
+        Directory the results are written to.
+
+    Returns
+    -------
+    output_names : dict
+        Name of the results workbook by input file.
+
+    """
+    output_names = {input_file: os.path.join(output_dir,
+                                             f'squire_results_{name}.xlsx')
+                    for input_file, name in mk_unique_stems(
+                        input_files).items()}
+    return output_names
+
+
+def run_input(input_sheets, output_name):
+    """
+    Simulate one input file and write its results, in a worker process.
+
+    Parameters
+    ----------
+    input_sheets : dict
+        Contains the estate, crops, animal and biodigestor sheets as they are
+        in the input file.
+    output_name : str
+        Name of the results workbook to write.
+
+    Returns
+    -------
+    summary : pd.Series
+        Years simulated, the final herd size and every statistics column
+        summed over all years.
+
+    """
+    results = fs.run_scenario(input_sheets)
+    ex.write_results(output_name)
+    summary = pd.Series({'years': len(results),
+                         'final_herd_size': gd.herd_results.iloc[-1].sum()})
+    summary = pd.concat([summary, results.sum()])
+    return summary
+
+
+def run_batch(input_files, output_names, workers, readers):
+    """
+    Read and simulate all input files.
+
+    Parameters
+    ----------
+    input_files : list
+        Names of the input files.
+    output_names : dict
+        Name of the results workbook by input file.
+    workers : int
+        Amount of simulations run in parallel.
+    readers : int
+        Amount of input files read in parallel.
+
+    Returns
+    -------
+    summaries : dict
+        Summary by input file, of the input files that could be simulated.
+
+    """
+    summaries = {}
+    hits = 0
+    read_pool = ThreadPoolExecutor(readers)
+    run_pool = ProcessPoolExecutor(workers, initializer=cr.use_cache,
+                                   initargs=(cr.cache_dir,
+                                             cr.max_bytes / 2 ** 20))
+    with read_pool, run_pool:
+        reading = {read_pool.submit(gd.read_input, input_file): input_file
+                   for input_file in input_files}
+        running = {}
+        for future in as_completed(reading):
+            input_file = reading[future]
+            try:
+                input_sheets = future.result()
+            except Exception as error:
+                print(f'could not read {input_file}: {error}')
+                continue
+            hits += cr.cached(cr.run_key(input_sheets))
+            running[run_pool.submit(run_input, input_sheets,
+                                    output_names[input_file])] = input_file
+        for future in as_completed(running):
+            input_file = running[future]
+            try:
+                summaries[input_file] = future.result()
+            except Exception as error:
+                print(f'could not simulate {input_file}: {error}')
+                continue
+            print(f'simulated {len(summaries)} of {len(input_files)} '
+                  'input files')
+    if cr.cache_dir:
+        cr.report_hits(hits, len(running))
+    return summaries
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    cr.use_cache(args.result_cache, args.result_cache_size)
+    input_files = find_input_files(args.inputs)
+    print(f'{len(input_files)} input files found')
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_names = mk_output_names(input_files, args.output_dir)
+    summaries = run_batch(input_files, output_names, args.workers,
+                          args.readers)
+
+    timestamp = dt.datetime.now()
+    timestamp = timestamp.strftime('%Y-%m-%d_%H.%M.%S')
+    summary = pd.DataFrame([summaries[input_file] for input_file in input_files
+                            if input_file in summaries],
+                           index=[input_file for input_file in input_files
+                                  if input_file in summaries])
+    summary.index.name = 'input_file'
+    summary.insert(0, 'results_file',
+                   [output_names[input_file] for input_file in summary.index])
+    output_name = os.path.join(args.output_dir,
+                               f'squire_batch_{timestamp}.xlsx')
+    with pd.ExcelWriter(output_name) as writer:
+        summary.to_excel(writer, sheet_name='summary')
+    print(f'batch done, {len(summary)} of {len(input_files)} input files '
+          f'simulated, check {output_name}')
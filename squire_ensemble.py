@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+"""
+Author: Siebrant Hendriks.
+
+Simulate replicates of farm squire scenarios until their results are precise.
+
+Each input file is a scenario of which replicates, runs with their own random
+numbers (see animal_lifecycle_functions.seed_run), are simulated in batches on
+a process pool. Every replicate is summarized by chosen metrics, such as the
+mean animal revenue over all years or the final herd size. After each batch
+the confidence interval of every metric's mean is worked out, and a scenario
+gets no more replicates once all its intervals are narrow enough or its
+replicate budget is spent. The same replicate of every scenario draws the same
+random numbers, so the scenarios can be compared replicate by replicate.
+The statistics and herds of all replicates can be kept in memory-mapped arrays
+on disk (see ensemble_functions).
+"""
+import os
+import argparse
+import datetime as dt
+from statistics import NormalDist
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import global_data as gd
+import animal_lifecycle_functions as al
+import farm_squire as fs
+import squire_batch as sb
+import cache_functions as cr
+import ensemble_functions as en
+import aggregate_functions as ag
+
+# Ways a metric summarizes a statistics column over the years of a run.
+SUMMARIES = ['mean', 'sum', 'final']
+# Column of the herd size, next to the statistics columns.
+HERD_SIZE = 'herd_size'
+DEFAULT_METRICS = ['mean:revenue_balance_animal', 'final:herd_size']
+
+# Why a scenario got no more replicates.
+STOP_REASONS = {'precise': 'all metrics within tolerance',
+                'budget': 'replicate budget spent',
+                'failed': 'a replicate could not be simulated'}
+
+# Input sheets of every scenario, the metrics and how the replicates are
+# seeded, in a worker process.
+scenario_sheets = None
+worker_metrics = None
+worker_seeding = None
+
+
+def parse_arguments():
+    """
+    Read the command line options.
+
+    Returns
+    -------
+    args : argparse.Namespace
+        Contains the input files, metrics and ensemble settings.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='Simulate replicates of farm squire scenarios until '
+        'their results are precise.')
+    parser.add_argument('inputs', nargs='+',
+                        help='input workbooks, directories of them or glob '
+                        'patterns like "scenarios/*.xlsx"')
+    parser.add_argument('--metric', action='append', dest='metrics',
+                        metavar='SUMMARY:COLUMN',
+                        help='metric to make precise, e.g. '
+                        'mean:revenue_balance_animal or final:herd_size; '
+                        'can be given more than once')
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help='largest half-width of the confidence interval, '
+                        'as part of the mean')
+    parser.add_argument('--absolute-tolerance', type=float, default=0.0,
+                        help='half-width that is always narrow enough, for '
+                        'metrics with a mean close to zero')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                        help='confidence level of the intervals')
+    parser.add_argument('--min-replicates', type=int, default=10,
+                        help='replicates simulated before the first check')
+    parser.add_argument('--max-replicates', type=int, default=1000,
+                        help='replicate budget of every scenario')
+    parser.add_argument('--batch-size', type=int, metavar='N',
+                        help='replicates added per check, the amount of '
+                        'workers by default')
+    parser.add_argument('--antithetic', action='store_true',
+                        help='simulate antithetic pairs of replicates')
+    parser.add_argument('--seed', type=int, default=al.SEED,
+                        help='seed the random streams of replicates spawn '
+                        'from')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='amount of simulations run in parallel')
+    parser.add_argument('--store', metavar='DIR',
+                        help='keep the statistics and herds of every '
+                        'replicate in memory-mapped arrays in DIR, a '
+                        'directory per scenario')
+    parser.add_argument('--result-cache', metavar='DIR',
+                        help='take runs from the result cache in DIR if they '
+                        'were simulated before, and store them there')
+    parser.add_argument('--result-cache-size', type=float,
+                        default=cr.DEFAULT_CACHE_SIZE, metavar='MB',
+                        help='size limit of the result cache')
+    args = parser.parse_args()
+    args.metrics = args.metrics or DEFAULT_METRICS
+    for metric in args.metrics:
+        summary, _, column = metric.partition(':')
+        if summary not in SUMMARIES or column not in\
+                [*gd.results.columns, HERD_SIZE]:
+            parser.error(f'unknown metric {metric}, give one of '
+                         f'{", ".join(SUMMARIES)}, a colon and a statistics '
+                         f'column or {HERD_SIZE}')
+    if not 0 < args.confidence < 1:
+        parser.error('the confidence level must lie between 0 and 1')
+    return args
+
+
+def measure(statistics, herd_sizes, metrics):
+    """
+    Summarize a run by its metrics.
+
+    Parameters
+    ----------
+    statistics : np.ndarray
+        (years x statistics columns) the statistics of every year simulated.
+    herd_sizes : np.ndarray
+        The herd size at the end of every year simulated.
+    metrics : list
+        Metrics written as 'summary:column'.
+
+    Returns
+    -------
+    values : np.ndarray
+        Value of every metric.
+
+    """
+    columns = list(gd.results.columns)
+    values = np.zeros(len(metrics))
+    for index, metric in enumerate(metrics):
+        summary, _, column = metric.partition(':')
+        if column == HERD_SIZE:
+            yearly = herd_sizes
+        else:
+            yearly = statistics[:, columns.index(column)]
+        if summary == 'mean':
+            values[index] = yearly.mean()
+        elif summary == 'sum':
+            values[index] = yearly.sum()
+        else:
+            values[index] = yearly[-1]
+    return values
+
+
+def init_worker(input_sheets, metrics, seeding, stores, result_cache):
+    """
+    Set up a worker process with the scenarios to simulate replicates of.
+
+    Parameters
+    ----------
+    input_sheets : list
+        Input sheets of every scenario.
+    metrics : list
+        Metrics written as 'summary:column'.
+    seeding : tuple
+        Whether replicates are paired antithetically, and the seed.
+    stores : list
+        Directory of the store of every scenario, empty without stores.
+    result_cache : tuple
+        Directory and size limit in MB of the result cache, see
+        cache_functions.use_cache.
+
+    Returns
+    -------
+    None.
+
+    """
+    global scenario_sheets, worker_metrics, worker_seeding
+    scenario_sheets = input_sheets
+    worker_metrics = metrics
+    worker_seeding = seeding
+    en.use_stores(stores)
+    cr.use_cache(*result_cache)
+
+
+def run_replicates(scenario, replicates):
+    """
+    Simulate replicates of a scenario, in a worker process.
+
+    Each replicate gets folded into a summary of its statistics and herd size
+    in every year, and then dropped.
+
+    Parameters
+    ----------
+    scenario : int
+        Index of the scenario.
+    replicates : list
+        Numbers of the replicates.
+
+    Returns
+    -------
+    values : np.ndarray
+        (replicates x metrics) value of every metric in every replicate, or
+        None when the replicates were written to the store of the scenario.
+    summary : aggregate_functions.YearlySummary
+        Summary of the yearly statistics and herd size of the replicates.
+
+    """
+    antithetic, seed = worker_seeding
+    values = []
+    summary = None
+    for replicate in replicates:
+        results = fs.run_scenario(scenario_sheets[scenario],
+                                  replicate=replicate, antithetic=antithetic,
+                                  seed=seed)
+        herd_sizes = gd.herd_results.sum(axis=1).to_numpy()[:len(results)]
+        yearly = np.column_stack([results.to_numpy(), herd_sizes])
+        if summary is None:
+            summary = ag.YearlySummary(yearly.shape)
+        summary.add(yearly)
+        if en.open_stores:
+            en.write_replicate(scenario, replicate, results, gd.herd_results)
+        else:
+            values.append(measure(yearly[:, :-1], herd_sizes, worker_metrics))
+    if en.open_stores:
+        return None, summary
+    return np.array(values), summary
+
+
+def estimate_precision(values, antithetic, confidence):
+    """
+    Estimate the mean of every metric and the half-width of its interval.
+
+    The interval uses the normal distribution, which is why a few replicates
+    get simulated before the first check. An antithetic pair counts as one
+    observation, the mean of both replicates.
+
+    Parameters
+    ----------
+    values : np.ndarray
+        (replicates x metrics) value of every metric in every replicate.
+    antithetic : bool
+        Replicates are paired antithetically.
+    confidence : float
+        Confidence level of the intervals.
+
+    Returns
+    -------
+    mean : np.ndarray
+        Mean of every metric.
+    half_width : np.ndarray
+        Half-width of the confidence interval of every mean, infinite with
+        less than two observations.
+
+    """
+    if antithetic:
+        values = values.reshape(-1, 2, values.shape[1]).mean(axis=1)
+    mean = values.mean(axis=0)
+    if len(values) < 2:
+        return mean, np.full(len(mean), np.inf)
+    z_score = NormalDist().inv_cdf(0.5 + confidence / 2)
+    half_width = z_score * values.std(axis=0, ddof=1) / np.sqrt(len(values))
+    return mean, half_width
+
+
+def mk_targets(mean, tolerance, absolute_tolerance):
+    """
+    Determine the half-width every metric has to get within.
+
+    Parameters
+    ----------
+    mean : np.ndarray
+        Mean of every metric.
+    tolerance : float
+        Largest half-width, as part of the mean.
+    absolute_tolerance : float
+        Half-width that is always narrow enough.
+
+    Returns
+    -------
+    np.ndarray
+        Largest half-width of every metric.
+
+    """
+    return np.maximum(tolerance * np.abs(mean), absolute_tolerance)
+
+
+def run_ensemble(scenarios, args, stores=None):
+    """
+    Simulate replicates of every scenario until it is precise or its budget
+    is spent.
+
+    Every round adds a batch of replicates to each scenario still going, all
+    simulated side by side on a process pool. The batch is split over the
+    workers, which summarize the replicates they simulate; their summaries
+    are merged into the summary of the scenario.
+
+    Parameters
+    ----------
+    scenarios : dict
+        Input sheets by scenario name.
+    args : argparse.Namespace
+        Metrics and ensemble settings.
+    stores : dict, optional
+        Directory of the store by scenario name. Each gets allocated for the
+        replicate budget, and the workers write the replicates into it.
+
+    Returns
+    -------
+    values : dict
+        (replicates x metrics) value of every metric in every replicate, by
+        scenario name.
+    stops : dict
+        Why the scenario got no more replicates by scenario name, a key of
+        STOP_REASONS.
+    summaries : dict
+        Summary of the yearly statistics and herd size of all replicates by
+        scenario name, see aggregate_functions.YearlySummary.
+
+    """
+    names = list(scenarios)
+    # Antithetic pairs are never split over batches.
+    step = 2 if args.antithetic else 1
+    batch_size = -(-max(args.batch_size or args.workers, 1) // step) * step
+    first_batch = -(-max(args.min_replicates, 2 * step) // step) * step
+    budget = -(-max(args.max_replicates, first_batch) // step) * step
+    values = {name: np.zeros((0, len(args.metrics))) for name in names}
+    summaries = dict.fromkeys(names)
+    stops = {}
+    hits = 0
+    runs = 0
+    seeding = (args.antithetic, args.seed)
+    stores = stores or {}
+    arrays = {}
+    for name, directory in stores.items():
+        gd.setup(scenarios[name])
+        en.create_store(directory, budget, name, seeding)
+        arrays[name] = en.open_store(directory)
+    result_cache = (cr.cache_dir, cr.max_bytes / 2 ** 20)
+    with ProcessPoolExecutor(args.workers, initializer=init_worker,
+                             initargs=(list(scenarios.values()), args.metrics,
+                                       seeding, list(stores.values()),
+                                       result_cache)) as executor:
+        while len(stops) < len(names):
+            running = {}
+            for scenario, name in enumerate(names):
+                if name in stops:
+                    continue
+                done = len(values[name])
+                size = min(first_batch if done == 0 else batch_size,
+                           budget - done)
+                if cr.cache_dir:
+                    for replicate in range(done, done + size):
+                        al.seed_run(replicate, args.antithetic, args.seed)
+                        hits += cr.cached(cr.run_key(scenarios[name]))
+                chunk_size = -(-size // args.workers)
+                for start in range(done, done + size, chunk_size):
+                    replicates = list(range(start, min(start + chunk_size,
+                                                       done + size)))
+                    future = executor.submit(run_replicates, scenario,
+                                             replicates)
+                    running[future] = (name, replicates)
+                runs += size
+            batch = {}
+            for future in as_completed(running):
+                name, replicates = running[future]
+                try:
+                    chunk_values, summary = future.result()
+                except Exception as error:
+                    if name not in stops:
+                        print(f'could not simulate replicates {replicates[0]}'
+                              f' to {replicates[-1]} of {name}: {error}')
+                    stops[name] = 'failed'
+                    continue
+                if name in arrays:
+                    chunk_values = np.array([measure(
+                        arrays[name]['statistics'][replicate],
+                        arrays[name]['herds'][replicate].sum(axis=1),
+                        args.metrics) for replicate in replicates])
+                batch[name, replicates[0]] = (chunk_values, summary)
+            for name in names:
+                if name in stops:
+                    continue
+                for chunk_values, summary in [batch[key] for key in
+                                              sorted(batch) if key[0] == name]:
+                    values[name] = np.vstack([values[name], chunk_values])
+                    if summaries[name] is None:
+                        summaries[name] = summary
+                    else:
+                        summaries[name].merge(summary)
+                if name in stores:
+                    en.count_replicates(stores[name], len(values[name]))
+                mean, half_width = estimate_precision(
+                    values[name], args.antithetic, args.confidence)
+                targets = mk_targets(mean, args.tolerance,
+                                     args.absolute_tolerance)
+                print(f'{name}: {len(values[name])} replicates, ' +
+                      ', '.join(f'{metric} {value:.6g} +/- {width:.3g}'
+                                for metric, value, width in
+                                zip(args.metrics, mean, half_width)))
+                if (half_width <= targets).all():
+                    stops[name] = 'precise'
+                elif len(values[name]) >= budget:
+                    stops[name] = 'budget'
+    if cr.cache_dir:
+        cr.report_hits(hits, runs)
+    return values, stops, summaries
+
+
+def mk_store_dirs(input_files, store_dir):
+    """
+    Name the store directory of every scenario.
+
+    Parameters
+    ----------
+    input_files : list
+        Names of the input files.
+    store_dir : str
+        Directory the stores are made in.
+
+    Returns
+    -------
+    store_dirs : dict
+        Directory of the store by input file.
+
+    """
+    store_dirs = {input_file: os.path.join(store_dir, name)
+                  for input_file, name in sb.mk_unique_stems(
+                      input_files).items()}
+    return store_dirs
+
+
+def mk_precision_table(values, stops, args):
+    """
+    Tabulate the stopping decision and the precision reached per scenario.
+
+    Parameters
+    ----------
+    values : dict
+        (replicates x metrics) value of every metric in every replicate, by
+        scenario name.
+    stops : dict
+        Why the scenario got no more replicates by scenario name.
+    args : argparse.Namespace
+        Metrics and ensemble settings.
+
+    Returns
+    -------
+    precision : pd.DataFrame
+        One row per scenario and metric with the replicates simulated, why
+        they stopped, the mean, the half-width of its confidence interval,
+        the half-width aimed for and whether it was reached.
+
+    """
+    rows = []
+    for name, scenario_values in values.items():
+        if len(scenario_values):
+            mean, half_width = estimate_precision(
+                scenario_values, args.antithetic, args.confidence)
+        else:
+            mean = half_width = np.full(len(args.metrics), np.nan)
+        targets = mk_targets(mean, args.tolerance, args.absolute_tolerance)
+        for metric, value, width, target in zip(args.metrics, mean,
+                                                half_width, targets):
+            rows.append({'scenario': name, 'metric': metric,
+                         'replicates': len(scenario_values),
+                         'stop': stops[name], 'mean': value,
+                         'half_width': width, 'target': target,
+                         'precise': bool(width <= target)})
+    precision = pd.DataFrame(rows)
+    return precision
+
+
+def mk_summary_table(summaries):
+    """
+    Tabulate the yearly summaries of all scenarios.
+
+    Parameters
+    ----------
+    summaries : dict
+        Summary of the yearly statistics and herd size of all replicates by
+        scenario name, None for scenarios without replicates.
+
+    Returns
+    -------
+    summary_table : pd.DataFrame
+        One row per scenario, year and statistics column (or herd size) with
+        its unit, mean, variance and quantiles over all replicates.
+
+    """
+    columns = [*gd.results.columns, HERD_SIZE]
+    units = [*gd.results.loc['unit'], en.HERD_UNIT]
+    tables = []
+    for name, summary in summaries.items():
+        if summary is None:
+            continue
+        years = len(summary.mean)
+        cells = {'scenario': name,
+                 'year': np.repeat(np.arange(1, years + 1), len(columns)),
+                 'column': np.tile(columns, years),
+                 'unit': np.tile(units, years),
+                 'replicates': summary.count,
+                 'mean': summary.mean.ravel(),
+                 'variance': summary.variance().ravel()}
+        for probability, quantile in zip(ag.QUANTILES, summary.quantiles()):
+            cells[f'p{probability * 100:g}'] = quantile.ravel()
+        tables.append(pd.DataFrame(cells))
+    summary_table = pd.concat(tables, ignore_index=True) if tables else\
+        pd.DataFrame()
+    return summary_table
+
+
+def report_precision(precision, confidence):
+    """
+    Print the stopping decision and the precision reached per scenario.
+
+    Parameters
+    ----------
+    precision : pd.DataFrame
+        Precision table, see mk_precision_table.
+    confidence : float
+        Confidence level of the intervals.
+
+    Returns
+    -------
+    None.
+
+    """
+    for name, rows in precision.groupby('scenario', sort=False):
+        first = rows.iloc[0]
+        print(f'\n{name}: stopped after {first["replicates"]} replicates, '
+              f'{STOP_REASONS[first["stop"]]}')
+        for row in rows.itertuples():
+            print(f'  {row.metric}: {row.mean:.6g} +/- {row.half_width:.3g} '
+                  f'at {confidence:.0%} confidence (aimed for '
+                  f'+/- {row.target:.3g})')
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    cr.use_cache(args.result_cache, args.result_cache_size)
+    input_files = sb.find_input_files(args.inputs)
+    print(f'{len(input_files)} input files found')
+    scenarios = {}
+    for input_file in input_files:
+        try:
+            scenarios[input_file] = gd.read_input(input_file)
+        except Exception as error:
+            print(f'could not read {input_file}: {error}')
+    if not scenarios:
+        raise SystemExit('no scenarios to simulate')
+    stores = mk_store_dirs(list(scenarios), args.store) if args.store else\
+        None
+    values, stops, summaries = run_ensemble(scenarios, args, stores)
+    precision = mk_precision_table(values, stops, args)
+    report_precision(precision, args.confidence)
+
+    timestamp = dt.datetime.now()
+    timestamp = timestamp.strftime('%Y-%m-%d_%H.%M.%S')
+    output_name = f'squire_ensemble_{timestamp}.xlsx'
+    replicates = pd.concat(
+        [pd.DataFrame(scenario_values, columns=args.metrics).rename_axis(
+            'replicate').reset_index() for scenario_values in values.values()],
+        keys=list(values), names=['scenario', None])
+    replicates = replicates.reset_index(level=0)
+    with pd.ExcelWriter(output_name) as writer:
+        precision.to_excel(writer, sheet_name='precision', index=False)
+        replicates.to_excel(writer, sheet_name='replicates', index=False)
+        mk_summary_table(summaries).to_excel(writer, sheet_name='yearly',
+                                             index=False)
+    if args.store:
+        print(f'replicates stored in {args.store}')
+    print(f'\nensemble done, check {output_name}')
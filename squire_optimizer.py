@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Author: Siebrant Hendriks.
+
+Search the farm plan that maximizes the cumulative revenue of farm squire.
+
+Chosen input fields (e.g. crop ratios, the initial herd or the maximum
+digestate spreadable) are optimized within their ranges by differential
+evolution, while the nitrogen balance has to stay non-negative in every year.
+Each generation of candidate plans is simulated in parallel on a process pool
+and every plan that was already simulated is taken from a result cache (see
+sweep_functions). A candidate's run is stopped at the first year it breaks a
+constraint, such plans are ranked by how early they fail.
+"""
+import os
+import argparse
+import datetime as dt
+import numpy as np
+import pandas as pd
+import global_data as gd
+import sweep_functions as sw
+import farm_squire as fs
+
+# Summed over all years these make up the revenue that gets maximized.
+OBJECTIVE_COLUMNS = ['revenue_balance_animal', 'revenue_balance_crops']
+# These may not become negative in any year.
+CONSTRAINT_COLUMNS = ['nitrogen_balance']
+# Input properties that only take whole numbers.
+INTEGER_PROPERTIES = ['initial_animal_count']
+
+
+def parse_arguments():
+    """
+    Read the command line options.
+
+    Returns
+    -------
+    args : argparse.Namespace
+        Contains the input file name, parameter file and optimizer settings.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='Optimize the farm plan of farm squire.')
+    parser.add_argument('input_file', help='input workbook')
+    parser.add_argument('parameter_file',
+                        help='csv file with columns parameter, low and high')
+    parser.add_argument('--population', type=int, default=16,
+                        help='candidate plans per generation')
+    parser.add_argument('--generations', type=int, default=30)
+    parser.add_argument('--mutation', type=float, default=0.7,
+                        help='differential weight of the mutation')
+    parser.add_argument('--crossover', type=float, default=0.9,
+                        help='chance a field is taken from the mutation')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='amount of simulations run in parallel')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the search')
+    parser.add_argument('--cache', metavar='FILE',
+                        help='keep simulated plans in FILE, to skip them '
+                        'when the optimizer is run again')
+    args = parser.parse_args()
+    return args
+
+
+def breaks_constraints():
+    """
+    Check if the year that was just simulated breaks a constraint.
+
+    Returns
+    -------
+    bool
+        True if a constraint column is negative, False if not.
+
+    """
+    year_results = gd.results.loc[f'year_{gd.year}', CONSTRAINT_COLUMNS]
+    return bool((year_results.astype('float') < 0).any())
+
+
+def evaluate_plan(values):
+    """
+    Simulate a candidate plan until it ends or breaks a constraint.
+
+    Parameters
+    ----------
+    values : tuple
+        Value of each optimized input field in this plan.
+
+    Returns
+    -------
+    score : tuple
+        (years short, deficit, negative revenue); lower is better. Years
+        short counts the years the run did not complete without breaking a
+        constraint, deficit is the amount the constraints were broken by in
+        the year it failed. Both are 0 for feasible plans, and the revenue is
+        only scored for those.
+
+    """
+    results = fs.run_scenario(sw.point_sheets(values),
+                              stop=breaks_constraints)
+    if breaks_constraints():
+        years_short = int(gd.estate_values['runtime']) - gd.year + 1
+        deficit = -results[CONSTRAINT_COLUMNS].iloc[-1].clip(upper=0).sum()
+        score = (years_short, float(deficit), 0.0)
+    else:
+        revenue = results[OBJECTIVE_COLUMNS].to_numpy().sum()
+        score = (0, 0.0, -float(revenue))
+    return score
+
+
+def mk_bounds(parameters):
+    """
+    Get the search range of every field.
+
+    Parameters
+    ----------
+    parameters : pd.DataFrame
+        Low and high value by input field.
+
+    Returns
+    -------
+    low : np.ndarray
+        Lowest value of each field.
+    high : np.ndarray
+        Highest value of each field.
+    integer : np.ndarray
+        True for fields that only take whole numbers.
+
+    """
+    low = parameters['low'].to_numpy()
+    high = parameters['high'].to_numpy()
+    integer = np.array([gd.split_field(field)[1] in INTEGER_PROPERTIES
+                        for field in parameters.index])
+    return low, high, integer
+
+
+def fit_bounds(points, low, high, integer):
+    """
+    Bring points within the search range, rounding whole number fields.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        (points x fields) matrix of candidate plans.
+    low : np.ndarray
+        Lowest value of each field.
+    high : np.ndarray
+        Highest value of each field.
+    integer : np.ndarray
+        True for fields that only take whole numbers.
+
+    Returns
+    -------
+    points : np.ndarray
+        The fitted points.
+
+    """
+    points = np.clip(points, low, high)
+    points[:, integer] = np.clip(np.round(points[:, integer]),
+                                 np.ceil(low[integer]),
+                                 np.floor(high[integer]))
+    return points
+
+
+def mk_population(parameters, size, rng):
+    """
+    Make the first generation of candidate plans.
+
+    The current input file is included as a plan (brought within range), so
+    the best plan found is never worse than it when it is feasible.
+
+    Parameters
+    ----------
+    parameters : pd.DataFrame
+        Low and high value by input field.
+    size : int
+        Amount of candidate plans.
+    rng : np.random.Generator
+        Random number generator used for the plans.
+
+    Returns
+    -------
+    population : np.ndarray
+        (size x fields) matrix of candidate plans.
+
+    """
+    low, high, integer = mk_bounds(parameters)
+    population = low + rng.random((size, len(parameters))) * (high - low)
+    input_sheets = gd.get_input_sheets()
+    population[0] = [gd.get_input_value(input_sheets, field)
+                     for field in parameters.index]
+    population = fit_bounds(population, low, high, integer)
+    return population
+
+
+def mk_trials(population, parameters, mutation, crossover, rng):
+    """
+    Make a trial plan for every plan in the population (DE/rand/1/bin).
+
+    Parameters
+    ----------
+    population : np.ndarray
+        (size x fields) matrix of candidate plans.
+    parameters : pd.DataFrame
+        Low and high value by input field.
+    mutation : float
+        Differential weight of the mutation.
+    crossover : float
+        Chance a field is taken from the mutation.
+    rng : np.random.Generator
+        Random number generator used for the trials.
+
+    Returns
+    -------
+    trials : np.ndarray
+        (size x fields) matrix of trial plans.
+
+    """
+    size, n_fields = population.shape
+    trials = population.copy()
+    for member in range(size):
+        others = [other for other in range(size) if other != member]
+        base, plus, minus = population[rng.choice(others, 3, replace=False)]
+        mutant = base + mutation * (plus - minus)
+        crossed = rng.random(n_fields) < crossover
+        crossed[rng.integers(n_fields)] = True
+        trials[member, crossed] = mutant[crossed]
+    trials = fit_bounds(trials, *mk_bounds(parameters))
+    return trials
+
+
+def mk_score_table(scores, index):
+    """
+    Make a readable table of plan scores.
+
+    Parameters
+    ----------
+    scores : list
+        Score of every plan, as made by evaluate_plan.
+    index : pd.Index
+        Index of the table.
+
+    Returns
+    -------
+    table : pd.DataFrame
+        Years short, deficit and revenue of every plan; the revenue is empty
+        for plans that break a constraint.
+
+    """
+    table = pd.DataFrame(scores, index=index,
+                         columns=['years_short', 'deficit', 'revenue'])
+    table['revenue'] = -table['revenue']
+    table.loc[table['years_short'] > 0, 'revenue'] = np.nan
+    return table
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    gd.use_input_file(args.input_file)
+    parameters = sw.read_parameters(args.parameter_file)
+    fields = list(parameters.index)
+    rng = np.random.default_rng(args.seed)
+    cache = sw.load_cache(args.cache, fields, evaluate_plan)
+
+    population = mk_population(parameters, args.population, rng)
+    scores = sw.evaluate_points(evaluate_plan, population, fields,
+                                args.workers, cache, args.cache)
+    # Plans of this run, the cache may hold plans of earlier runs as well.
+    evaluated = dict.fromkeys(tuple(plan) for plan in population.tolist())
+    progress = []
+    best_scores = []
+    for generation in range(args.generations + 1):
+        if generation > 0:
+            trials = mk_trials(population, parameters, args.mutation,
+                               args.crossover, rng)
+            trial_scores = sw.evaluate_points(evaluate_plan, trials, fields,
+                                              args.workers, cache, args.cache)
+            evaluated.update(dict.fromkeys(tuple(plan)
+                                           for plan in trials.tolist()))
+            for member, trial_score in enumerate(trial_scores):
+                if trial_score <= scores[member]:
+                    population[member] = trials[member]
+                    scores[member] = trial_score
+        best = min(range(len(scores)), key=scores.__getitem__)
+        feasible = sum(score[0] == 0 for score in scores)
+        progress.append([generation, feasible])
+        best_scores.append(scores[best])
+        print(f'generation {generation}: {feasible} feasible plans, best '
+              f'score {scores[best]}\n')
+
+    best_plan = parameters.copy()
+    input_sheets = gd.get_input_sheets()
+    best_plan['input_file'] = [gd.get_input_value(input_sheets, field)
+                               for field in fields]
+    best_plan['best'] = population[best]
+    progress = pd.DataFrame(progress, columns=['generation', 'feasible'])
+    progress = progress.join(mk_score_table(best_scores, progress.index))
+    plans = list(evaluated)
+    evaluated = pd.DataFrame(plans, columns=fields)
+    evaluated = evaluated.join(mk_score_table([cache[plan] for plan in plans],
+                                              evaluated.index))
+
+    timestamp = dt.datetime.now()
+    timestamp = timestamp.strftime('%Y-%m-%d_%H.%M.%S')
+    output_name = f'squire_optimum_{timestamp}.xlsx'
+    with pd.ExcelWriter(output_name) as writer:
+        best_plan.to_excel(writer, sheet_name='best plan')
+        progress.to_excel(writer, sheet_name='progress', index=False)
+        evaluated.to_excel(writer, sheet_name='evaluated plans')
+    if scores[best][0] > 0:
+        print('no plan was found that keeps the constraints in every year')
+    print(f'optimization done, check {output_name}')
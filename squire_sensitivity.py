@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Author: Siebrant Hendriks.
+
+Global sensitivity analysis of farm squire results to its input fields.
+
+Sample designs (Sobol/Saltelli or Morris) are generated over chosen input
+fields with ranges. The points are simulated in parallel batches on a process
+pool, where points that were already simulated are taken from a result cache
+(see sweep_functions). Each run is summarized by the mean of every statistics
+column over all years.
+"""
+import os
+import argparse
+import datetime as dt
+import numpy as np
+import pandas as pd
+import global_data as gd
+import sweep_functions as sw
+import farm_squire as fs
+import cache_functions as cr
+
+
+def parse_arguments():
+    """
+    Read the command line options.
+
+    Returns
+    -------
+    args : argparse.Namespace
+        Contains the input file name, parameter file and analysis settings.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='Global sensitivity analysis of farm squire results.')
+    parser.add_argument('input_file', help='input workbook')
+    parser.add_argument('parameter_file',
+                        help='csv file with columns parameter, low and high')
+    parser.add_argument('--method', choices=['sobol', 'morris'],
+                        default='sobol')
+    parser.add_argument('--samples', type=int, default=64,
+                        help='base samples (sobol) or trajectories (morris)')
+    parser.add_argument('--levels', type=int, default=4,
+                        help='grid levels of the morris design')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='amount of simulations run in parallel')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the sample design')
+    parser.add_argument('--cache', metavar='FILE',
+                        help='keep simulated points in FILE, to skip them '
+                        'when the analysis is run again')
+    parser.add_argument('--result-cache', metavar='DIR',
+                        help='take runs from the result cache in DIR if they '
+                        'were simulated before, and store them there')
+    parser.add_argument('--result-cache-size', type=float,
+                        default=cr.DEFAULT_CACHE_SIZE, metavar='MB',
+                        help='size limit of the result cache')
+    args = parser.parse_args()
+    return args
+
+
+def mk_sobol_design(parameters, n_base, rng):
+    """
+    Make the Saltelli sample design used to estimate Sobol indices.
+
+    Parameters
+    ----------
+    parameters : pd.DataFrame
+        Low and high value by input field.
+    n_base : int
+        Amount of base samples.
+    rng : np.random.Generator
+        Random number generator used for the samples.
+
+    Returns
+    -------
+    points : np.ndarray
+        (n_base * (fields + 2) x fields) matrix of points to simulate; first
+        matrix A, then matrix B, then for every field A with that field's
+        column taken from B.
+
+    """
+    n_fields = len(parameters)
+    low = parameters['low'].to_numpy()
+    span = parameters['high'].to_numpy() - low
+    a_matrix = low + rng.random((n_base, n_fields)) * span
+    b_matrix = low + rng.random((n_base, n_fields)) * span
+    blocks = [a_matrix, b_matrix]
+    for field in range(n_fields):
+        ab_matrix = a_matrix.copy()
+        ab_matrix[:, field] = b_matrix[:, field]
+        blocks.append(ab_matrix)
+    points = np.vstack(blocks)
+    return points
+
+
+def mk_morris_design(parameters, n_trajectories, levels, rng):
+    """
+    Make the one-at-a-time trajectories of a Morris design.
+
+    Parameters
+    ----------
+    parameters : pd.DataFrame
+        Low and high value by input field.
+    n_trajectories : int
+        Amount of trajectories.
+    levels : int
+        Amount of grid levels each field can take.
+    rng : np.random.Generator
+        Random number generator used for the samples.
+
+    Returns
+    -------
+    points : np.ndarray
+        (n_trajectories * (fields + 1) x fields) matrix of points to simulate.
+    moves : np.ndarray
+        (n_trajectories x fields) matrix with per trajectory the field
+        changed at each step; negative (-field - 1) when it decreased.
+
+    """
+    n_fields = len(parameters)
+    low = parameters['low'].to_numpy()
+    span = parameters['high'].to_numpy() - low
+    delta = levels / (2 * (levels - 1))
+    grid = np.arange(levels) / (levels - 1)
+    points = []
+    moves = np.zeros((n_trajectories, n_fields), dtype='int')
+    for trajectory in range(n_trajectories):
+        unit_point = rng.choice(grid, size=n_fields)
+        points.append(low + unit_point * span)
+        for step, field in enumerate(rng.permutation(n_fields)):
+            if unit_point[field] + delta <= 1:
+                unit_point[field] += delta
+                moves[trajectory, step] = field
+            else:
+                unit_point[field] -= delta
+                moves[trajectory, step] = -field - 1
+            points.append(low + unit_point * span)
+    points = np.array(points)
+    return points, moves
+
+
+def evaluate_point(values):
+    """
+    Simulate one point of the design and summarize its results.
+
+    Parameters
+    ----------
+    values : tuple
+        Value of each varied input field at this point.
+
+    Returns
+    -------
+    summary : np.ndarray
+        Mean over all years of every statistics column.
+
+    """
+    results = fs.run_scenario(sw.point_sheets(values))
+    summary = results.mean().to_numpy()
+    return summary
+
+
+def sobol_indices(summaries, n_base, n_fields):
+    """
+    Estimate first order and total Sobol indices of a Saltelli design.
+
+    First order indices use the Saltelli (2010) estimator, total indices the
+    Jansen estimator.
+
+    Parameters
+    ----------
+    summaries : np.ndarray
+        Summarized results of all design points, in design order.
+    n_base : int
+        Amount of base samples.
+    n_fields : int
+        Amount of input fields varied.
+
+    Returns
+    -------
+    first_order : np.ndarray
+        (fields x statistics columns) first order indices.
+    total : np.ndarray
+        (fields x statistics columns) total indices.
+
+    """
+    f_a = summaries[:n_base]
+    f_b = summaries[n_base:2 * n_base]
+    variance = np.var(np.vstack([f_a, f_b]), axis=0)
+    variance[variance == 0] = np.nan
+    first_order = np.zeros((n_fields, summaries.shape[1]))
+    total = np.zeros((n_fields, summaries.shape[1]))
+    for field in range(n_fields):
+        start = (field + 2) * n_base
+        f_ab = summaries[start:start + n_base]
+        first_order[field] = np.mean(f_b * (f_ab - f_a), axis=0) / variance
+        total[field] = 0.5 * np.mean((f_a - f_ab) ** 2, axis=0) / variance
+    return first_order, total
+
+
+def morris_indices(summaries, moves, levels):
+    """
+    Calculate Morris elementary effect statistics.
+
+    Parameters
+    ----------
+    summaries : np.ndarray
+        Summarized results of all design points, in design order.
+    moves : np.ndarray
+        (trajectories x fields) matrix with per trajectory the field changed
+        at each step; negative (-field - 1) when it decreased.
+    levels : int
+        Amount of grid levels each field could take.
+
+    Returns
+    -------
+    mu : np.ndarray
+        (fields x statistics columns) mean elementary effects.
+    mu_star : np.ndarray
+        (fields x statistics columns) mean absolute elementary effects.
+    sigma : np.ndarray
+        (fields x statistics columns) standard deviation of the effects.
+
+    """
+    n_trajectories, n_fields = moves.shape
+    delta = levels / (2 * (levels - 1))
+    effects = np.zeros((n_trajectories, n_fields, summaries.shape[1]))
+    for trajectory in range(n_trajectories):
+        start = trajectory * (n_fields + 1)
+        for step in range(n_fields):
+            move = moves[trajectory, step]
+            field = move if move >= 0 else -move - 1
+            change = summaries[start + step + 1] - summaries[start + step]
+            if move < 0:
+                change = -change
+            # Effects are per whole field range, so fields of any unit can
+            # be compared.
+            effects[trajectory, field] = change / delta
+    mu = effects.mean(axis=0)
+    mu_star = np.abs(effects).mean(axis=0)
+    sigma = effects.std(axis=0, ddof=1) if n_trajectories > 1 else\
+        np.zeros_like(mu)
+    return mu, mu_star, sigma
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    gd.use_input_file(args.input_file)
+    cr.use_cache(args.result_cache, args.result_cache_size)
+    parameters = sw.read_parameters(args.parameter_file)
+    fields = list(parameters.index)
+    columns = gd.results.columns
+    rng = np.random.default_rng(args.seed)
+    cache = sw.load_cache(args.cache, fields, evaluate_point)
+
+    if args.method == 'sobol':
+        points = mk_sobol_design(parameters, args.samples, rng)
+    else:
+        points, moves = mk_morris_design(parameters, args.samples,
+                                         args.levels, rng)
+    summaries = np.array(sw.evaluate_points(evaluate_point, points, fields,
+                                            args.workers, cache, args.cache))
+    if args.method == 'sobol':
+        first_order, total = sobol_indices(summaries, args.samples,
+                                           len(fields))
+        indices = {'first_order': first_order, 'total': total}
+    else:
+        mu, mu_star, sigma = morris_indices(summaries, moves, args.levels)
+        indices = {'mu_star': mu_star, 'mu': mu, 'sigma': sigma}
+
+    timestamp = dt.datetime.now()
+    timestamp = timestamp.strftime('%Y-%m-%d_%H.%M.%S')
+    output_name = f'squire_sensitivity_{timestamp}.xlsx'
+    with pd.ExcelWriter(output_name) as writer:
+        for name, values in indices.items():
+            table = pd.DataFrame(values, index=fields, columns=columns)
+            table.to_excel(writer, sheet_name=name)
+        parameters.to_excel(writer, sheet_name='parameters')
+        design = pd.DataFrame(points, columns=fields)
+        design = design.join(pd.DataFrame(summaries, columns=columns))
+        design.to_excel(writer, sheet_name='design')
+    print(f'sensitivity analysis done, check {output_name}')
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+Author: Siebrant Hendriks.
+
+Keep farm squire running to simulate scenarios on request.
+
+The server keeps the input sheets of every scenario it has read in memory,
+keyed by their fingerprint, and simulates runs of them on a process pool that
+stays warm between requests. It speaks JSON over HTTP, either on a local TCP
+port or on a Unix socket:
+
+GET /health
+    {"status": "ok", "scenarios": n, "running": n}
+GET /scenarios
+    {"scenarios": [fingerprint, ...], "default": fingerprint}
+POST /scenarios {"input_file": "input.xlsx"}
+    Reads an input file, answers {"scenario": fingerprint}.
+POST /runs {"scenario": fingerprint, "overrides": {field: value},
+            "run_id": "any"}
+    Simulates a run, all keys are optional. Answers {"run_id": ...,
+    "scenario": ..., "statistics": {"columns", "index", "data"}} once done.
+DELETE /runs/<run_id>
+    Cancels a run that is waiting or being simulated; the request of the run
+    is then answered with status 409.
+
+Requests beyond the concurrency limit are answered with status 503.
+"""
+import os
+import json
+import uuid
+import signal
+import argparse
+import threading
+import socketserver
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import global_data as gd
+import farm_squire as fs
+import checkpoint_functions as cp
+
+# Input sheets by scenario fingerprint, and the fingerprint of the input file
+# the server was started with.
+scenarios = {}
+default_scenario = None
+scenarios_lock = threading.Lock()
+# Runs waiting or being simulated, by run id.
+runs = {}
+runs_lock = threading.Lock()
+run_slots = None
+executor = None
+# Ids of cancelled runs, shared with the worker processes.
+cancelled_runs = None
+
+
+def parse_arguments():
+    """
+    Read the command line options.
+
+    Returns
+    -------
+    args : argparse.Namespace
+        Contains the input file name and server settings.
+
+    """
+    parser = argparse.ArgumentParser(
+        description='Simulate farm squire scenarios on request.')
+    parser.add_argument('input_file', nargs='?', default=gd.FILENAME,
+                        help='input workbook of the default scenario')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='TCP port to listen on')
+    parser.add_argument('--socket', metavar='PATH',
+                        help='listen on a Unix socket at PATH instead of a '
+                        'TCP port')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='amount of runs simulated in parallel')
+    parser.add_argument('--max-requests', type=int, default=None,
+                        help='amount of runs waiting or being simulated at '
+                        'once, twice the workers by default')
+    args = parser.parse_args()
+    return args
+
+
+def init_worker(cancelled):
+    """
+    Set up a worker process.
+
+    Parameters
+    ----------
+    cancelled : multiprocessing.managers.DictProxy
+        Ids of cancelled runs.
+
+    Returns
+    -------
+    None.
+
+    """
+    global cancelled_runs
+    cancelled_runs = cancelled
+
+
+def simulate_run(input_sheets, run_id):
+    """
+    Simulate a run, inside a worker process.
+
+    Parameters
+    ----------
+    input_sheets : dict
+        Contains the estate, crops, animal and biodigestor sheets of the run.
+    run_id : str
+        Id of the run, the run stops after the year it got cancelled in.
+
+    Returns
+    -------
+    statistics : str or None
+        JSON of the statistics of every year simulated, in the split
+        orientation of pd.DataFrame.to_json. None when the run got cancelled.
+
+    """
+    results = fs.run_scenario(input_sheets,
+                              stop=lambda: run_id in cancelled_runs)
+    if run_id in cancelled_runs:
+        return None
+    statistics = results.to_json(orient='split')
+    return statistics
+
+
+def stop_server(signum, frame):
+    """
+    Stop serving when the server gets terminated, like on Ctrl+C.
+
+    Parameters
+    ----------
+    signum : int
+        Number of the signal received.
+    frame : frame
+        Frame that was running when the signal came in.
+
+    Raises
+    ------
+    KeyboardInterrupt
+        Always, to leave serve_forever.
+
+    Returns
+    -------
+    None.
+
+    """
+    raise KeyboardInterrupt
+
+
+def add_scenario(input_sheets):
+    """
+    Keep the input sheets of a scenario.
+
+    Parameters
+    ----------
+    input_sheets : dict
+        Contains the estate, crops, animal and biodigestor sheets as they are
+        in the input file.
+
+    Returns
+    -------
+    fingerprint : str
+        Key of the scenario.
+
+    """
+    fingerprint = cp.input_fingerprint(input_sheets)
+    with scenarios_lock:
+        scenarios.setdefault(fingerprint, input_sheets)
+    return fingerprint
+
+
+def check_run_request(request):
+    """
+    Check the scenario and overrides of a requested run.
+
+    Parameters
+    ----------
+    request : dict
+        Optionally contains the scenario, overrides and run_id of the run.
+
+    Returns
+    -------
+    error : str
+        What is wrong with the request, None if nothing.
+
+    """
+    if not isinstance(request.get('scenario', ''), str):
+        return 'scenario must be a fingerprint'
+    overrides = request.get('overrides', {})
+    if not isinstance(overrides, dict):
+        return 'overrides must be an object of fields and values'
+    for field, value in overrides.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return f'override of {field} must be a number'
+    return None
+
+
+def run(request):
+    """
+    Simulate a requested run.
+
+    Parameters
+    ----------
+    request : dict
+        Optionally contains the scenario, overrides and run_id of the run.
+
+    Returns
+    -------
+    status : int
+        HTTP status of the answer.
+    answer : dict
+        Statistics of the run, or the error.
+
+    """
+    error = check_run_request(request)
+    if error:
+        return 400, {'error': error}
+    run_id = str(request.get('run_id') or uuid.uuid4().hex)
+    scenario = request.get('scenario', default_scenario)
+    with scenarios_lock:
+        input_sheets = scenarios.get(scenario)
+    if input_sheets is None:
+        return 404, {'error': f'unknown scenario {scenario}'}
+    try:
+        input_sheets = gd.override_input(input_sheets,
+                                         request.get('overrides', {}))
+    except ValueError as error:
+        return 400, {'error': str(error)}
+    if not run_slots.acquire(blocking=False):
+        return 503, {'error': 'too many runs, try again later'}
+    with runs_lock:
+        if run_id in runs:
+            run_slots.release()
+            return 409, {'error': f'run {run_id} is already running'}
+        future = executor.submit(simulate_run, input_sheets, run_id)
+        runs[run_id] = future
+    try:
+        try:
+            statistics = future.result()
+        except CancelledError:
+            statistics = None
+        except Exception as error:
+            return 500, {'error': f'run {run_id} failed: {error}'}
+        if statistics is None:
+            return 409, {'error': f'run {run_id} was cancelled'}
+        answer = {'run_id': run_id, 'scenario': scenario,
+                  'statistics': json.loads(statistics)}
+        return 200, answer
+    finally:
+        with runs_lock:
+            runs.pop(run_id, None)
+        cancelled_runs.pop(run_id, None)
+        run_slots.release()
+
+
+def cancel(run_id):
+    """
+    Cancel a run that is waiting or being simulated.
+
+    Parameters
+    ----------
+    run_id : str
+        Id of the run.
+
+    Returns
+    -------
+    status : int
+        HTTP status of the answer.
+    answer : dict
+        The cancelled run, or the error.
+
+    """
+    with runs_lock:
+        future = runs.get(run_id)
+        if future is None:
+            return 404, {'error': f'no run {run_id}'}
+        cancelled_runs[run_id] = True
+        future.cancel()
+    return 200, {'cancelled': run_id}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Request handler answers the requests of one connection.
+
+    Attribues:
+    ----------
+    See http.server.BaseHTTPRequestHandler.
+    """
+
+    def answer(self, status, answer):
+        """
+        Send an answer as JSON.
+
+        Parameters
+        ----------
+        status : int
+            HTTP status of the answer.
+        answer : dict
+            Content of the answer.
+
+        Returns
+        -------
+        None.
+        """
+        body = json.dumps(answer).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_request(self):
+        """
+        Read the JSON content of a request.
+
+        Returns
+        -------
+        request : dict
+            Content of the request, empty when there is none.
+
+        Raises
+        ------
+        ValueError
+            If the content is no JSON object.
+        """
+        length = int(self.headers.get('Content-Length', 0))
+        if length == 0:
+            return {}
+        request = json.loads(self.rfile.read(length))
+        if not isinstance(request, dict):
+            raise ValueError('the request must be an object')
+        return request
+
+    def do_GET(self):
+        """Answer health and scenario listings."""
+        if self.path == '/health':
+            with runs_lock:
+                running = len(runs)
+            self.answer(200, {'status': 'ok', 'scenarios': len(scenarios),
+                              'running': running})
+        elif self.path == '/scenarios':
+            with scenarios_lock:
+                fingerprints = list(scenarios)
+            self.answer(200, {'scenarios': fingerprints,
+                              'default': default_scenario})
+        else:
+            self.answer(404, {'error': f'no such path {self.path}'})
+
+    def do_POST(self):
+        """Answer requests to read a scenario or simulate a run."""
+        try:
+            request = self.read_request()
+        except ValueError as error:
+            self.answer(400, {'error': f'invalid JSON: {error}'})
+            return
+        if self.path == '/runs':
+            self.answer(*run(request))
+        elif self.path == '/scenarios':
+            try:
+                input_sheets = gd.read_input(request['input_file'])
+            except (KeyError, OSError, ValueError) as error:
+                self.answer(400, {'error': f'could not read input file: '
+                                           f'{error}'})
+                return
+            self.answer(200, {'scenario': add_scenario(input_sheets)})
+        else:
+            self.answer(404, {'error': f'no such path {self.path}'})
+
+    def do_DELETE(self):
+        """Answer requests to cancel a run."""
+        if self.path.startswith('/runs/'):
+            self.answer(*cancel(self.path[len('/runs/'):]))
+        else:
+            self.answer(404, {'error': f'no such path {self.path}'})
+
+    def log_message(self, format, *args):
+        """Print a line per request, also when served on a Unix socket."""
+        print(format % args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    """
+    HTTP server on a Unix socket, handling every connection in a thread.
+
+    Attribues:
+    ----------
+    See socketserver.UnixStreamServer.
+    """
+
+    daemon_threads = True
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    default_scenario = add_scenario(gd.read_input(args.input_file))
+    run_slots = threading.BoundedSemaphore(args.max_requests or
+                                           2 * args.workers)
+    manager = multiprocessing.Manager()
+    cancelled_runs = manager.dict()
+    executor = ProcessPoolExecutor(args.workers, initializer=init_worker,
+                                   initargs=(cancelled_runs,))
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, RequestHandler)
+        print(f'serving on {args.socket}')
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), RequestHandler)
+        print(f'serving on http://{args.host}:{args.port}')
+    signal.signal(signal.SIGTERM, stop_server)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('shutting down')
+    finally:
+        server.server_close()
+        executor.shutdown(cancel_futures=True)
+        manager.shutdown()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
@@ -0,0 +1,119 @@
+"""
+Author: Siebrant Hendriks.
+
+Supplementary script for keeping the stores of the farm
+
+The stores of every material in the material registry are kept in one buffer
+that is allocated once per simulation and refilled at the start of every year.
+All stages of the year withdraw from it in place, and the amount each stage
+took is kept.
+"""
+import numpy as np
+import pandas as pd
+import global_data as gd
+
+# Stages of the year that withdraw from the stores, in order.
+STAGES = ['bedding', 'feed', 'digestor', 'mulch', 'sale']
+
+
+class HarvestStores:
+    """
+    Harvest stores keeps the Kg amount in store of every material on the farm.
+
+    Attribues:
+    ----------
+    harvest : np.ndarray
+        Kg amount of every material harvested each year.
+    amounts : np.ndarray
+        Kg amount of every material in store.
+    stock : pd.Series
+        The amounts in store by material, sharing its data with amounts.
+    withdrawals : np.ndarray
+        (stages x materials) Kg amount each stage withdrew this year.
+    saved_amounts : np.ndarray
+        Amounts in store at the last checkpoint.
+    saved_withdrawals : np.ndarray
+        Withdrawals at the last checkpoint.
+    """
+
+    def __init__(self):
+        self.harvest = gd.harvest_yield.reindex(gd.materials, fill_value=0)
+        self.harvest = self.harvest.to_numpy(dtype='float')
+        self.amounts = np.empty(len(gd.materials))
+        self.stock = pd.Series(self.amounts, index=gd.materials, copy=False)
+        self.withdrawals = np.empty((len(STAGES), len(gd.materials)))
+        self.saved_amounts = np.empty_like(self.amounts)
+        self.saved_withdrawals = np.empty_like(self.withdrawals)
+        self.restock()
+
+    def restock(self):
+        """
+        Fill the stores with this year's harvest and clear the withdrawals.
+
+        None of the animal matter is in store yet.
+
+        Returns
+        -------
+        None.
+        """
+        self.amounts[:] = self.harvest
+        self.withdrawals[:] = 0.0
+
+    def deposit(self, material, amount):
+        """
+        Set the Kg amount in store of a material.
+
+        Parameters
+        ----------
+        material : str
+            Name of the material, as in gd.materials.
+        amount : float
+            Kg amount put in store.
+
+        Returns
+        -------
+        None.
+        """
+        self.amounts[gd.materials.get_loc(material)] = amount
+
+    def withdraw(self, stage, used):
+        """
+        Take the amounts used by a stage out of the stores.
+
+        Parameters
+        ----------
+        stage : str
+            Name of the stage, one of STAGES.
+        used : pd.Series
+            Kg amount used of some of the materials.
+
+        Returns
+        -------
+        None.
+        """
+        positions = gd.materials.get_indexer(used.index)
+        used = used.to_numpy(dtype='float')
+        self.amounts[positions] -= used
+        self.withdrawals[STAGES.index(stage), positions] += used
+
+    def checkpoint(self):
+        """
+        Remember the stores and withdrawals, to roll back to.
+
+        Returns
+        -------
+        None.
+        """
+        self.saved_amounts[:] = self.amounts
+        self.saved_withdrawals[:] = self.withdrawals
+
+    def rollback(self):
+        """
+        Undo all withdrawals since the last checkpoint.
+
+        Returns
+        -------
+        None.
+        """
+        self.amounts[:] = self.saved_amounts
+        self.withdrawals[:] = self.saved_withdrawals
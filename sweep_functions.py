@@ -0,0 +1,225 @@
+"""
+Author: Siebrant Hendriks.
+
+Supplementary script for simulating farm squire at many input points
+
+An input point gives a value to each of a chosen set of input fields, written
+as 'estate:property' or 'sheet:property:item' (see global_data.override_input).
+Points are simulated in parallel batches on a process pool, and a result cache
+makes sure every distinct point is only simulated once. A cache file is only
+reused by the same runner, on the same input data, fields and version of the
+simulation. Runs can also be taken
+from the on-disk result cache shared by all runners (see cache_functions).
+"""
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import global_data as gd
+import utility_functions as ul
+import checkpoint_functions as cp
+import cache_functions as cr
+
+# Input sheets every worker process starts its runs from, and the input
+# fields the values of a point belong to.
+base_sheets = None
+base_fields = None
+
+
+def read_parameters(filename):
+    """
+    Read the input fields to vary and their ranges.
+
+    Parameters
+    ----------
+    filename : str
+        Name of a csv file with columns parameter, low and high. Parameters
+        are input fields written as 'estate:property' or
+        'sheet:property:item'.
+
+    Returns
+    -------
+    parameters : pd.DataFrame
+        Low and high value by input field.
+
+    """
+    parameters = pd.read_csv(filename, index_col='parameter')
+    parameters = parameters[['low', 'high']].astype('float')
+    # Fail early on misspelled fields instead of in every worker.
+    gd.override_input(gd.get_input_sheets(), dict(parameters['low'].items()))
+    return parameters
+
+
+def mk_cache_setup(fields, evaluate):
+    """
+    Describe what the results in a cache file were made from.
+
+    Parameters
+    ----------
+    fields : list
+        Input fields the values of a point belong to.
+    evaluate : function
+        Function that made the results of the points.
+
+    Returns
+    -------
+    tuple
+        Fingerprint of the input data, the fields, the engine version and
+        the name of the function.
+
+    """
+    return (cp.input_fingerprint(), tuple(fields), cr.ENGINE_VERSION,
+            evaluate.__name__)
+
+
+def load_cache(filename, fields, evaluate):
+    """
+    Load the results of previously simulated points.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the cache file, may be None or not exist yet.
+    fields : list
+        Input fields the values of a point belong to.
+    evaluate : function
+        Function that makes the results of the points.
+
+    Returns
+    -------
+    cache : dict
+        Results by point, empty when there is no cache file or it was made
+        from other input data, fields, engine version or function.
+
+    """
+    if not filename or not os.path.exists(filename):
+        return {}
+    with open(filename, 'rb') as cache_file:
+        cache = pickle.load(cache_file)
+    if not isinstance(cache, dict) or\
+            cache.get('setup') != mk_cache_setup(fields, evaluate):
+        print(f'{filename} was made for another analysis, input file or '
+              'version, starting an empty cache')
+        return {}
+    return cache['points']
+
+
+def init_worker(input_sheets, fields, result_cache):
+    """
+    Set up a worker process with the input sheets to start runs from.
+
+    Parameters
+    ----------
+    input_sheets : dict
+        Contains the estate, crops, animal and biodigestor sheets as they are
+        in the input file.
+    fields : list
+        Input fields the values of a point belong to.
+    result_cache : tuple
+        Directory and size limit in MB of the result cache, see
+        cache_functions.use_cache.
+
+    Returns
+    -------
+    None.
+
+    """
+    global base_sheets, base_fields
+    base_sheets = input_sheets
+    base_fields = fields
+    cr.use_cache(*result_cache)
+
+
+def count_cached(points, fields):
+    """
+    Count the points of which the run is in the result cache.
+
+    Parameters
+    ----------
+    points : list
+        Values of the input fields of every point.
+    fields : list
+        Input fields the values of a point belong to.
+
+    Returns
+    -------
+    hits : int
+        Amount of points that will be taken from the result cache.
+
+    """
+    input_sheets = gd.get_input_sheets()
+    hits = sum(cr.cached(cr.run_key(gd.override_input(
+        input_sheets, dict(zip(fields, values))))) for values in points)
+    return hits
+
+
+def point_sheets(values):
+    """
+    Make the input sheets of a point, inside a worker process.
+
+    Parameters
+    ----------
+    values : tuple
+        Value of each input field of the point.
+
+    Returns
+    -------
+    input_sheets : dict
+        Copy of the worker's input sheets with the values filled in.
+
+    """
+    input_sheets = gd.override_input(base_sheets,
+                                     dict(zip(base_fields, values)))
+    return input_sheets
+
+
+def evaluate_points(evaluate, points, fields, workers, cache, cache_file=None):
+    """
+    Simulate all points, skipping points already in the cache.
+
+    Parameters
+    ----------
+    evaluate : function
+        Takes the values of a point and returns its result. Runs in a worker
+        process, so it must be defined at module level.
+    points : np.ndarray
+        (points x fields) matrix of points to simulate.
+    fields : list
+        Input fields the columns of points belong to.
+    workers : int
+        Amount of simulations run in parallel.
+    cache : dict
+        Results by point, gets extended in place.
+    cache_file : str, optional
+        Name of the file the cache gets saved to after every batch.
+
+    Returns
+    -------
+    results : list
+        Result of every point, in the order of points.
+
+    """
+    keys = [tuple(point) for point in points.tolist()]
+    todo = list(dict.fromkeys(key for key in keys if key not in cache))
+    print(f'{len(keys)} points, {len(set(keys))} distinct, '
+          f'{len(todo)} to simulate')
+    if todo and cr.cache_dir:
+        cr.report_hits(count_cached(todo, fields), len(todo))
+    if todo:
+        batch_size = workers * 8
+        result_cache = (cr.cache_dir, cr.max_bytes / 2 ** 20)
+        with ProcessPoolExecutor(workers, initializer=init_worker,
+                                 initargs=(gd.get_input_sheets(), fields,
+                                           result_cache)) as executor:
+            for start in range(0, len(todo), batch_size):
+                batch = todo[start:start + batch_size]
+                chunksize = max(len(batch) // workers, 1)
+                cache.update(zip(batch, executor.map(evaluate, batch,
+                                                     chunksize=chunksize)))
+                if cache_file:
+                    ul.write_atomic(cache_file, pickle.dumps(
+                        {'setup': mk_cache_setup(fields, evaluate),
+                         'points': cache}))
+                print(f'simulated {start + len(batch)} of {len(todo)} points')
+    results = [cache[key] for key in keys]
+    return results
@@ -0,0 +1,156 @@
+"""
+Author: Siebrant Hendriks.
+
+Supplementary script for tracing the herd and feed decisions of a run
+
+When tracing is started every decision gets recorded as a typed event in a
+ring buffer allocated once, so the last events of even a very long run are
+kept in fixed memory. Without tracing, recording an event only checks one
+flag. The trace is written as JSON lines, or as a compact numpy archive.
+"""
+import json
+import numpy as np
+import global_data as gd
+
+# Kinds of events, with the reasons they can have.
+EVENT_KINDS = ['slaughter', 'cull', 'cull_failed', 'tier_escalation',
+               'grass_cap', 'diet_failure']
+REASONS = ['', 'max_age', 'not_pregnant', 'male_surplus', 'stocking',
+           'bedding', 'feed']
+
+# Default amount of events kept in the ring buffer.
+DEFAULT_TRACE_SIZE = 100000
+
+# Layout of an event: the year, the kind, reason and label as codes, the
+# amount of animals or times and a value (Kg, or the tier).
+EVENT_TYPE = np.dtype([('year', 'i4'), ('kind', 'u1'), ('reason', 'u1'),
+                       ('label', 'i2'), ('count', 'i4'), ('value', 'f8')])
+
+# Ring buffer of events, None while not tracing; the amount of events
+# recorded in total and the labels by code.
+events = None
+recorded = 0
+labels = []
+label_codes = {}
+
+
+def start_trace(size=DEFAULT_TRACE_SIZE):
+    """
+    Start recording events, in an empty ring buffer.
+
+    Parameters
+    ----------
+    size : int, optional
+        Amount of events kept, older events get overwritten.
+
+    Returns
+    -------
+    None.
+
+    """
+    global events, recorded, labels, label_codes
+    events = np.zeros(size, dtype=EVENT_TYPE)
+    recorded = 0
+    labels = ['']
+    label_codes = {'': 0}
+
+
+def record(kind, label='', count=1, value=0.0, reason=''):
+    """
+    Record an event of the current year, if tracing.
+
+    Events involving no animals or times are left out.
+
+    Parameters
+    ----------
+    kind : str
+        Kind of event, one of EVENT_KINDS.
+    label : str, optional
+        Animal type or crop the event is about.
+    count : int, optional
+        Amount of animals or times involved.
+    value : float, optional
+        Kg amount or tier involved.
+    reason : str, optional
+        Why it happened, one of REASONS.
+
+    Returns
+    -------
+    None.
+
+    """
+    global recorded
+    if events is None or count == 0:
+        return
+    code = label_codes.get(label)
+    if code is None:
+        code = label_codes[label] = len(labels)
+        labels.append(label)
+    events[recorded % len(events)] = (gd.year, EVENT_KINDS.index(kind),
+                                      REASONS.index(reason), code, count,
+                                      value)
+    recorded += 1
+
+
+def tracing():
+    """
+    Check if events get recorded.
+
+    Returns
+    -------
+    bool
+        True while tracing.
+
+    """
+    return events is not None
+
+
+def kept_events():
+    """
+    Get the events kept in the ring buffer, oldest first.
+
+    Returns
+    -------
+    np.ndarray
+        Events of EVENT_TYPE.
+
+    """
+    if recorded <= len(events):
+        return events[:recorded]
+    start = recorded % len(events)
+    return np.concatenate([events[start:], events[:start]])
+
+
+def write_trace(path):
+    """
+    Write the events kept to a file.
+
+    Files ending in .npz get the events as a numpy structured array next to
+    the kinds, reasons and labels their codes refer to; any other file gets
+    one JSON object per event.
+
+    Parameters
+    ----------
+    path : str
+        Name of the file to write.
+
+    Returns
+    -------
+    None.
+
+    """
+    kept = kept_events()
+    if path.endswith('.npz'):
+        np.savez_compressed(path, events=kept, kinds=EVENT_KINDS,
+                            reasons=REASONS, labels=labels)
+    else:
+        with open(path, 'w') as trace_file:
+            for event in kept.tolist():
+                year, kind, reason, label, count, value = event
+                trace_file.write(json.dumps(
+                    {'year': year, 'event': EVENT_KINDS[kind],
+                     'reason': REASONS[reason], 'label': labels[label],
+                     'count': count, 'value': value}) + '\n')
+    dropped = recorded - len(kept)
+    print(f'{len(kept)} events written to {path}' +
+          (f', {dropped} older events dropped' if dropped else ''))
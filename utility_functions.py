@@ -3,10 +3,95 @@ Author: Siebrant Hendriks.
 
 Supplementary script for uncategorized functions
 """
+import os
+import tempfile
+import numpy as np
 import pandas as pd
 import global_data as gd
 import animal_lifecycle_functions as al
 
+# Reports that leave out the materials of which nothing was used, and reports
+# that output the materials not considered in a year as 0.
+REPORTS_DROP_EMPTY = ['feed_used']
+REPORTS_FILL_ZERO = ['digestor_used', 'mulch_used']
+
+
+def allocate(amounts, budget, costs=1.0):
+    """
+    Allocate ordered amounts against a budget, first come first served.
+
+    Every amount is taken in full while the budget lasts, the amount the
+    budget runs out on is taken in part, and all amounts after it are left.
+
+    Parameters
+    ----------
+    amounts : pd.Series
+        Amounts that can be taken, in order of preferred use.
+    budget : float
+        Total cost that can be spent on the amounts.
+    costs : pd.Series or float, optional
+        Cost per unit of each amount, in the same order as amounts.
+        The default is 1.0.
+
+    Returns
+    -------
+    allocation : pd.Series
+        The part of each amount that is taken.
+    budget_left : float
+        Budget left after the last amount, 0 if it ran out.
+
+    """
+    amount = amounts.to_numpy(dtype='float')
+    cost = np.broadcast_to(np.asarray(costs, dtype='float'), amount.shape)
+    spent = amount * cost
+    # Budget left before each amount; subtracted one by one so it rounds the
+    # same as a running budget would.
+    left = np.subtract.accumulate(np.concatenate([[budget], spent]))
+    budget_left = max(left[-1], 0.0)
+    left = left[:-1]
+    # The first amount is always looked at, later ones only while there is
+    # budget left.
+    taken = left > 0
+    taken[:1] = True
+    spent_here = np.clip(left, 0.0, spent)
+    partial = (spent_here < spent) & taken
+    allocation = np.divide(spent_here, cost, out=amount.copy(), where=partial)
+    allocation[~taken] = 0.0
+    if partial.any():
+        # Taking part of an amount can leave a rounding crumb of budget,
+        # which goes to the amounts after it like a running budget would.
+        cut = np.flatnonzero(partial)[0]
+        crumb = left[cut] - allocation[cut] * cost[cut]
+        if crumb > 0 and cut + 1 < len(amount):
+            tail, budget_left = allocate(amounts.iloc[cut + 1:], crumb,
+                                         cost[cut + 1:])
+            allocation[cut + 1:] = tail.to_numpy()
+    allocation = pd.Series(allocation, index=amounts.index)
+    return allocation, budget_left
+
+
+def select_materials(harvest_stores, use):
+    """
+    Select the materials in store that can be put to a use.
+
+    Parameters
+    ----------
+    harvest_stores : pd.Series
+        Kg amount in store of every material in the material registry.
+    use : str
+        Name of the use, a column of gd.material_uses.
+
+    Returns
+    -------
+    selected : pd.Series
+        Kg amount in store of the materials for the use that are in store, in
+        registry order.
+
+    """
+    in_store = harvest_stores.to_numpy() > 0
+    selected = harvest_stores[gd.material_uses[use].to_numpy() & in_store]
+    return selected
+
 
 def assign_bedding(harvest_stores, animals_on_farm):
     """
@@ -15,7 +100,7 @@ def assign_bedding(harvest_stores, animals_on_farm):
     Parameters
     ----------
     harvest_stores : pd.Series
-        Contains all harvested crops and their stored amounts.
+        Kg amount in store of every material in the material registry.
     animals_on_farm : pd.Series
         Keeps track of which animals are on the farm and in what amount they
         are present.
@@ -27,23 +112,14 @@ def assign_bedding(harvest_stores, animals_on_farm):
         used thusly.
 
     """
-    bedding_crops = harvest_stores.where(gd.plant_data['bedding_use'] == True)
-    bedding_crops = bedding_crops.where(bedding_crops > 0)
-    bedding_crops.dropna(inplace=True)
+    bedding_crops = select_materials(harvest_stores, 'bedding_use')
     bedding_crops.sort_values(ascending=False, inplace=True)
     bedding_per_head = gd.estate_values['bedding_required']
     bedding_needed = sum(animals_on_farm) * bedding_per_head
-    bedding_used = pd.Series(0.0, index=bedding_crops.index)
-    for label, amount in bedding_crops.items():
-        amount = min(amount, bedding_needed)
-        bedding_used[label] += amount
-        bedding_crops[label] -= amount
-        bedding_needed -= amount
-        if bedding_needed <= 0:
-            break
+    bedding_used, bedding_needed = allocate(bedding_crops, bedding_needed)
     # If not enough bedding available, reduce herd and try again.
     if bedding_needed > 0:
-        al.reduce_animal(animals_on_farm)
+        al.reduce_animal(animals_on_farm, 'bedding')
         bedding_used = assign_bedding(harvest_stores, animals_on_farm)
     return bedding_used
 
@@ -67,60 +143,10 @@ def apply_stocking_limits(animals_on_farm):
     herd_size = sum(animals_on_farm * gd.animal_data['livestock_units'])
     can_support = gd.livestock_units_max
     while herd_size > can_support:
-        al.reduce_animal(animals_on_farm)
+        al.reduce_animal(animals_on_farm, 'stocking')
         herd_size = sum(animals_on_farm * gd.animal_data['livestock_units'])
 
 
-def fixate_fm(harvest_stores):
-    """
-    Apply the fixation of fertile molecules by crops to the farmland.
-
-    Parameters
-    ----------
-    harvest_stores : pd.Series
-        Contains all harvested crops and their stored amounts.
-
-    Returns
-    -------
-    None;
-    Extratedted fertile molecules get added to global variables.
-
-    """
-    phosphorus = sum(harvest_stores * gd.plant_data['P_fixation'])
-    nitrogen = sum(harvest_stores * gd.plant_data['N_fixation'])
-    gd.fertile_molecules['phosphorus'] += phosphorus
-    gd.fertile_molecules['nitrogen'] += nitrogen
-
-
-def extract_fm(biopro_use):
-    """
-    Extract fertile molecules from the matter send to the bioprocessor.
-
-    Parameters
-    ----------
-    biopro_use : pd.Series
-        Contains all matter types used by the bioprocessor, and the Kg amounts
-        in which they are being used for the bioprocessor.
-
-    Returns
-    -------
-    None;
-    Extratedted fertile molecules get added to global variables.
-
-    """
-    for label, amount in biopro_use.items():
-        if label in ['chicken_manure', 'horse_manure', 'deep_litter']:
-            gd.fertile_molecules['phosphorus'] += amount *\
-                gd.estate_values[f'{label}_P_content']
-            gd.fertile_molecules['nitrogen'] += amount * 0.52 *\
-                gd.estate_values[f'{label}_N_content']
-        else:
-            gd.fertile_molecules['phosphorus'] += amount *\
-                gd.plant_data['P_content'].loc[label]
-            gd.fertile_molecules['nitrogen'] += amount * 0.52 *\
-                gd.plant_data['N_content'].loc[label]
-
-
 def fertilize_fm():
     """
     Reduce nitrogen and phosphorus stores by fertilizing farmland.
@@ -160,7 +186,7 @@ def select_cash_crops(harvest_stores):
     Parameters
     ----------
     harvest_stores : pd.Series
-        Contains all harvested crops and their stored amounts.
+        Kg amount in store of every material in the material registry.
 
     Returns
     -------
@@ -168,38 +194,10 @@ def select_cash_crops(harvest_stores):
         Contains all crops designated to be sold.
 
     """
-    cash_crops = harvest_stores.where(gd.plant_data['sale_use'] == True)
-    cash_crops = cash_crops.where(cash_crops > 0)
-    cash_crops.dropna(inplace=True)
+    cash_crops = select_materials(harvest_stores, 'sale_use')
     return cash_crops
 
 
-def apply_cash_crop_yield(cash_crops):
-    """
-    Apply sale results of all cash crops.
-
-    Parameters
-    ----------
-    cash_crops : pd.Series
-        Contains all crops designated to be sold.
-
-    Returns
-    -------
-    None;
-    All sale results get added to global variables.
-
-    """
-    for label, amount in cash_crops.items():
-        revenue = gd.plant_data['sale_value'].loc[label] * amount
-        Kcal = gd.plant_data['food_energy_content'].loc[label] * amount
-        fat = gd.plant_data['food_fat_content'].loc[label] * amount
-        prot = gd.plant_data['food_protein_content'].loc[label] * amount
-        gd.results['revenue_balance_crops'].loc[f'year_{gd.year}'] += revenue
-        gd.results['food_energy_produced'].loc[f'year_{gd.year}'] += Kcal
-        gd.results['food_fat_produced'].loc[f'year_{gd.year}'] += fat
-        gd.results['food_protein_produced'].loc[f'year_{gd.year}'] += prot
-
-
 def apply_crop_balance():
     """
     Apply flat yearly operation costs/profits of crops.
@@ -234,43 +232,17 @@ def apply_digestion_methane_emission(animals_on_farm):
         sum(animals_on_farm * gd.animal_data['digestion_methane_emission'])
 
 
-def apply_manure(manure):
-    """
-    Apply nitrogen and phosphorus yield from manure.
-
-    Parameters
-    ----------
-    manure : pd.Series
-        Kg amount of manure prduced for each animal type on farm.
-
-    Returns
-    -------
-    None;
-    Nitrogen and phosphorus yields get added to golbal variables.
-
-    """
-    nitrogen = sum(gd.animal_data['manure_nitrogen_content'] * manure) * 0.63
-    phosphorus = sum(gd.animal_data['manure_phosphorus_content'] * manure)
-    methane = sum(gd.animal_data['manure_methane_content'] * manure)
-    gd.results['manure_methane_emissions'].loc[f'year_{gd.year}'] += methane
-    gd.fertile_molecules['nitrogen'] += nitrogen
-    gd.fertile_molecules['phosphorus'] += phosphorus
-
-
-def select_mulch(harvest_stores, biomatter_available, biomatter_use):
+def select_mulch(harvest_stores):
     """
     Select which biomatter will be applied as mulch.
 
+    All mulch crops left in store are applied, together with the deep litter
+    the bioprocessor left.
+
     Parameters
     ----------
     harvest_stores : pd.Series
-        Contains all harvested crops and their stored amounts.
-    biomatter_available :  pd.Series
-        Contains matter types suitable for bioprocessor and their Kg amount.
-        Series is ordered to have preferred matter appear first.
-    biomatter_use : pd.Series
-        Contains matter types suitable for bioprocessor and their Kg amount
-        that will be used by the bioprocessor.
+        Kg amount in store of every material in the material registry.
 
     Returns
     -------
@@ -279,46 +251,13 @@ def select_mulch(harvest_stores, biomatter_available, biomatter_use):
         they will be applied.
 
     """
-    mulch = harvest_stores.where(gd.plant_data['mulch_use'] == True)
-    mulch = mulch.where(mulch > 0)
-    mulch.dropna(inplace=True)
-    deep_litter = biomatter_available['deep_litter'] -\
-        biomatter_use['deep_litter']
-    deep_litter = {'deep_litter': deep_litter}
-    deep_litter = pd.Series(deep_litter)
-    mulch = pd.concat([mulch, deep_litter])
+    in_store = harvest_stores.to_numpy() > 0
+    mulch = gd.material_uses['mulch_use'].to_numpy() & in_store
+    mulch[gd.materials.get_loc('deep_litter')] = True
+    mulch = harvest_stores[mulch]
     return mulch
 
 
-def apply_mulch(mulch):
-    """
-    Apply soil nutrient yield generated by mulching.
-
-    Parameters
-    ----------
-    mulch : pd.Series
-        Contains matter types suitable for mulching and the Kg amounts in which
-        they will be applied.
-
-    Returns
-    -------
-    None;
-    All yeilds get added to global variables.
-
-    """
-    for label, amount in mulch.items():
-        if label == 'deep_litter':
-            nitrogen = gd.estate_values[f'{label}_N_content'] * 0.7 * amount
-            phosphorus = gd.estate_values[f'{label}_P_content'] * amount
-            gd.fertile_molecules['nitrogen'] += nitrogen
-            gd.fertile_molecules['phosphorus'] += phosphorus
-        else:
-            nitrogen = gd.plant_data['N_content'].loc[label] * 0.8 * amount
-            phosphorus = gd.plant_data['P_content'].loc[label] * amount
-            gd.fertile_molecules['nitrogen'] += nitrogen
-            gd.fertile_molecules['phosphorus'] += phosphorus
-
-
 def apply_animal_balance(animals_on_farm):
     """
     Apply costs and profits from having animals on the farm.
@@ -379,6 +318,58 @@ def apply_digestate():
     gd.results['revenue_balance_crops'].loc[f'year_{gd.year}'] -= cost
 
 
+def report_and_wipe_slaughter(animals_on_farm):
+    """
+    Report herd kept and animals slaughtered this year, and wipe for new year.
+
+    Parameters
+    ----------
+    animals_on_farm : pd.Series
+        Keeps track of which animals are on the farm and in what amount they
+        are present.
+
+    Returns
+    -------
+    None;
+    Global data gets altered in place.
+
+    """
+    herd = animals_on_farm.copy()
+    herd.name = f'year_{gd.year}'
+    gd.herd_year_end.append(herd)
+    slaughtered = gd.slaughter_count.copy()
+    slaughtered.name = f'year_{gd.year}'
+    gd.animals_slaughtered.append(slaughtered)
+    gd.slaughter_count[:] = 0
+
+
+def write_report(report, order, used):
+    """
+    Write this year's row of a report.
+
+    Parameters
+    ----------
+    report : np.ndarray
+        (runtime x materials) Kg amounts of the report.
+    order : np.ndarray
+        Rank in which each material first appeared in the report, -1 if it
+        has not yet.
+    used : pd.Series
+        Kg amount of the materials considered this year.
+
+    Returns
+    -------
+    None;
+    Report and order are altered in place.
+
+    """
+    positions = gd.materials.get_indexer(used.index)
+    report[gd.year - 1, positions] = used.to_numpy(dtype='float')
+    new = positions[order[positions] < 0]
+    first_rank = np.count_nonzero(order >= 0)
+    order[new] = np.arange(first_rank, first_rank + len(new))
+
+
 def report_bedding(bedding):
     """
     Report bedding use.
@@ -395,8 +386,7 @@ def report_bedding(bedding):
     Results get added to global variables.
 
     """
-    bedding.name = f'year {gd.year}'
-    gd.bedding_used.append(bedding.copy())
+    write_report(gd.bedding_used, gd.report_order['bedding_used'], bedding)
 
 
 def report_feed(feed_use):
@@ -414,8 +404,7 @@ def report_feed(feed_use):
     Results get added to global variables.
 
     """
-    feed_use.name = f'year {gd.year}'
-    gd.feed_used.append(feed_use.copy())
+    write_report(gd.feed_used, gd.report_order['feed_used'], feed_use)
 
 
 def report_sold(cash_crops):
@@ -433,8 +422,7 @@ def report_sold(cash_crops):
     Results get added to global variables.
 
     """
-    cash_crops.name = f'year {gd.year}'
-    gd.crops_sold.append(cash_crops.copy())
+    write_report(gd.crops_sold, gd.report_order['crops_sold'], cash_crops)
 
 
 def report_digestor(biomatter_use):
@@ -453,8 +441,8 @@ def report_digestor(biomatter_use):
     Results get added to global variables.
 
     """
-    biomatter_use.name = f'year {gd.year}'
-    gd.digestor_used.append(biomatter_use.copy())
+    write_report(gd.digestor_used, gd.report_order['digestor_used'],
+                 biomatter_use)
 
 
 def report_mulch(mulch):
@@ -473,27 +461,126 @@ def report_mulch(mulch):
     Results get added to global variables.
 
     """
-    mulch.name = f'year {gd.year}'
-    gd.mulch_used.append(mulch.copy())
+    write_report(gd.mulch_used, gd.report_order['mulch_used'], mulch)
 
 
-def drop_empty_columns(dataframe):
+def report_positions(name):
     """
-    Drop columns that are empty from dataframe.
+    Determine which materials of a report are output, and in what order.
+
+    Materials that never appeared in the report are left out, and the
+    materials that did are put in the order they first appeared in. Of the
+    feed report the materials of which nothing was used are left out as well.
 
     Parameters
     ----------
-    dataframe : pd.Dataframe
-        Any dataframe.
+    name : str
+        Name of the report, as in gd.report_order.
 
     Returns
     -------
-    None;
-    Edit is done inplace.
+    positions : np.ndarray
+        Positions in gd.materials of the materials to output.
 
     """
-    empty_columns = []
-    for column in dataframe.columns:
-        if sum(dataframe[column]) == 0:
-            empty_columns.append(column)
-    dataframe.drop(empty_columns, axis=1, inplace=True)
+    order = gd.report_order[name]
+    keep = order >= 0
+    if name in REPORTS_DROP_EMPTY:
+        keep &= np.nansum(getattr(gd, name)[:gd.year], axis=0) != 0
+    positions = np.flatnonzero(keep)
+    positions = positions[np.argsort(order[positions])]
+    return positions
+
+
+def report_values(name, years, positions):
+    """
+    Get the reported amounts of some years for output.
+
+    Parameters
+    ----------
+    name : str
+        Name of the report, as in gd.report_order.
+    years : int or slice
+        Row position of the year, or slice of them, to get.
+    positions : np.ndarray
+        Positions in gd.materials of the materials to get.
+
+    Returns
+    -------
+    values : np.ndarray
+        Kg amounts, materials not considered in a year set to the fill value
+        of the report.
+
+    """
+    values = getattr(gd, name)[years][..., positions]
+    if name in REPORTS_FILL_ZERO:
+        values = np.where(np.isnan(values), 0.0, values)
+    return values
+
+
+def report_labels():
+    """
+    Make the row labels of the reports.
+
+    Returns
+    -------
+    list
+        Label of every year simulated.
+
+    """
+    return [f'year {year}' for year in range(1, gd.year + 1)]
+
+
+def mk_report_frame(name):
+    """
+    Turn a report into a dataframe for output.
+
+    Parameters
+    ----------
+    name : str
+        Name of the report, as in gd.report_order.
+
+    Returns
+    -------
+    report_frame : pd.DataFrame
+        (years x materials) Kg amounts of every year simulated.
+
+    """
+    positions = report_positions(name)
+    report_frame = pd.DataFrame(
+        report_values(name, slice(0, gd.year), positions),
+        index=report_labels(), columns=gd.materials[positions])
+    return report_frame
+
+
+def write_atomic(path, data):
+    """
+    Write data to a file such that it is either fully replaced or untouched.
+
+    The data is written into a temporary file next to the target, which then
+    replaces the target in one step. An interrupted write thus never leaves a
+    broken file behind.
+
+    Parameters
+    ----------
+    path : str
+        Name of the file to write.
+    data : bytes
+        Content to write to the file.
+
+    Returns
+    -------
+    None.
+
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as temp_file:
+            temp_file.write(data)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
@@ -0,0 +1,229 @@
+"""
+Author: Siebrant Hendriks.
+
+Supplementary script for valuing a run's physical flows against price scenarios
+
+Once the physical flows of a run are known (harvest, labour, fuel, crops sold,
+digestate, animals slaughtered and kept), both revenue balances are linear in
+the prices and costs. Every flow is booked against the input field (price key)
+that values it, so any amount of price scenarios can be valued with a single
+matrix product instead of simulating the farm again.
+
+Price keys are written as 'sheet:property' for estate fields and as
+'sheet:property:item' for fields of a single crop or animal, e.g.
+'estate:land_rent' or 'crops:sale_value:Oat_food_grain'.
+"""
+import numpy as np
+import pandas as pd
+import global_data as gd
+import recompute_functions as rc
+
+REVENUE_COLUMNS = ['revenue_balance_crops', 'revenue_balance_animal']
+
+# Prices and costs per crop or animal, by input sheet.
+ITEM_PRICES = {'crops': ['subsidies', 'cultivation_costs',
+                         'contract_work_costs', 'sale_value'],
+               'animal': ['meat_sale_value', 'subsidies_gained']}
+ESTATE_PRICES = ['land_rent', 'regular_labour_cost', 'casual_labour_cost',
+                 'fuel_price', 'digestate_application_cost',
+                 'animal_maintenance']
+
+
+def mk_prices():
+    """
+    Get the prices and costs of the current input data.
+
+    Returns
+    -------
+    prices : pd.Series
+        Value of every price key.
+
+    """
+    prices = {}
+    for field in ESTATE_PRICES:
+        prices[f'estate:{field}'] = gd.estate_values[field]
+    for field in ITEM_PRICES['crops']:
+        for label, value in gd.plant_data[field].items():
+            prices[f'crops:{field}:{label}'] = value
+    for field in ITEM_PRICES['animal']:
+        for label, value in gd.animal_data[field].items():
+            prices[f'animal:{field}:{label}'] = value
+    prices = pd.Series(prices, dtype='float')
+    return prices
+
+
+def book(flows, key, amounts):
+    """
+    Book (add) amounts valued by the given price key to the flows.
+
+    Parameters
+    ----------
+    flows : dict
+        Yearly amounts per price key.
+    key : str
+        Price key valuing the amounts.
+    amounts : np.ndarray or float
+        Yearly amounts, costs booked as negative amounts.
+
+    Returns
+    -------
+    None;
+    Passed variable gets altered in place.
+
+    """
+    flows[key] = flows.get(key, 0.0) + amounts
+
+
+def mk_flows(ledger=None):
+    """
+    Make the physical flow ledger of both revenue balances.
+
+    Parameters
+    ----------
+    ledger : dict, optional
+        Physical trajectory of a run, as made by recompute_functions.mk_ledger.
+        Defaults to the trajectory of the run that just finished.
+
+    Returns
+    -------
+    flows : dict
+        Per revenue column a (years x price keys) dataframe with the amounts
+        each price is multiplied with. The revenue of a year is the sum of
+        its amounts times their prices.
+
+    """
+    if ledger is None:
+        ledger = rc.mk_ledger()
+    years = ledger['herd'].index
+    ones = np.ones(len(years))
+
+    # Flat yearly crop balance, booked as in global_data.
+    crop_flows = {}
+    harvest = np.floor(gd.grassland_yields + gd.cropping_yields)
+    for label, hectare in gd.harvest_ha.items():
+        book(crop_flows, f'crops:subsidies:{label}', hectare * ones)
+    book(crop_flows, 'estate:land_rent',
+         -gd.estate_values['rented_land'] * ones)
+    for label, amount in harvest.items():
+        book(crop_flows, f'crops:cultivation_costs:{label}', -amount * ones)
+        book(crop_flows, f'crops:contract_work_costs:{label}',
+             -amount * ones)
+    labour = sum(harvest * gd.plant_data['general_labour_needed'])
+    regular_labour = min(labour, gd.estate_values['max_yearly_regular_labour'])
+    book(crop_flows, 'estate:regular_labour_cost', -regular_labour * ones)
+    book(crop_flows, 'estate:casual_labour_cost',
+         -(labour - regular_labour) * ones)
+    book(crop_flows, 'estate:fuel_price', -gd.fuel_use * ones)
+    # Yearly crop sales and digestate application.
+    for label, amounts in ledger['sold'].items():
+        book(crop_flows, f'crops:sale_value:{label}', amounts.to_numpy())
+    book(crop_flows, 'estate:digestate_application_cost',
+         -ledger['digestate_produced'].to_numpy())
+
+    # Yearly slaughter yields and costs/profits of animals kept.
+    animal_flows = {}
+    herd = ledger['herd']
+    meat = ledger['slaughtered'] * gd.animal_data['slaughter_meat_yield']
+    for label, amounts in meat.items():
+        book(animal_flows, f'animal:meat_sale_value:{label}',
+             amounts.to_numpy())
+    for label, amounts in herd.items():
+        book(animal_flows, f'animal:subsidies_gained:{label}',
+             amounts.to_numpy())
+    book(animal_flows, 'estate:casual_labour_cost',
+         -(herd @ gd.animal_data['general_labour_costs']).to_numpy())
+    book(animal_flows, 'estate:animal_maintenance',
+         -(herd @ gd.animal_data['livestock_units']).to_numpy())
+
+    flows = {'revenue_balance_crops': pd.DataFrame(crop_flows, index=years),
+             'revenue_balance_animal': pd.DataFrame(animal_flows,
+                                                    index=years)}
+    return flows
+
+
+def mk_scenario_matrix(scenarios, prices):
+    """
+    Complete price scenarios with the current prices for keys not given.
+
+    Parameters
+    ----------
+    scenarios : pd.DataFrame
+        One row per scenario, one column per price key that varies.
+    prices : pd.Series
+        Value of every price key in the current input data.
+
+    Raises
+    ------
+    ValueError
+        When a scenario column is not a known price key.
+
+    Returns
+    -------
+    matrix : np.ndarray
+        (scenarios x price keys) matrix ordered like prices.
+
+    """
+    unknown = scenarios.columns.difference(prices.index)
+    if len(unknown) > 0:
+        raise ValueError(f'unknown price keys: {", ".join(unknown)}')
+    matrix = np.tile(prices.to_numpy(), (len(scenarios), 1))
+    positions = prices.index.get_indexer(scenarios.columns)
+    matrix[:, positions] = scenarios.to_numpy(dtype='float')
+    return matrix
+
+
+def value_scenarios(flows, scenarios):
+    """
+    Value the physical flows of a run against many price scenarios at once.
+
+    Parameters
+    ----------
+    flows : dict
+        Per revenue column the yearly amounts per price key, as made by
+        mk_flows.
+    scenarios : pd.DataFrame
+        One row per scenario, one column per price key that varies. Keys that
+        are not given keep their value from the current input data.
+
+    Returns
+    -------
+    revenues : pd.DataFrame
+        One row per scenario, one column per (revenue column, year).
+
+    """
+    prices = mk_prices()
+    matrix = mk_scenario_matrix(scenarios, prices)
+    # Stack both revenue columns into one (columns * years x price keys)
+    # matrix so all scenarios get valued by a single matrix product.
+    blocks = [flows[column].reindex(columns=prices.index, fill_value=0.0)
+              for column in REVENUE_COLUMNS]
+    amounts = np.vstack([block.to_numpy() for block in blocks])
+    revenues = matrix @ amounts.T
+    columns = pd.MultiIndex.from_product([REVENUE_COLUMNS,
+                                          flows[REVENUE_COLUMNS[0]].index])
+    revenues = pd.DataFrame(revenues, index=scenarios.index, columns=columns)
+    return revenues
+
+
+def write_scenario_values(scenario_file, output_name):
+    """
+    Value the finished run against the price scenarios in a csv file.
+
+    Parameters
+    ----------
+    scenario_file : str
+        Name of a csv file with one row per scenario and one column per
+        price key that varies.
+    output_name : str
+        Name of the csv file to write the yearly revenues per scenario to.
+
+    Returns
+    -------
+    None.
+
+    """
+    scenarios = pd.read_csv(scenario_file)
+    revenues = value_scenarios(mk_flows(), scenarios)
+    revenues.columns = [f'{column}:{year}' for column, year in
+                        revenues.columns]
+    revenues.to_csv(output_name, index_label='scenario')